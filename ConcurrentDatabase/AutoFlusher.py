@@ -0,0 +1,163 @@
+import threading
+import time
+
+from loguru import logger as logging
+
+
+class AutoFlusher:
+    """
+    Writes the pending changes of dirty entries on a background thread. Entries register themselves when a column is
+    assigned and every interval seconds (or as soon as max_dirty entries are waiting) the changes of every dirty
+    entry, across all tables, are written in one transaction. Registered entries are kept alive until they are
+    flushed (or dropped after max_retries failed flushes), so no change waits for longer than about one interval and
+    entries are never flushed by the garbage collector on whichever thread drops them.
+    """
+
+    def __init__(self, database, interval: float = 0.1, max_dirty: int = 500, max_retries: int = 3):
+        """
+        :param database: The database to flush entries of.
+        :param interval: The maximum number of seconds a change waits before it is written.
+        :param max_dirty: Flush straight away once this many entries are waiting.
+        :param max_retries: The number of flushes an entry that can't be written is tried again in before it is
+         dropped from the flusher, it keeps its changes and can still be flushed by the application.
+        """
+        if interval <= 0:
+            raise ValueError("interval must be greater than 0")
+        if max_dirty < 1:
+            raise ValueError("max_dirty must be at least 1")
+        self.database = database
+        self.interval = interval
+        self.max_dirty = max_dirty
+        self.max_retries = max_retries
+        self._dirty = {}  # type: dict[int, tuple]  # id of each registered entry to the entry and when it was marked
+        self._failures = {}  # type: dict[int, int]  # id of each registered entry to the number of its failed flushes
+        self._registry_lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # Only one flush runs at a time
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None  # type: threading.Thread or None
+        self._stats = {"flushes": 0, "entries": 0, "errors": 0, "dropped": 0, "last_flush": None,
+                       "last_duration": 0.0, "last_lag": 0.0, "max_lag": 0.0}
+
+    def mark_dirty(self, entry):
+        """
+        Register an entry with unwritten changes, called when a column of the entry is assigned.
+        """
+        with self._registry_lock:
+            if id(entry) not in self._dirty:
+                self._dirty[id(entry)] = (entry, time.monotonic())
+            full = len(self._dirty) >= self.max_dirty
+        if full:
+            self._wake.set()
+
+    def pending(self) -> int:
+        """
+        Get the number of entries waiting to be flushed.
+        """
+        with self._registry_lock:
+            return len(self._dirty)
+
+    def lag(self) -> float:
+        """
+        Get the number of seconds the oldest unwritten change has been waiting.
+        """
+        with self._registry_lock:
+            if not self._dirty:
+                return 0.0
+            return time.monotonic() - min(marked for _, marked in self._dirty.values())
+
+    def flush(self) -> int:
+        """
+        Write the changes of every registered entry in one transaction. If the transaction fails each entry is written
+        on its own, so one entry that can't be written doesn't hold back the others. An entry that fails stays dirty
+        and is tried again on the next flush, up to max_retries times.
+        :return: The number of entries written.
+        """
+        with self._flush_lock:
+            with self._registry_lock:
+                pending, self._dirty = self._dirty, {}
+            if not pending:
+                return 0
+            started = time.perf_counter()
+            now = time.monotonic()
+            try:
+                flushed = self.database.flush_entries(entry for entry, _ in pending.values())
+            except Exception as e:
+                self._stats["errors"] += 1
+                logging.warning(f"Unable to flush {len(pending)} entries together, writing them one by one: {e}")
+                flushed = self._flush_each(pending)
+                if not flushed:
+                    return 0
+            with self._registry_lock:
+                for key in pending:
+                    if key not in self._dirty:
+                        self._failures.pop(key, None)
+            lag = now - min(marked for _, marked in pending.values())
+            self._stats["flushes"] += 1
+            self._stats["entries"] += flushed
+            self._stats["last_flush"] = time.time()
+            self._stats["last_duration"] = time.perf_counter() - started
+            self._stats["last_lag"] = lag
+            self._stats["max_lag"] = max(self._stats["max_lag"], lag)
+            return flushed
+
+    def _flush_each(self, pending: dict) -> int:
+        """
+        Write the changes of each entry in its own transaction, entries that fail are registered again or dropped.
+        :return: The number of entries written.
+        """
+        flushed = 0
+        for key, (entry, marked) in pending.items():
+            try:
+                flushed += self.database.flush_entries([entry])
+                continue
+            except Exception as e:
+                if getattr(e, "entry", None) is entry:
+                    # A row changed by another writer is left to the application, its entry stays dirty
+                    logging.warning(f"Auto flush of {entry} conflicted with another writer: {e}")
+                    failures = self.max_retries
+                else:
+                    failures = self._failures.get(key, 0) + 1
+                    if failures >= self.max_retries:
+                        logging.error(f"Unable to flush {entry} after {failures} attempts, it is no longer "
+                                      f"auto flushed: {e}")
+            with self._registry_lock:
+                if failures < self.max_retries and entry.is_dirty():
+                    self._failures[key] = failures
+                    self._dirty.setdefault(key, (entry, marked))
+                else:
+                    self._failures.pop(key, None)
+                    self._stats["dropped"] += 1
+        return flushed
+
+    def start(self) -> "AutoFlusher":
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="auto-flush", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = None):
+        """
+        Stop the flusher thread, then write any changes that are still pending.
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+        if self.database.open:
+            self.flush()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set() or not self.database.open:
+                break
+            self.flush()
+
+    def stats(self) -> dict:
+        """
+        Get the flush counts and timings, lag is how long the oldest pending change has been waiting.
+        """
+        return dict(self._stats, pending=self.pending(), lag=self.lag())
@@ -0,0 +1,114 @@
+import os
+import sqlite3
+import threading
+import time
+
+from loguru import logger as logging
+
+
+class BackupJob:
+    """
+    Copies a database to a file a few pages at a time, releasing the database lock between each step so other queries
+    keep running while the copy is made.
+    """
+
+    def __init__(self, database, path: str, pages_per_step: int = 256, sleep: float = 0.01, progress=None):
+        """
+        :param database: The database to back up.
+        :param path: The file to write the backup to, it is replaced once the backup is complete.
+        :param pages_per_step: The number of pages copied while holding the lock.
+        :param sleep: The number of seconds to wait between steps.
+        :param progress: Called with (pages_copied, total_pages) after each step.
+        """
+        if pages_per_step < 1:
+            raise ValueError("pages_per_step must be at least 1")
+        self.database = database
+        self.path = path
+        self.pages_per_step = pages_per_step
+        self.sleep = sleep
+        self.progress_callback = progress
+        self.remaining = None  # type: int or None  # Pages left to copy
+        self.total = None  # type: int or None  # Pages in the database
+        self.steps = 0
+        self.started = None  # type: float or None
+        self.finished = None  # type: float or None
+        self.error = None  # type: Exception or None
+        self._done = threading.Event()
+        self._thread = None  # type: threading.Thread or None
+
+    @property
+    def progress(self) -> float:
+        """
+        The fraction of the database that has been copied.
+        """
+        if self._done.is_set() and self.error is None:
+            return 1.0
+        if not self.total:
+            return 0.0
+        return (self.total - self.remaining) / self.total
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def start(self) -> "BackupJob":
+        """
+        Run the backup on a background thread.
+        """
+        self._thread = threading.Thread(target=self.run, name=f"backup-{os.path.basename(self.path)}", daemon=True)
+        self._thread.start()
+        return self
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Wait for the backup to finish.
+        :param timeout: The maximum number of seconds to wait.
+        :return: True if the backup finished.
+        :raises Exception: The error that stopped the backup.
+        """
+        finished = self._done.wait(timeout)
+        if finished and self.error is not None:
+            raise self.error
+        return finished
+
+    def _step(self, status, remaining, total):
+        self.steps += 1
+        self.remaining = remaining
+        self.total = total
+        if self.progress_callback is not None:
+            self.progress_callback(total - remaining, total)
+        if remaining > 0:
+            # Let queued queries run before copying the next pages
+            self.database.lock.release()
+            if self.sleep > 0:
+                time.sleep(self.sleep)
+            self.database.lock.acquire(timeout=None, write=False)
+
+    def run(self):
+        """
+        Run the backup on the calling thread.
+        """
+        partial = f"{self.path}.partial"
+        self.started = time.monotonic()
+        try:
+            target = sqlite3.connect(partial)
+            try:
+                self.database.lock.acquire(timeout=None, write=False)
+                try:
+                    sqlite3.Connection.backup(self.database, target, pages=self.pages_per_step, progress=self._step)
+                finally:
+                    self.database.lock.release()
+            finally:
+                target.close()
+            os.replace(partial, self.path)
+        except Exception as e:
+            logging.error(f"Backup of {self.database.database_name} to {self.path} failed: {e}")
+            self.error = e
+            if os.path.exists(partial):
+                os.remove(partial)
+        finally:
+            self.finished = time.monotonic()
+            self._done.set()
+
+    def __repr__(self):
+        return f"BackupJob({self.path}, {self.progress * 100:.1f}%)"
@@ -0,0 +1,170 @@
+import io
+import os
+import sqlite3
+
+from .SqlUtils import split_table_name
+
+# Connection.blobopen was added in Python 3.11
+BLOB_STREAMING = hasattr(sqlite3.Connection, "blobopen")
+
+
+class ZeroBlob:
+    """
+    A placeholder for a BLOB of the given size filled with zeros, allocated by SQLite without building the bytes in
+    memory. Pass it to DynamicTable.add and write the content with entry.open_blob(column, "w").
+    """
+
+    def __init__(self, size: int):
+        if size < 0:
+            raise ValueError("A blob can't have a negative size")
+        self.size = size
+
+    def __repr__(self):
+        return f"ZeroBlob({self.size})"
+
+
+class BlobStream(io.RawIOBase):
+    """
+    A file-like object reading or writing a BLOB in place. The database lock is only held while each chunk is
+    transferred so other queries can run in between, and the blob is never loaded into memory as a whole.
+    Writes can't change the size of a blob, use ZeroBlob to allocate it first.
+    Writing a blob in place doesn't fire triggers, so if the table has triggers (changelog, full text search,
+    aggregates) or a version column an UPDATE of the row is run when the stream is closed for them to see the change.
+    Until then other readers can see the new bytes without the change being recorded.
+    """
+
+    def __init__(self, entry, column: str, mode: str = "r"):
+        """
+        :param entry: The DynamicEntry whose column is opened.
+        :param column: The name of the BLOB column.
+        :param mode: "r" to read, "w" to write.
+        """
+        super().__init__()
+        if not BLOB_STREAMING:
+            raise RuntimeError("Blob streaming needs Python 3.11 or newer")
+        if mode not in ("r", "w"):
+            raise ValueError(f"Unknown blob mode {mode}")
+        if entry.table.get_column(column).codec is not None:
+            raise ValueError(f"Column [{column}] is compressed and can't be streamed")
+        if not entry.table._has_rowid():
+            raise ValueError(f"Table [{entry.table.table_name}] has no rowid, its blobs can't be streamed")
+        self.entry = entry
+        self.database = entry.database
+        self.table_name = entry.table.table_name
+        self.column = column
+        self.mode = mode
+        self.rowid = entry._get_rowid()
+        self.position = 0
+        self.written = False
+        self.size = self._transfer(len)
+
+    def _transfer(self, fn):
+        """
+        Open the blob while holding the lock and call fn with it.
+        """
+        self.database.lock.acquire(timeout=self.database.lock_timeout, write=self.mode == "w")
+        try:
+            with self.database.blobopen(self.table_name, self.column, self.rowid,
+                                        readonly=self.mode == "r") as blob:
+                return fn(blob)
+        except sqlite3.OperationalError as e:
+            raise KeyError(f"Unable to open blob [{self.column}] of row {self.rowid} in table "
+                           f"[{self.table_name}]: {e}")
+        finally:
+            self.database.lock.release()
+
+    def readable(self) -> bool:
+        return self.mode == "r"
+
+    def writable(self) -> bool:
+        return self.mode == "w"
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        if not 0 <= offset <= self.size:
+            raise ValueError(f"Position {offset} is outside of the blob (size {self.size})")
+        self.position = offset
+        return self.position
+
+    def readinto(self, buffer) -> int:
+        if self.closed:
+            raise ValueError("I/O operation on closed blob")
+        if not self.readable():
+            raise io.UnsupportedOperation("Blob was not opened for reading")
+        length = min(len(buffer), self.size - self.position)
+        if length <= 0:
+            return 0
+
+        def read(blob):
+            blob.seek(self.position)
+            return blob.read(length)
+
+        data = self._transfer(read)
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("I/O operation on closed blob")
+        if not self.writable():
+            raise io.UnsupportedOperation("Blob was not opened for writing")
+        data = bytes(data)
+        if self.position + len(data) > self.size:
+            raise ValueError(f"Write of {len(data)} bytes at {self.position} is past the end of the blob "
+                             f"(size {self.size}), allocate the blob with ZeroBlob first")
+
+        def write(blob):
+            blob.seek(self.position)
+            blob.write(data)
+            # Blob writes are visible to other queries straight away, record them like any other write
+            self.database._record_write(f"UPDATE {self.table_name} SET {self.column} = ?")
+
+        self._transfer(write)
+        self.position += len(data)
+        self.written = True
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        if self.written:
+            self._record_change()
+            # The loaded value of the column is out of date, read it again if it is accessed
+            self.entry._unload(self.column)
+            if self.table_name in self.database.mirrors:
+                self.database.lock.acquire(timeout=self.database.lock_timeout)
+                try:
+                    self.database.mirrors[self.table_name].load(self.database)
+                finally:
+                    self.database.lock.release()
+
+    def _record_change(self):
+        """
+        Run an UPDATE of the written row so triggers fire and the row version is bumped, blob I/O bypasses both.
+        """
+        table = self.entry.table
+        schema, name = split_table_name(self.table_name)
+        has_triggers = self.database.get(f"SELECT 1 FROM {schema}.sqlite_master WHERE type='trigger' AND tbl_name=?",
+                                         (name,))
+        if table.version_column:
+            self.database.run(f"UPDATE {self.table_name} SET {table.version_column} = {table.version_column} + 1 "
+                              f"WHERE rowid = ?", (self.rowid,))
+            version = self.database.get(f"SELECT {table.version_column} FROM {self.table_name} WHERE rowid = ?",
+                                        (self.rowid,))
+            if version:  # The entry can still be flushed against the version it now has
+                self.entry._set_loaded(table.version_column, version[0][0])
+        elif has_triggers:
+            self.database.run(f"UPDATE {self.table_name} SET {self.column} = {self.column} WHERE rowid = ?",
+                              (self.rowid,))
+
@@ -0,0 +1,89 @@
+import hashlib
+import math
+import typing
+
+
+class BloomFilter:
+    """
+    A fixed size set of hashed keys that can tell for certain that a key was never added, and says a key may have
+    been added with a false positive rate of about error_rate while it holds no more than capacity keys.
+    Keys can't be removed.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        """
+        :param capacity: The number of keys the filter is sized for.
+        :param error_rate: The false positive rate once capacity keys have been added.
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))  # In bits
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.count = 0  # The number of keys added, including duplicates
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str) -> typing.Iterator[int]:
+        # Two halves of one digest combined as h1 + i * h2 give independent enough positions (Kirsch-Mitzenmacher)
+        digest = hashlib.blake2b(key.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (first + i * second) % self.size
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    @property
+    def full(self) -> bool:
+        """
+        Whether more keys than the filter was sized for have been added, so its false positive rate has gone up.
+        """
+        return self.count > self.capacity
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return f"BloomFilter({self.count}/{self.capacity} keys, {self.size} bits, {self.hashes} hashes)"
+
+
+def filter_key(values: typing.Iterable, affinities: typing.Iterable[str]) -> typing.Optional[str]:
+    """
+    Build the key of a row for a Bloom filter, values that SQLite compares as equal give the same key.
+    :param values: The stored form of each key column of the row.
+    :param affinities: The type affinity of each key column (see SqlUtils.column_affinity).
+    :return: The key, None if a value could be stored or compared in more than one way (e.g. text in a numeric
+     column), those must always be looked up in the database.
+    """
+    parts = []
+    for value, affinity in zip(values, affinities):
+        if isinstance(value, bool) or value is None:
+            return None
+        elif isinstance(value, (int, float)) and affinity == "TEXT":  # Text columns compare numbers as text
+            return None
+        elif isinstance(value, float):
+            if affinity == "REAL":
+                parts.append(value + 0.0)  # -0.0 = 0.0
+            elif value.is_integer():  # 2.0 = 2 in SQLite
+                parts.append(int(value))
+            else:
+                return None
+        elif isinstance(value, int):
+            parts.append(float(value) if affinity == "REAL" else value)
+        elif isinstance(value, str):
+            if affinity not in ("TEXT", "BLOB"):  # Numeric columns convert text that looks like a number
+                return None
+            parts.append(value)
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            parts.append(bytes(value))
+        else:
+            return None
+    return repr(tuple(parts))
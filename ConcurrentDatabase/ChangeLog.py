@@ -0,0 +1,97 @@
+import typing
+
+from .SqlUtils import split_table_name
+
+RESERVED_COLUMNS = ["seq", "operation", "changed_at"]
+
+
+class ChangeRecord:
+    """
+    A single row of a table's changelog.
+    """
+
+    def __init__(self, key_columns: typing.List[str], row: tuple):
+        # Changelog rows are laid out as (seq, operation, changed_at, *key_values)
+        self.seq = row[0]  # type: int
+        self.operation = row[1]  # type: str  # INSERT, UPDATE or DELETE
+        self.changed_at = row[2]  # type: float  # Unix timestamp of the change
+        self.key = {key_columns[i]: row[3 + i] for i in range(len(key_columns))}  # type: dict
+
+    def __str__(self):
+        return f"[{self.seq}]-{self.operation}-{self.key}"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def changelog_table_name(table_name: str) -> str:
+    return f"{table_name}_changelog"
+
+
+def changelog_key_columns(table) -> typing.List[str]:
+    """
+    Get the names of the columns used to identify a row in the changelog of the given table.
+    Tables without primary keys are tracked by rowid.
+    """
+    if table.primary_keys:
+        return [column.name for column in table.primary_keys]
+    return ["row_id"]
+
+
+def changelog_columns(table) -> dict:
+    """
+    Build the column definitions of the changelog table for the given table.
+    """
+    columns = {"seq": "INTEGER PRIMARY KEY AUTOINCREMENT", "operation": "TEXT NOT NULL", "changed_at": "REAL"}
+    if table.primary_keys:
+        for column in table.primary_keys:
+            if column.name in RESERVED_COLUMNS:
+                raise ValueError(f"Primary key [{column.name}] of table [{table.table_name}] "
+                                 f"conflicts with a changelog column")
+            columns[column.name] = column.type
+    else:
+        columns["row_id"] = "INTEGER"
+    return columns
+
+
+def changelog_trigger_sql(table) -> typing.List[str]:
+    """
+    Build the triggers that record every INSERT, UPDATE and DELETE on the given table into its changelog.
+    The triggers of a table in an attached database are created in that database, their bodies can only use
+    unqualified names.
+    """
+    schema, name = split_table_name(table.table_name)
+    prefix = f"{schema}." if schema != "main" else ""
+    log_table = changelog_table_name(name)
+    key_columns = changelog_key_columns(table)
+    if table.primary_keys:
+        source_columns = key_columns
+    else:
+        source_columns = ["rowid"]
+    timestamp = "(julianday('now') - 2440587.5) * 86400.0"
+    insert_columns = ", ".join(["operation", "changed_at"] + key_columns)
+
+    def values(operation, row):
+        return f"'{operation}', {timestamp}, " + ", ".join(f"{row}.{column}" for column in source_columns)
+
+    key_changed = " OR ".join(f"OLD.{column} IS NOT NEW.{column}" for column in source_columns)
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {prefix}{log_table}_insert AFTER INSERT ON {name} BEGIN "
+        f"INSERT INTO {log_table} ({insert_columns}) VALUES ({values('INSERT', 'NEW')}); END",
+        # If the key of a row is changed the old key is reported as deleted so consumers drop it
+        f"CREATE TRIGGER IF NOT EXISTS {prefix}{log_table}_rekey AFTER UPDATE ON {name} "
+        f"WHEN {key_changed} BEGIN "
+        f"INSERT INTO {log_table} ({insert_columns}) VALUES ({values('DELETE', 'OLD')}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {prefix}{log_table}_update AFTER UPDATE ON {name} BEGIN "
+        f"INSERT INTO {log_table} ({insert_columns}) VALUES ({values('UPDATE', 'NEW')}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {prefix}{log_table}_delete AFTER DELETE ON {name} BEGIN "
+        f"INSERT INTO {log_table} ({insert_columns}) VALUES ({values('DELETE', 'OLD')}); END",
+    ]
+
+
+def changelog_trigger_names(table_name: str) -> typing.List[str]:
+    """
+    Get the names of the changelog triggers of a table, qualified with the alias of its database if it is attached.
+    """
+    log_table = changelog_table_name(table_name)
+    return [f"{log_table}_insert", f"{log_table}_rekey", f"{log_table}_update", f"{log_table}_delete"]
@@ -0,0 +1,48 @@
+import lzma
+import zlib
+
+# name -> (compress, decompress, exceptions raised when decompressing data that was not compressed)
+COMPRESSION_CODECS = {
+    "zlib": (zlib.compress, zlib.decompress, (zlib.error,)),
+    "lzma": (lzma.compress, lzma.decompress, (lzma.LZMAError,)),
+}
+
+
+def register_compression_codec(name: str, compress, decompress, errors: tuple = (Exception,)):
+    """
+    Register a compression codec that can be used for TEXT and BLOB columns.
+    :param name: The name the codec is recorded under in the schema metadata.
+    :param compress: Compresses bytes to bytes.
+    :param decompress: Decompresses bytes to bytes.
+    :param errors: The exceptions decompress raises when given data that was not compressed.
+    """
+    COMPRESSION_CODECS[name] = (compress, decompress, errors)
+
+
+def encode(codec: str, column_type: str, value):
+    """
+    Compress a value before it is written to a column.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    elif not isinstance(value, (bytes, bytearray, memoryview)):
+        value = str(value).encode("utf-8")
+    return COMPRESSION_CODECS[codec][0](bytes(value))
+
+
+def decode(codec: str, column_type: str, value):
+    """
+    Decompress a value read from a column. Values that were written before the codec was set are returned unchanged.
+    """
+    if not isinstance(value, bytes):
+        return value
+    decompress, errors = COMPRESSION_CODECS[codec][1], COMPRESSION_CODECS[codec][2]
+    try:
+        value = decompress(value)
+    except errors:
+        return value
+    if column_type in ("TEXT", "STRING"):
+        return value.decode("utf-8")
+    return value
@@ -1,5 +1,8 @@
 from loguru import logger as logging
 
+from . import Codecs, TypeAdapters
+from .BlobStream import ZeroBlob
+
 
 class ColumnWrapper:
 
@@ -20,6 +23,8 @@ class ColumnWrapper:
         self.linked_table = None  # type: DynamicTable or None
         self.linked_column = None  # type: ColumnWrapper or None
 
+        self.codec = None  # type: str or None  # The compression codec values are stored with
+
         if self.primary_key:
             self.table.primary_keys.append(self)
 
@@ -29,16 +34,35 @@ class ColumnWrapper:
         self.linked_table = linked_table
         self.linked_column = linked_column
 
-    def validate(self, value):
-
+    def validate(self, value, mode: str = "strict"):
+        """
+        Validate a value before it is written to or compared against the column
+        :param value: The value, or a [lower, upper] range of values
+        :param mode: "strict" checks the duck type of the value, "fast" only checks its python type, "off" skips all checks
+        """
+        if mode == "off":
+            return
         if (self.not_null and value is None) and self.default_value == "":
             raise ValueError(f"Column {self.name} cannot be null")
         elif value is None:
             return
 
-        if isinstance(value, list):  # If the value is a range of values then validate each value in the range
+        if self.accepts(value):  # Rich types are converted by their registered adapter
+            return
+        if isinstance(value, ZeroBlob):
+            if self.type != "BLOB":
+                raise ValueError(f"Column {self.name} of type {self.type} can't hold a zeroblob")
+            if self.codec is not None:
+                raise ValueError(f"Column {self.name} is compressed and can't hold a zeroblob")
+            return
+        # If the value is a range or a set of values then validate each value
+        if isinstance(value, (list, tuple)):
             for item in value:
-                self.validate(item)
+                self.validate(item, mode)
+            return
+        if mode == "fast":
+            if self.type in TypeAdapters.NATIVE_TYPES and not isinstance(value, TypeAdapters.NATIVE_TYPES[self.type]):
+                raise ValueError(f"Column {self.name} must of exact type {self.type} not {type(value)}")
             return
         # Validate the duck type of the column is correct (aka if it is a string of an integer its still an integer)
         if self.type == "INTEGER" or self.type == "INT":
@@ -63,6 +87,46 @@ class ColumnWrapper:
         else:
             logging.warning(f"Unknown column type {self.type}")
 
+    @property
+    def adapted(self) -> bool:
+        """
+        Whether values of the column are converted by the adapter registered for its type in TypeAdapters.
+        """
+        return self.table.database.type_adapters and self.type in TypeAdapters.TYPE_ADAPTERS
+
+    @property
+    def needs_decoding(self) -> bool:
+        """
+        Whether values read from the column differ from the values that were written until they are decoded.
+        """
+        return self.codec is not None or (self.adapted and TypeAdapters.has_converter(self.type))
+
+    def accepts(self, value) -> bool:
+        """
+        Check if a value is one of the rich python types the column converts, e.g. a dict for a JSON column.
+        """
+        return self.adapted and TypeAdapters.accepts(self.type, value)
+
+    def encode(self, value):
+        """
+        Convert a value to the form it is stored in the database
+        """
+        if self.adapted:
+            value = TypeAdapters.adapt(self.type, value)
+        if self.codec is None:
+            return value
+        return Codecs.encode(self.codec, self.type, value)
+
+    def decode(self, value):
+        """
+        Convert a value read from the database back to the value that was written
+        """
+        if self.codec is not None:
+            value = Codecs.decode(self.codec, self.type, value)
+        if self.adapted:
+            value = TypeAdapters.convert(self.type, value)
+        return value
+
     def __str__(self):
         return f"[{self.position}]{'-PRIMARY KEY' if self.primary_key else ''}-{self.name}-({self.type})" \
                f"{'-NOT NULL' if self.not_null else ''}" \
@@ -99,6 +163,8 @@ class ColumnWrapper:
         """
         if value is None:
             return "NULL"
+        elif isinstance(value, (bytes, bytearray)):
+            return f"X'{bytes(value).hex()}'"
         elif self.type == "TEXT" or self.type == "STRING":
             return "'" + str(value).replace('\'', '\'\'') + "'"
         elif self.type == "INTEGER" or self.type == "INT":
@@ -1,38 +1,29 @@
+import json
 import sqlite3
 import sys
 import threading
 import time
+import typing
 
 from loguru import logger as logging
 from typing import List
 
-from .DynamicEntry import DynamicEntry
+from .AutoFlusher import AutoFlusher
+from .Backup import BackupJob
+from .DynamicEntry import DynamicEntry, ConflictError
 from .DynamicTable import DynamicTable
+from .LockScheduler import LockScheduler
+from .Maintenance import MaintenanceScheduler, optimize, wal_checkpoint, incremental_vacuum
+from .QueryCache import QueryCache
+from .QueryProfiler import QueryProfiler
+from .TableMirror import TableMirror
+from .TimeSeriesTable import TimeSeriesTable, rollup_table_name
+from .SqlUtils import statement_type, written_tables, normalize_sql, referenced_tables, read_sources, \
+    split_table_name
 
 
-class CustomLock:
-
-    def __init__(self):
-        self.lock = threading.Lock()
-        self.lock_count = 0
-        self.queued_lock_count = 0
-
-    def acquire(self, blocking=True, timeout=-1):
-        self.lock_count += 1
-        self.queued_lock_count += 1
-        acquired = self.lock.acquire(blocking, timeout)
-        if acquired:
-            return True
-        else:
-            self.queued_lock_count -= 1
-            return False
-
-    def release(self):
-        self.queued_lock_count -= 1
-        self.lock.release()
-
-    def locked(self):
-        return self.lock.locked()
+# The lock used to be a simple counting wrapper around threading.Lock, kept for backwards compatibility
+CustomLock = LockScheduler
 
 
 class CreateTableLink:
@@ -103,13 +94,60 @@ class TableLink:
 
 class Database(sqlite3.Connection):
 
-    def __init__(self, *args, no_gc=False, **kwargs):
+    def __init__(self, *args, no_gc=False, coherence="refresh", lock_timeout=5, read_priority=0, write_priority=0,
+                 max_queue_depth=None, validate="strict", type_adapters=False, version_check_interval=0.1, **kwargs):
+        """
+        :param no_gc: Don't start the table garbage collector thread.
+        :param coherence: How DynamicEntry.get() decides to re-read a row, "refresh" always re-reads it,
+         "version" only re-reads it if the table has been written to since the entry was loaded.
+        :param version_check_interval: The minimum number of seconds between reads of the file's data version, writes
+         made by other connections may go unnoticed for this long. Writes through this connection are always seen.
+         0 reads it every time a version is needed.
+        :param lock_timeout: The default number of seconds a query waits for the lock before raising
+         LockTimeoutError, None to wait forever.
+        :param read_priority: The lock priority of reads, higher priorities are served first.
+        :param write_priority: The lock priority of writes.
+        :param max_queue_depth: The maximum number of queries that may wait for the lock before new queries are
+         rejected with LockQueueFullError, None for no limit.
+        :param validate: How values are checked before they are written, "strict" checks that they can be parsed as
+         the column type, "fast" only checks their python type and "off" passes them straight to SQLite.
+        :param type_adapters: Convert the values of columns declared with a type registered in TypeAdapters (DATE,
+         JSON, DECIMAL...) to and from python values when they are written and read through tables.
+        """
         super().__init__(*args, check_same_thread=False, **kwargs)
+        if coherence not in ("refresh", "version"):
+            raise ValueError(f"Unknown coherence mode {coherence}")
+        if validate not in ("strict", "fast", "off"):
+            raise ValueError(f"Unknown validation mode {validate}")
+        self.validate = validate
+        self.type_adapters = type_adapters
         self.open = True
+        self.coherence = coherence
         self.table_links = []
-        self.lock = CustomLock()
+        self.lock_timeout = lock_timeout
+        self.lock = LockScheduler(read_priority, write_priority, max_queue_depth)
+        # Write tracking, every write made through this connection bumps the counters of the tables it affects
+        self.write_epoch = 0  # Bumped by schema changes and writes whose target tables can't be determined
+        self.write_counters = {}  # type: dict[str, int]
+        self.version_check_interval = version_check_interval
+        self._data_version = None  # type: int or None  # The data version when it was last read
+        self._data_version_checked = 0.0  # When the data version was last read (time.monotonic)
+        self._dependent_tables = None  # type: dict[str, set] or None  # Tables written to by cascades/triggers
+        self._table_cases = {}  # type: dict[str, str]  # Case folded table names to the names they were created with
+        self._table_names = None  # type: list[str] or None  # Cached names of every table in the database
+        self._view_tables = None  # type: dict[str, list] or None  # The tables each view reads, cached with the names
+        self.query_cache = None  # type: QueryCache or None
+        self.profiler = None  # type: QueryProfiler or None
+        self.maintenance = None  # type: MaintenanceScheduler or None
+        self.auto_flusher = None  # type: AutoFlusher or None
+        self.mirrors = {}  # type: dict[str, TableMirror]  # In-memory copies of pinned tables
+        self.attached = {}  # type: dict[str, str]  # Aliases of attached database files to their paths
+        self.declared_links = []  # type: list[tuple]  # Relations between tables that SQLite can't enforce
         self.tables = {}
         self.database_name = args[0]
+        # Per column settings such as compression codecs, the table is only created once something is stored in it
+        self.metadata_enabled = bool(self.get("SELECT name FROM sqlite_master WHERE type='table' "
+                                              "AND name='schema_metadata'"))
         self.create_table("table_versions", {"table_name": "TEXT", "version": "INTEGER"}, ["table_name"])
         self.table_version_table = self.get_table("table_versions")
 
@@ -124,32 +162,151 @@ class Database(sqlite3.Connection):
     def _update_table_links(self):
         # Get all table names
         relations = []
-        table_names = self.get("SELECT name FROM sqlite_master WHERE type='table'")
+        table_names = self._all_table_names()
         # Get all foreign keys for each table
         for table_name in table_names:
-            table_name = table_name[0]
-            result = self.get(f"PRAGMA foreign_key_list({table_name})")
+            schema, name = split_table_name(table_name)
+            result = self.get(f"PRAGMA {schema}.foreign_key_list({name})")
             if result:
                 for row in result:
                     child_table = table_name
                     if row[4] is None:
                         continue
+                    if schema != "main":  # Foreign keys always reference a table in the same file
+                        row = row[:2] + (f"{schema}.{row[2]}",) + row[3:]
                     relations.append(TableLink(self, child_table, row))
+        for child_table, child_key, parent_table, parent_key in self.declared_links:
+            relations.append(TableLink(self, child_table, (0, 0, parent_table, child_key, parent_key,
+                                                           "NO ACTION", "NO ACTION")))
         self.table_links = relations
 
+    def _all_table_names(self) -> List[str]:
+        """
+        Get the names of every table in the database and in the attached databases, qualified with their alias.
+        """
+        names = [row[0] for row in self.get("SELECT name FROM sqlite_master WHERE type='table'")]
+        for alias in self.attached:
+            names += [f"{alias}.{row[0]}" for row in self.get(f"SELECT name FROM {alias}.sqlite_master "
+                                                              f"WHERE type='table'")]
+        return names
+
+    def _all_view_tables(self, table_names: List[str]) -> dict:
+        """
+        Get the tables each view in the database reads from, views of other views are resolved to their tables.
+        :param table_names: The names of every table, as returned by _all_table_names.
+        :return: A dictionary of view names (qualified like the table names) to table names.
+        """
+        views = {}
+        for schema in ["main"] + list(self.attached):
+            prefix = f"{schema}." if schema != "main" else ""
+            for name, sql in self.get(f"SELECT name, sql FROM {schema}.sqlite_master WHERE type='view'"):
+                views[prefix + name] = sql
+
+        def resolve(view: str, seen: set) -> set:
+            # The views of a database file can only read from the tables and views of the same file
+            prefix = view.split(".")[0] + "." if "." in view else ""
+            local_tables = [name[len(prefix):] for name in table_names
+                            if (name.startswith(prefix) if prefix else "." not in name)]
+            local_views = [name[len(prefix):] for name in views
+                           if (name.startswith(prefix) if prefix else "." not in name)]
+            tables = {prefix + name for name in referenced_tables(views[view], local_tables)}
+            for name in referenced_tables(views[view], local_views):
+                if prefix + name not in seen:
+                    tables |= resolve(prefix + name, seen | {prefix + name})
+            return tables
+
+        return {view: sorted(resolve(view, {view})) for view in views}
+
+    def attach(self, path: str, alias: str) -> List[DynamicTable]:
+        """
+        Attach another database file to this connection. Its tables are available as "alias.table", share this
+        database's lock and can be joined with the tables of this database in a single query.
+        :param path: The path of the database file, it is created if it doesn't exist.
+        :param alias: The name the attached database is referenced by.
+        :return: The tables of the attached database.
+        """
+        if not self.open:
+            raise RuntimeError("Database is closed")
+        if not alias.isidentifier() or alias.lower() in ("main", "temp"):
+            raise ValueError(f"Invalid database alias {alias}")
+        if alias in self.attached:
+            raise ValueError(f"A database is already attached as {alias}")
+        self.lock.acquire(timeout=self.lock_timeout)
+        try:
+            if self.in_transaction:  # ATTACH can't run inside a transaction
+                super().commit()
+            super().execute(f"ATTACH DATABASE ? AS {alias}", (path,))
+            self.attached[alias] = path
+            self.write_epoch += 1
+            self._data_version = None
+            self._dependent_tables = None
+            self._table_names = None
+        finally:
+            self.lock.release()
+        tables = [self.get_table(name) for name in self._all_table_names() if name.startswith(f"{alias}.")]
+        self._update_table_links()
+        return tables
+
+    def detach(self, alias: str):
+        """
+        Detach a database attached with attach, its tables and the relations declared with them are forgotten.
+        """
+        if alias not in self.attached:
+            raise KeyError(f"No database is attached as {alias}")
+        for table_name in [name for name in self.tables if name.startswith(f"{alias}.")]:
+            if table_name in self.mirrors:
+                self.unpin(table_name)
+            self.tables.pop(table_name)
+        self.declared_links = [link for link in self.declared_links
+                               if not link[0].startswith(f"{alias}.") and not link[2].startswith(f"{alias}.")]
+        self.lock.acquire(timeout=self.lock_timeout)
+        try:
+            if self.in_transaction:
+                super().commit()
+            super().execute(f"DETACH DATABASE {alias}")
+            self.attached.pop(alias)
+            self.write_epoch += 1
+            self._data_version = None
+            self._dependent_tables = None
+            self._table_names = None
+        finally:
+            self.lock.release()
+        self._update_table_links()
+
+    def link_tables(self, child_table: str, child_key: str, parent_table: str, parent_key: str):
+        """
+        Declare a relation between tables that SQLite can't enforce, such as between tables in different database
+        files. The relation is used like a foreign key by get_related_entries and DynamicEntry.get, but isn't
+        enforced or cascaded.
+        :param child_table: The table holding the reference, e.g. "archive.orders".
+        :param child_key: The column of the child table holding the referenced value.
+        :param parent_table: The referenced table.
+        :param parent_key: The referenced column of the parent table.
+        """
+        self.get_table(child_table).get_column(child_key)
+        self.get_table(parent_table).get_column(parent_key)
+        self.declared_links.append((child_table, child_key, parent_table, parent_key))
+        self._update_table_links()
+
     def create_table(self, table_name: str, columns: dict, primary_keys: List[str] = None,
-                     linked_tables: list = None) -> DynamicTable:
+                     linked_tables: list = None, fulltext: List[str] = None, codecs: dict = None) -> DynamicTable:
         """
         Create a table in the database.
         :param table_name: The name of the table to create.
         :param columns: A dictionary of the columns to create in the table.
         :param primary_keys: A list of the primary keys in the table.
         :param linked_tables: A list of tables to link to this table.
+        :param fulltext: A list of TEXT columns to index for full text search.
+        :param codecs: A dictionary of TEXT/BLOB columns to the compression codec ("zlib", "lzma") to store them with.
         """
         if not self.open:
             raise RuntimeError("Database is closed")
         if table_name != "table_versions":
             self._create_table(table_name, columns, primary_keys, linked_tables)
+            for column_name, codec in (codecs or {}).items():
+                self.tables[table_name].set_codec(column_name, codec)
+            if fulltext:
+                self.tables[table_name].enable_fulltext(fulltext)
         else:
             self.run(f"CREATE TABLE IF NOT EXISTS table_versions (table_name TEXT PRIMARY KEY, version INTEGER)")
             self.tables[table_name] = DynamicTable(table_name, self)
@@ -170,12 +327,68 @@ class Database(sqlite3.Connection):
         sql += ")"
         self.run(sql)
         # Add the table to the tables dictionary
-        self.tables[table_name] = DynamicTable(table_name, self)
+        self.tables[table_name] = self._table_class(table_name)(table_name, self)
         self._update_table_links()
         # Add the table to the table_versions table (unless this is the table_versions table)
         if not self.table_version_table.get_row(table_name=table_name):
             self.table_version_table.update_or_add(table_name=table_name, version=0)
 
+    def create_timeseries_table(self, table_name: str, columns: dict, time_column: str = "timestamp",
+                                clustered: str = "rowid", retention: float = None, rollups: dict = None,
+                                rollup_columns: List[str] = None, batch_size: int = 500) -> TimeSeriesTable:
+        """
+        Create an append-only table of timestamped samples.
+        :param table_name: The name of the table to create.
+        :param columns: A dictionary of the value columns of each sample, the time column is added automatically.
+        :param time_column: The name of the column holding the unix time of each sample.
+        :param clustered: "rowid" stores samples in the order they were appended with an index on the time column,
+         "timestamp" makes the time the rowid itself, so times must be whole, unique seconds (a sample at a second
+         that already holds a sample is dropped when the batch is written).
+        :param retention: Delete samples older than this many seconds, None to keep every sample.
+        :param rollups: A dictionary of labels to bucket sizes in seconds, e.g. {"1h": 3600}, samples are summarised
+         into a rollup table per label before they are deleted.
+        :param rollup_columns: The numeric columns to summarise, defaults to every INTEGER and REAL column.
+        :param batch_size: The number of appended samples buffered before they are written.
+        """
+        if not self.open:
+            raise RuntimeError("Database is closed")
+        if clustered not in ("rowid", "timestamp"):
+            raise ValueError(f"Unknown clustering {clustered}")
+        if time_column in columns:
+            raise ValueError(f"Column {time_column} is reserved for the sample time")
+        if table_name in self.tables:
+            return self.get_table(table_name)
+        if rollup_columns is None:
+            rollup_columns = [name for name, kind in columns.items()
+                              if kind.split()[0].upper() in ("INTEGER", "INT", "REAL")]
+        settings = {"kind": "timeseries", "time_column": time_column, "retention": retention,
+                    "rollups": json.dumps(rollups) if rollups else None,
+                    "rollup_columns": json.dumps(rollup_columns), "batch_size": batch_size}
+        for key, value in settings.items():  # Stored first so the table is loaded as a TimeSeriesTable
+            self.set_metadata(table_name, "", key, value)
+        if clustered == "timestamp":
+            table_columns = {time_column: "INTEGER PRIMARY KEY", **columns}
+        else:
+            table_columns = {time_column: "REAL NOT NULL", **columns}
+        self._create_table(table_name, table_columns)
+        if clustered == "rowid":
+            self.run(f"CREATE INDEX IF NOT EXISTS {table_name}_{time_column} ON {table_name} ({time_column})")
+        for label, interval in (rollups or {}).items():
+            rollup_columns_sql = {"bucket": "REAL PRIMARY KEY", "count": "INTEGER"}
+            for column in rollup_columns:
+                for stat in ("min", "max", "sum"):
+                    rollup_columns_sql[f"{column}_{stat}"] = "REAL"
+            self._create_table(rollup_table_name(table_name, label), rollup_columns_sql)
+        return self.tables[table_name]
+
+    def _table_class(self, table_name: str) -> type:
+        """
+        Get the class a table is loaded as, from the kind recorded in the schema metadata.
+        """
+        if self.get_metadata(table_name, "kind").get("") == "timeseries":
+            return TimeSeriesTable
+        return DynamicTable
+
     def get_table(self, table_name: str) -> DynamicTable:
         """
         Get a table from the database.
@@ -188,9 +401,12 @@ class Database(sqlite3.Connection):
             return self.tables[table_name]
         else:
             # Load the table from the database
-            result = self.run(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'").fetchall()
+            schema, name = split_table_name(table_name)
+            if schema != "main" and schema not in self.attached:
+                raise KeyError(f"Table {table_name} not found in database {self.database_name}")
+            result = self.get(f"SELECT name FROM {schema}.sqlite_master WHERE type='table' AND name=?", (name,))
             if result:
-                self.tables[table_name] = DynamicTable(table_name, self)
+                self.tables[table_name] = self._table_class(table_name)(table_name, self)
                 self._update_table_links()
                 return self.tables[table_name]
             else:
@@ -233,6 +449,364 @@ class Database(sqlite3.Connection):
         else:
             raise NotImplementedError("Updating tables with columns is not yet implemented")
 
+    def get_metadata(self, table_name: str, key: str) -> dict:
+        """
+        Get a setting stored in the schema metadata for every column of a table.
+        :param table_name: The name of the table.
+        :param key: The name of the setting.
+        :return: A dictionary of column names to values, the table itself is stored under the column name "".
+        """
+        if not self.metadata_enabled:
+            return {}
+        return dict(self.get("SELECT column_name, value FROM schema_metadata WHERE table_name = ? AND key = ?",
+                             (table_name, key)))
+
+    def set_metadata(self, table_name: str, column_name: str, key: str, value: str = None):
+        """
+        Store a setting in the schema metadata.
+        :param table_name: The name of the table.
+        :param column_name: The name of the column, "" for a setting of the table itself.
+        :param key: The name of the setting.
+        :param value: The value of the setting, None to remove it.
+        """
+        if not self.metadata_enabled:
+            if value is None:
+                return
+            self.create_table("schema_metadata", {"table_name": "TEXT", "column_name": "TEXT", "key": "TEXT",
+                                                  "value": "TEXT"}, ["table_name", "column_name", "key"])
+            self.metadata_enabled = True
+        if value is None:
+            self.run("DELETE FROM schema_metadata WHERE table_name = ? AND column_name = ? AND key = ?",
+                     (table_name, column_name, key))
+        else:
+            self.run("INSERT OR REPLACE INTO schema_metadata (table_name, column_name, key, value) "
+                     "VALUES (?, ?, ?, ?)", (table_name, column_name, key, str(value)))
+
+    def data_version(self, max_age: float = None) -> int:
+        """
+        Get the data version of the database file, it changes whenever another connection commits a change.
+        The version is read at most once per version_check_interval seconds, so checking it doesn't queue for the lock
+        on every access.
+        :param max_age: Read the version again if it was read longer than this many seconds ago, defaults to
+         version_check_interval.
+        :return: The data version.
+        """
+        now = time.monotonic()
+        max_age = self.version_check_interval if max_age is None else max_age
+        if self._data_version is not None and now - self._data_version_checked < max_age:
+            return self._data_version
+        version = self.get("PRAGMA data_version")[0][0]
+        for alias in self.attached:  # Each version only ever increases, so their sum changes when any of them does
+            version += self.get(f"PRAGMA {alias}.data_version")[0][0]
+        self._data_version, self._data_version_checked = version, now
+        return version
+
+    def table_version(self, table_name: str) -> tuple:
+        """
+        Get a token that changes whenever the given table may have been modified, either through this connection
+        or by another connection to the same database file.
+        :param table_name: The name of the table.
+        :return: A comparable version token.
+        """
+        return self.data_version(), self.write_epoch, self.write_counters.get(table_name, 0)
+
+    def _load_dependent_tables(self):
+        """
+        Build a map of which tables are implicitly written to when a table is written to, through foreign key
+        cascades or triggers. Must be called while holding the lock.
+        """
+        cursor = super().cursor()
+        dependents = {}
+        names = {}
+        for schema in ["main"] + list(self.attached):
+            prefix = f"{schema}." if schema != "main" else ""
+            for name, in cursor.execute(f"SELECT name FROM {schema}.sqlite_master WHERE type='table'").fetchall():
+                names[(prefix + name).casefold()] = prefix + name
+                for row in cursor.execute(f"PRAGMA {schema}.foreign_key_list({name})").fetchall():
+                    dependents.setdefault(prefix + row[2], set()).add(prefix + name)
+            for table_name, sql in cursor.execute(f"SELECT tbl_name, sql FROM {schema}.sqlite_master "
+                                                  f"WHERE type='trigger'"):
+                dependents.setdefault(prefix + table_name, set()).update(prefix + name
+                                                                         for name in written_tables(sql))
+        cursor.close()
+        # Table names are case-insensitive, statements may not spell them the way they were created
+        self._table_cases = names
+        self._dependent_tables = {}
+        for table_name, tables in dependents.items():
+            self._dependent_tables.setdefault(names.get(table_name.casefold(), table_name), set()).update(
+                names.get(name.casefold(), name) for name in tables)
+
+    def _record_write(self, sql: str):
+        """
+        Bump the write counters of every table affected by the given statement. Must be called while holding the lock.
+        """
+        kind = statement_type(sql)
+        if kind == "schema":
+            self.write_epoch += 1
+            self._dependent_tables = None
+            self._table_names = None
+            return
+        elif kind != "write":
+            return
+        tables = written_tables(sql)
+        if not tables:
+            self.write_epoch += 1
+            return
+        if self._dependent_tables is None:
+            self._load_dependent_tables()
+        tables = [self._table_cases.get(table_name.casefold(), table_name) for table_name in tables]
+        for table_name in self._affected_tables(tables):
+            self.write_counters[table_name] = self.write_counters.get(table_name, 0) + 1
+            table = self.tables.get(table_name)
+            if table is not None and table._bloom_settings is not None:
+                table._bloom_write(sql, table_name in tables)
+
+    def _affected_tables(self, tables: List[str]) -> set:
+        """
+        Get the tables written to by a statement writing to the given tables, including the tables written to by
+        cascades and triggers. Must be called while holding the lock.
+        """
+        if self._dependent_tables is None:
+            self._load_dependent_tables()
+        tables = list(tables)
+        affected = set()
+        while tables:
+            table_name = tables.pop()
+            if table_name in affected:
+                continue
+            affected.add(table_name)
+            tables.extend(self._dependent_tables.get(table_name, []))
+        return affected
+
+    def _mirror_write(self, sql: str, args=(), many: bool = False, script: bool = False):
+        """
+        Apply a write to the in-memory copies of pinned tables. Must be called while holding the lock.
+        """
+        kind = statement_type(sql)
+        if kind == "schema":
+            for table_name, mirror in list(self.mirrors.items()):
+                try:
+                    mirror.load(self)
+                except KeyError:  # The table was dropped
+                    self.mirrors.pop(table_name).close()
+            return
+        elif kind != "write" and not script:
+            return
+        direct = written_tables(sql)
+        affected = self._affected_tables(direct) if direct else set(self.mirrors)
+        for table_name in affected:
+            mirror = self.mirrors.get(table_name)
+            if mirror is None:
+                continue
+            if direct == [table_name]:
+                try:
+                    mirror.apply(sql, args, many, script)
+                    continue
+                except sqlite3.Error as e:
+                    logging.debug(f"Reloading mirror of {table_name}, unable to replay write: {e}")
+            # Written to indirectly (cascades, triggers) or the replay failed, copy the table again
+            mirror.load(self)
+
+    def enable_query_cache(self, max_entries: int = 256, ttl: float = None):
+        """
+        Cache the results of DynamicTable.select() and custom_query(). Cached results are invalidated whenever a table
+        they read from is written to, through this database or by another connection.
+        :param max_entries: The maximum number of results to keep.
+        :param ttl: The maximum number of seconds to keep a result for, useful for queries that use the current time.
+        """
+        self.query_cache = QueryCache(max_entries, ttl)
+
+    def disable_query_cache(self):
+        self.query_cache = None
+
+    def cached_get(self, sql, args: tuple = ()) -> list:
+        """
+        Run a read query, returning a cached result if the query cache is enabled and the tables it reads are unchanged.
+        :param sql: The SQL query to run.
+        :param args: The arguments to pass to the query.
+        :return: The rows.
+        """
+        cache = self.query_cache
+        if cache is None or statement_type(sql) != "read":
+            return self.get(sql, args)
+        if self._table_names is None:
+            table_names = self._all_table_names()
+            self._view_tables = self._all_view_tables(table_names)
+            self._table_names = table_names
+        # A statement reading from something that isn't a known table or view can't be invalidated, it isn't cached
+        known = {name.casefold() for name in self._table_names} | {name.casefold() for name in self._view_tables}
+        sources = read_sources(sql)
+        if sources is None or any((name[5:] if name.startswith("main.") else name) not in known for name in sources):
+            return self.get(sql, args)
+        tables = set(referenced_tables(sql, self._table_names))
+        for view in referenced_tables(sql, self._view_tables):  # Views are invalidated by writes to their tables
+            tables.update(self._view_tables[view])
+        tables = sorted(tables)
+        key = (normalize_sql(sql), tuple(args))
+        # The versions are read before the query so a write made while it runs invalidates the result
+        versions = (self.data_version(), self.write_epoch, tuple(self.write_counters.get(name, 0) for name in tables))
+        rows = cache.get(key, versions)
+        if rows is None:
+            rows = self.get(sql, args)
+            cache.put(key, versions, rows)
+        return list(rows)
+
+    def enable_profiling(self, warn: bool = True):
+        """
+        Record how often each shape of statement runs and how long it takes, and flag statements whose query plan
+        scans a whole table or builds a temporary b-tree.
+        :param warn: Log a warning with the calling site the first time a flagged statement is run from it.
+        """
+        self.profiler = QueryProfiler(warn)
+
+    def disable_profiling(self):
+        self.profiler = None
+
+    def profile_report(self, flagged_only: bool = False) -> list:
+        """
+        Get the statistics collected since profiling was enabled, the most expensive statement shapes first.
+        :param flagged_only: Only include statements with a full scan or temporary b-tree in their plan.
+        :return: A list of dictionaries.
+        """
+        if self.profiler is None:
+            raise RuntimeError("Profiling is not enabled")
+        return self.profiler.report(flagged_only)
+
+    def backup_to(self, path: str, pages_per_step: int = 256, sleep: float = 0.01, progress=None,
+                  background: bool = True) -> BackupJob:
+        """
+        Make a consistent copy of the database while it stays in use. Pages are copied in small steps and the lock is
+        released between steps, changes made through this database during the copy are included in the backup.
+        :param path: The file to write the backup to, it is only replaced once the copy is complete.
+        :param pages_per_step: The number of pages copied while holding the lock.
+        :param sleep: The number of seconds to wait between steps.
+        :param progress: Called with (pages_copied, total_pages) after each step.
+        :param background: Run the backup on a background thread, otherwise return once it is complete.
+        :return: The backup job, use job.wait() to wait for it to finish.
+        """
+        if not self.open:
+            raise RuntimeError("Database is closed")
+        job = BackupJob(self, path, pages_per_step, sleep, progress)
+        if background:
+            return job.start()
+        job.run()
+        job.wait()
+        return job
+
+    def enable_maintenance(self, optimize_interval: float = 3600, checkpoint_interval: float = 300,
+                           checkpoint_writes: int = 1000, checkpoint_mode: str = "PASSIVE",
+                           vacuum_interval: float = 600, vacuum_pages: int = 128, poll: float = 1.0,
+                           pause: float = 0.01) -> MaintenanceScheduler:
+        """
+        Start running maintenance in the background, more tasks can be added with maintenance.add_task.
+        Pass None for an interval to not schedule that task.
+        :param optimize_interval: Seconds between runs of PRAGMA optimize.
+        :param checkpoint_interval: Seconds between WAL checkpoints (only done in WAL mode).
+        :param checkpoint_writes: Also checkpoint after this many writes.
+        :param checkpoint_mode: "PASSIVE" never waits on readers, "TRUNCATE" also shrinks the WAL file.
+        :param vacuum_interval: Seconds between incremental vacuums (only done with auto_vacuum = INCREMENTAL).
+        :param vacuum_pages: The number of free pages released per step of the vacuum.
+        :param poll: Seconds between checks for due tasks.
+        :param pause: Seconds to wait between the steps of a task, the lock is free while waiting.
+        :return: The scheduler.
+        """
+        if not self.open:
+            raise RuntimeError("Database is closed")
+        self.disable_maintenance()
+        scheduler = MaintenanceScheduler(self, poll, pause)
+        if optimize_interval is not None:
+            scheduler.add_task("optimize", optimize, interval=optimize_interval)
+        if checkpoint_interval is not None or checkpoint_writes is not None:
+            scheduler.add_task("checkpoint", wal_checkpoint(checkpoint_mode), interval=checkpoint_interval,
+                               writes=checkpoint_writes)
+        if vacuum_interval is not None:
+            scheduler.add_task("incremental_vacuum", incremental_vacuum(vacuum_pages), interval=vacuum_interval)
+        self.maintenance = scheduler.start()
+        return scheduler
+
+    def disable_maintenance(self):
+        if self.maintenance is not None:
+            self.maintenance.stop()
+            self.maintenance = None
+
+    def enable_auto_flush(self, interval: float = 0.1, max_dirty: int = 500, max_retries: int = 3) -> AutoFlusher:
+        """
+        Write the changes made with entry[column] = value in the background instead of waiting for flush() or the
+        garbage collector. The changes of every dirty entry are written together in one transaction.
+        :param interval: The maximum number of seconds a change waits before it is written.
+        :param max_dirty: Flush straight away once this many entries have unwritten changes.
+        :param max_retries: The number of flushes an entry that can't be written is tried in before it is left for the
+         application to flush.
+        :return: The flusher.
+        """
+        if not self.open:
+            raise RuntimeError("Database is closed")
+        self.disable_auto_flush()
+        self.auto_flusher = AutoFlusher(self, interval, max_dirty, max_retries)
+        # Entries that were already dirty are written by the first flush too
+        for table in list(self.tables.values()):
+            for entry in table.entries:
+                if entry is not None and entry.is_dirty():
+                    self.auto_flusher.mark_dirty(entry)
+        return self.auto_flusher.start()
+
+    def disable_auto_flush(self):
+        """
+        Stop the auto flusher, any pending changes are written first.
+        """
+        if self.auto_flusher is not None:
+            flusher, self.auto_flusher = self.auto_flusher, None
+            flusher.stop()
+
+    def stats(self) -> dict:
+        """
+        Get statistics about the lock, writes, auto flushing and background maintenance of the database.
+        """
+        return {"lock": self.lock.stats(), "writes": dict(self.write_counters), "write_epoch": self.write_epoch,
+                "auto_flush": self.auto_flusher.stats() if self.auto_flusher is not None else {},
+                "maintenance": self.maintenance.stats() if self.maintenance is not None else {}}
+
+    def pin_in_memory(self, table_name: str):
+        """
+        Keep a copy of a small, frequently read table in memory. Reads through its DynamicTable are served from the
+        copy without waiting for the database lock, writes made through this database are applied to both copies.
+        Changes made by other connections are not seen until reload_pinned() is called.
+        :param table_name: The name of the table to pin.
+        """
+        if not self.open:
+            raise RuntimeError("Database is closed")
+        self.get_table(table_name)
+        mirror = TableMirror(table_name)
+        self.lock.acquire(timeout=self.lock_timeout, write=False)
+        try:
+            mirror.load(self)
+            self.mirrors[table_name] = mirror
+        finally:
+            self.lock.release()
+
+    def reload_pinned(self, table_name: str = None):
+        """
+        Copy pinned tables from the database again, to pick up changes made by other connections.
+        :param table_name: The table to reload, all pinned tables if None.
+        """
+        self.lock.acquire(timeout=self.lock_timeout, write=False)
+        try:
+            for name, mirror in self.mirrors.items():
+                if table_name is None or name == table_name:
+                    mirror.load(self)
+        finally:
+            self.lock.release()
+
+    def unpin(self, table_name: str):
+        """
+        Stop keeping an in-memory copy of a table.
+        :param table_name: The name of the pinned table.
+        """
+        mirror = self.mirrors.pop(table_name, None)
+        if mirror is None:
+            raise KeyError(f"Table {table_name} is not pinned in memory")
+        mirror.close()
+
     def drop_table(self, table_name: str):
         """
         Drop a table from the database.
@@ -243,12 +817,38 @@ class Database(sqlite3.Connection):
         # Check if the table exists
         if table_name not in self.tables:
             raise KeyError(f"Table {table_name} not found in database {self.database_name}")
+        # A materialized aggregate is dropped through the table it summarises, so its triggers go with it
+        schema, name = split_table_name(table_name)
+        owner = self.get(f"SELECT tbl_name FROM {schema}.sqlite_master WHERE type='trigger' AND name=?",
+                         (f"{name}_agg_insert",))
+        if owner:
+            prefix = f"{schema}." if schema != "main" else ""
+            self.get_table(prefix + owner[0][0]).drop_materialized_aggregate(table_name)
+            return
+        if self.tables[table_name].changelog_enabled:
+            self.tables[table_name].disable_changelog()
+        for aggregate in self.tables[table_name].materialized_aggregates:
+            self.tables[table_name].drop_materialized_aggregate(aggregate)
+        if self.tables[table_name].fulltext_columns:
+            self.tables[table_name].disable_fulltext()
+        if table_name in self.mirrors:
+            self.unpin(table_name)
+        if isinstance(self.tables[table_name], TimeSeriesTable):
+            for label in self.tables[table_name].rollups:
+                try:
+                    self.get_table(rollup_table_name(table_name, label))
+                except KeyError:
+                    continue
+                self.drop_table(rollup_table_name(table_name, label))
         self.run(f"DROP TABLE {table_name}")
+        if self.metadata_enabled:
+            self.run("DELETE FROM schema_metadata WHERE table_name = ?", (table_name,))
         # Remove the table from the table_versions table
-        self.table_version_table.delete(table_name=table_name)
+        self.table_version_table.delete_where(table_name=table_name)
         # del self.tables[table_name]
         self.tables.pop(table_name)
         # del self.tables[table_name]
+        self.declared_links = [link for link in self.declared_links if table_name not in (link[0], link[2])]
         self._update_table_links()
 
     def run(self, sql, *args, **kwargs) -> sqlite3.Cursor:
@@ -257,14 +857,28 @@ class Database(sqlite3.Connection):
         :param sql: The SQL query to run.
         :param args: The arguments to pass to the query.
         :param kwargs: The keyword arguments to pass to the query.
+         commit: Commit after the query (default True), fetch: Return the fetched rows instead of the cursor,
+         the rows are read before committing which is required for statements with a RETURNING clause,
+         timeout: Seconds to wait for the lock (defaults to the database's lock_timeout).
         :return: A cursor object, use cursor.fetchall() to get the results. (The cursor is not thread safe)
+        :raises LockTimeoutError: If the lock could not be acquired within the timeout.
+        :raises LockQueueFullError: If too many queries are already waiting for the lock.
         """
         if not self.open:
             raise RuntimeError("Database is closed")
-        self.lock.acquire(timeout=5)
+        self.lock.acquire(timeout=kwargs.get("timeout", self.lock_timeout), write=statement_type(sql) != "read")
         cursor = super().cursor()
+        rows = []
         try:
+            started = time.perf_counter()
             cursor.execute(sql, *args)
+            self._record_write(sql)
+            if self.mirrors:
+                self._mirror_write(sql, args[0] if args else ())
+            if kwargs.get("fetch", False):
+                rows = cursor.fetchall()
+            if self.profiler is not None:
+                self.profiler.record(self, sql, args[0] if args else (), time.perf_counter() - started)
         except sqlite3.OperationalError as e:
             # If the error is a syntax error, print the query
             logging.error(f"Database Error: {e}")
@@ -277,6 +891,9 @@ class Database(sqlite3.Connection):
                 except sqlite3.OperationalError as e:
                     logging.error(f"Database Error: Commit failed {e}")
             self.lock.release()
+        if kwargs.get("fetch", False):
+            cursor.close()
+            return rows
         return cursor
 
     def batch_transaction(self, transactions: list, *args, **kwargs) -> sqlite3.Cursor:
@@ -289,11 +906,15 @@ class Database(sqlite3.Connection):
         """
         if not self.open:
             raise RuntimeError("Database is not open")
-        self.lock.acquire(timeout=5)
+        self.lock.acquire(timeout=kwargs.get("timeout", self.lock_timeout))
         cursor = super().cursor()
         try:
             sql = ";\n".join(filter(None, transactions))
             cursor.executescript(sql)
+            for statement in filter(None, transactions):
+                self._record_write(statement)
+            if self.mirrors:
+                self._mirror_write(sql, script=True)
         except sqlite3.OperationalError as e:
             logging.error(f"Database Error: {e}")
         finally:
@@ -305,6 +926,79 @@ class Database(sqlite3.Connection):
             self.lock.release()
         return cursor
 
+    def transaction(self, statements: List[tuple], expect_changes: typing.Container[int] = (),
+                    **kwargs) -> List[sqlite3.Cursor]:
+        """
+        Run several parameterized statements in a single transaction with thread safety, if any statement fails the
+        whole transaction is rolled back and the error is raised.
+        :param statements: A list of (sql, args) tuples.
+        :param expect_changes: The indexes of the statements that must change at least one row, the transaction is
+         rolled back with a ConflictError if one of them doesn't.
+        :param kwargs: timeout, the number of seconds to wait for the lock.
+        :return: The cursor of each statement.
+        """
+        if not self.open:
+            raise RuntimeError("Database is not open")
+        self.lock.acquire(timeout=kwargs.get("timeout", self.lock_timeout))
+        cursors = []
+        try:
+            if self.in_transaction:
+                super().commit()
+            super().execute("BEGIN")
+            for index, (sql, args) in enumerate(statements):
+                started = time.perf_counter()
+                cursors.append(super().execute(sql, args))
+                if index in expect_changes and cursors[-1].rowcount == 0:
+                    raise ConflictError(f"Statement {index} of the transaction changed no rows: {sql}", index)
+                self._record_write(sql)
+                if self.profiler is not None:
+                    self.profiler.record(self, sql, args, time.perf_counter() - started)
+            if self.mirrors:
+                for sql, args in statements:
+                    self._mirror_write(sql, args)
+            super().commit()
+        except Exception:
+            super().rollback()
+            for mirror in self.mirrors.values():  # Some statements may already have been replayed
+                mirror.load(self)
+            raise
+        finally:
+            self.lock.release()
+        return cursors
+
+    def flush_entries(self, entries: typing.Iterable[DynamicEntry]) -> int:
+        """
+        Write the pending changes of many entries, from any number of tables, in one transaction. If the transaction
+        fails the entries keep their changes and stay dirty.
+        :param entries: The entries to flush, entries without changes are skipped.
+        :return: The number of entries written.
+        :raises ConflictError: If a row of a versioned table was changed by another writer, the rejected entry is in
+         the error's entry attribute.
+        """
+        statements, flushed, seen = [], [], set()
+        for entry in list(entries):
+            if entry is None or entry._deleted or id(entry) in seen:  # A table may list an entry more than once
+                continue
+            seen.add(id(entry))
+            pending = entry._pending_write()
+            if pending is not None:
+                statements.append(pending[:2])
+                flushed.append((entry, pending[2]))
+        if not statements:
+            return 0
+        try:
+            self.transaction(statements, expect_changes={index for index, (entry, _) in enumerate(flushed)
+                                                         if entry.table.version_column})
+        except ConflictError as e:
+            if e.index is not None:
+                e.entry = flushed[e.index][0]
+            raise
+        # The entries stay dirty until the changes are committed so they aren't reloaded with the old rows
+        for entry, written in flushed:
+            entry._mark_written(written)
+            entry._bump_version()
+        return len(flushed)
+
     def run_many(self, sql, *args, **kwargs) -> sqlite3.Cursor:
         """
         Run a query on the database with thread safety.
@@ -314,15 +1008,36 @@ class Database(sqlite3.Connection):
         """
         if not self.open:
             raise RuntimeError("Database is not open")
-        self.lock.acquire()
+        if self.mirrors and args:  # The parameters are needed again to replay the write on pinned tables
+            args = (list(args[0]),) + args[1:]
+        self.lock.acquire(timeout=kwargs.get("timeout", self.lock_timeout))
         cursor = super().cursor()
-        cursor.executemany(sql, *args)
-        if kwargs.get("commit", True):
-            try:
-                super().commit()
-            except sqlite3.OperationalError as e:
-                logging.error(f"Database Error: Commit failed {e}")
-        self.lock.release()
+        try:
+            started = time.perf_counter()
+            cursor.executemany(sql, *args)
+            self._record_write(sql)
+            if self.mirrors:
+                self._mirror_write(sql, args[0], many=True)
+            if self.profiler is not None:
+                # The plan is explained with the first set of parameters
+                first = args[0][0] if args and isinstance(args[0], (list, tuple)) and args[0] else ()
+                self.profiler.record(self, sql, first, time.perf_counter() - started)
+        except Exception:
+            # The rows written before the failing one are undone, so a batch is applied entirely or not at all
+            if kwargs.get("commit", True):
+                super().rollback()
+                for mirror in self.mirrors.values():
+                    mirror.load(self)
+            self.lock.release()
+            raise
+        try:
+            if kwargs.get("commit", True):
+                try:
+                    super().commit()
+                except sqlite3.OperationalError as e:
+                    logging.error(f"Database Error: Commit failed {e}")
+        finally:
+            self.lock.release()
         return cursor
 
     def close(self):
@@ -330,22 +1045,27 @@ class Database(sqlite3.Connection):
         Close the connection to the database.
         Will flush all cached data to the database.
         """
+        self.disable_auto_flush()
+        self.disable_maintenance()
         for table in self.tables.values():
-            del table
+            if isinstance(table, TimeSeriesTable):  # Buffered samples are written before the connection goes away
+                try:
+                    table.flush_appends()
+                except Exception as e:
+                    logging.error(f"Unable to write the buffered samples of {table.table_name}: {e}")
+        for mirror in self.mirrors.values():
+            mirror.close()
         self.lock.acquire()
         super().close()
         self.open = False
         self.lock.release()
 
     def __del__(self):
-        if self.open:
+        if getattr(self, "open", False):
             self.close()
 
     def get(self, sql, *args) -> List[dict]:
-        cursor = self.run(sql, *args)
-        result = cursor.fetchall()
-        cursor.close()
-        return result
+        return self.run(sql, *args, fetch=True)
 
     def __gc(self):
         for table_name in list(self.tables.keys()):
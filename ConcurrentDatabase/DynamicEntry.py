@@ -1,38 +1,65 @@
 import time
+import typing
 
 from loguru import logger as logging
 
+from .BlobStream import BlobStream
+
+
+class ConflictError(RuntimeError):
+    """
+    Raised when a row of a versioned table was changed by another writer after it was loaded.
+    """
+
+    def __init__(self, message: str, index: int = None):
+        super().__init__(message)
+        self.index = index  # type: int or None  # The statement of a transaction that changed no rows
+        self.entry = None  # type: DynamicEntry or None  # The entry whose changes were rejected
+
 
 class DynamicEntry:
     """
     A class that allows you to access an entry in a database as if it were an object.
     """
 
-    def __init__(self, table, load_tuple=None, **kwargs):
+    def __init__(self, table, load_tuple=None, loaded_version=None, load_columns=None, rowid=None, **kwargs):
         self.columns = table.columns
         self.table = table
         self.database = table.database
         self.primary_keys = table.primary_keys
-        self._rowid = None
+        self._rowid = rowid
         self._values = {}
         self._previous_values = {}
         self._dirty = False
         self._deleted = False
+        self._loaded_version = loaded_version  # The table version the values were read at (coherence="version")
+        self._encoded = set()  # Columns whose values are still compressed as they were read from the database
+        self._unloaded = set()  # Columns left out of the query that loaded this entry, read when first accessed
+        self._batch = None  # type: list or None  # Weak references to the entries loaded by the same query
 
         if load_tuple is not None:
-            for i in range(len(load_tuple)):
-                if i < len(self.columns):
-                    self._values[self.columns[i].name] = load_tuple[i]
+            if load_columns is not None:  # Only some columns were selected
+                self._values = dict(zip(load_columns, load_tuple))
+                self._unloaded = {column.name for column in self.columns if column.name not in self._values}
+            else:
+                for i in range(len(load_tuple)):
+                    if i < len(self.columns):
+                        self._values[self.columns[i].name] = load_tuple[i]
+            self._encoded = {column.name for column in self.columns
+                             if column.needs_decoding and column.name in self._values}
 
         for key in kwargs:
             if key in self.columns:
                 self._values[key] = kwargs[key]
+                self._encoded.discard(key)
+                self._unloaded.discard(key)
             else:
                 raise KeyError(f"Column {key} does not exist in table {self.table.table_name}")
 
         # Add columns that were not specified and have a default value
         for column in self.columns:
-            if column.name not in self._values and column.default_value is not None:
+            if column.name not in self._values and column.name not in self._unloaded and \
+                    column.default_value is not None:
                 self._values[column.name] = column.default_value
 
         self._previous_values = self._values.copy()
@@ -41,12 +68,12 @@ class DynamicEntry:
         # This form of item setting does not access the database and is only in memory
         if isinstance(item, int):  # Select by index
             if len(self.columns) > item >= 0:
-                return self._values[self.columns[item].name]
+                return self._value(self.columns[item].name)
             else:
                 raise IndexError(f"Column index {item} is out of range for table {self.table.table_name}")
         elif isinstance(item, str):  # Select by column name
             if item in self.columns:
-                return self._values[item]
+                return self._value(item)
             else:
                 raise KeyError(f"Column {item} does not exist in table {self.table.table_name}")
         else:
@@ -61,19 +88,29 @@ class DynamicEntry:
         """
         if isinstance(key, int):  # Select by index
             if len(self.columns) > key >= 0:
-                self._dirty = True
+                self._prepare_set(self.columns[key].name)
                 self._values[self.columns[key].name] = value
+                self._mark_dirty()
             else:
                 raise IndexError(f"Column index {key} is out of range for table {self.table.table_name}")
         elif isinstance(key, str):  # Select by column name
             if key in self.columns:
-                self._dirty = True
+                self._prepare_set(key)
                 self._values[key] = value
+                self._mark_dirty()
             else:
                 raise KeyError(f"Column {key} does not exist in table {self.table.table_name}")
         else:
             raise TypeError(f"Invalid key type {type(key)}")
 
+    def _mark_dirty(self):
+        """
+        Flag the entry as having unwritten changes, and hand it to the database's auto flusher if it has one.
+        """
+        self._dirty = True
+        if self.database.auto_flusher is not None:
+            self.database.auto_flusher.mark_dirty(self)
+
     def set(self, **kwargs):
         """
         Sets the values of the entry and immediately flushes the changes to the database
@@ -83,6 +120,7 @@ class DynamicEntry:
         for key in kwargs:
             if key in self.columns:
                 self._dirty = True
+                self._prepare_set(key)
                 self._values[key] = kwargs[key]
             else:
                 raise KeyError(f"Column {key} does not exist in table {self.table.table_name}")
@@ -95,8 +133,15 @@ class DynamicEntry:
         """
         # This form of item setting accesses the database
         if key in self.columns:
-            self.refresh()
-            return self._values[key]
+            if self.database.coherence == "version":
+                # Only go to the database if the table has been written to since this entry was loaded
+                if not self._dirty and self.is_stale():
+                    self.table.refresh_stale()
+                    if self.is_stale():
+                        self.refresh()
+            else:
+                self.refresh()
+            return self._value(key)
         # If the key is not a column, check if it is a name of a foreign table
         elif key in [foreign_table.table_name for foreign_table in self.table.foreign_tables]:
             foreign_table = [foreign_table for foreign_table in
@@ -116,81 +161,309 @@ class DynamicEntry:
                 logging.warning(f"Unable to flush changes to {self.table.table_name} because the database is closed")
                 return
             # Build the query
-            changed_values = {}
-            for key in self._values:
-                if key in self._previous_values and self._values[key] != self._previous_values[key]:
-                    changed_values[key] = self._values[key]
-                elif key not in self._previous_values:
-                    changed_values[key] = self._values[key]
+            written = self._values.copy()
+            changed_values = self._changed_values(written)
             if len(changed_values) == 0:
                 return
-            sql = f"UPDATE {self.table.table_name} SET "
-            for key in changed_values:
-                sql += f"{key} = ?, "
-            sql = sql[:-2] if sql.endswith(", ") else sql  # Remove the trailing comma and space if there is one
-            sql += f" WHERE {self._entry_where_clause()}"
-            values = tuple(changed_values.values())
-            # values += [self._values[column.name] for column in self.columns if column.primary_key]
-            # print(sql, values)
+            sql, values = self._update_statement(changed_values)
             result = self.database.run(sql, values)
             if result.rowcount == 0:  # If the rowcount was 0 then the entry does not exist in the database
+                if self.table.version_column:
+                    raise ConflictError(f"Entry in table {self.table.table_name} was changed or deleted by another "
+                                        f"writer since it was loaded")
                 raise KeyError(f"Entry does not exist in table {self.table.table_name}")
-            self._dirty = False
-            self._previous_values = self._values.copy()
+            self._mark_written(written)
+            self._bump_version()
 
-    def flush_many(self) -> str:
+    def flush_many(self) -> typing.Optional[tuple]:
         """
         Called by this entry's table to flush all entries in the table in one transaction
-        :return:
+        :return: The UPDATE statement and its bound values, None if nothing changed
+        """
+        pending = self._pending_write()
+        if pending is None:
+            return None
+        sql, values, written = pending
+        self._mark_written(written)
+        return sql, values
+
+    def _pending_write(self) -> typing.Optional[tuple]:
+        """
+        Builds the UPDATE statement for the changes of this entry without marking them as written, the entry stays
+        dirty until _mark_written is called once the statement has been committed
+        :return: The SQL, its bound values and the values being written, None if nothing changed
         """
         if self._dirty:
-            # Build the query
-            changed_values = {}
-            for key in self._values:
-                if key in self._previous_values and self._values[key] != self._previous_values[key]:
-                    changed_values[key] = self._values[key]
-                elif key not in self._previous_values:
-                    changed_values[key] = self._values[key]
+            written = self._values.copy()
+            changed_values = self._changed_values(written)
             if len(changed_values) == 0:
-                return ""
-            sql = f"UPDATE {self.table.table_name} SET "
-            for key, value in changed_values.items():
-                column = self.columns[self.columns.index(key)]
-                sql += f"{key} = {column.safe_value(value)}, "
-            sql = sql[:-2] if sql.endswith(", ") else sql
-            sql += f" WHERE {self._entry_where_clause()}"
-            self._dirty = False
-            return sql
+                return None
+            sql, values = self._update_statement(changed_values)
+            return sql, values, written
+        return None
+
+    def _changed_values(self, values: dict) -> dict:
+        """
+        Gets the values that differ from the values last read from or written to the database
+        """
+        return {key: value for key, value in values.items()
+                if key not in self._previous_values or value != self._previous_values[key]}
+
+    def _mark_written(self, written: dict):
+        """
+        Records the values that were written, the entry stays dirty if another thread changed it in the meantime
+        """
+        self._dirty = False
+        self._previous_values = written
+        if self._values != written:
+            self._dirty = True
+
+    def _update_statement(self, changed_values: dict) -> tuple:
+        """
+        Build the UPDATE statement that writes the changed values of this entry
+        :return: The SQL with a ? placeholder for each value, and the values to bind to them
+        """
+        where, where_values = self._entry_where_clause()
+        version_column = self.table.version_column
+        if version_column:  # Compare and swap, the update only applies to the version that was loaded
+            self._value(version_column)
+            changed_values = {key: value for key, value in changed_values.items() if key != version_column}
+            where += f" AND {version_column} = ?"
+            where_values += (self._previous_values[version_column],)
+        sets = [f"{key} = ?" for key in changed_values]
+        if version_column:
+            sets.append(f"{version_column} = {version_column} + 1")
+        sql = f"UPDATE {self.table.table_name} SET " + ", ".join(sets) + f" WHERE {where}"
+        values = tuple(self.columns[self.columns.index(key)].encode(value) for key, value in changed_values.items())
+        return sql, values + where_values
+
+    def _bump_version(self):
+        """
+        Called after this entry's changes were written, to keep track of the version the row is now at
+        """
+        version_column = self.table.version_column
+        if version_column and self._previous_values.get(version_column) is not None:
+            self._values[version_column] = self._previous_values[version_column] + 1
+            self._previous_values[version_column] = self._values[version_column]
+
+    def discard_changes(self):
+        """
+        Drops the changes that haven't been flushed and reads the entry again from the database
+        :return:
+        """
+        version = self.table._snapshot_version()
+        where, values = self._entry_where_clause()
+        result = self.table._read(f"SELECT * FROM {self.table.table_name} WHERE {where}", values)
+        if not result:
+            raise KeyError(f"Entry does not exist in table {self.table.table_name}")
+        self._dirty = False
+        self._load(result[0], version)
+
+    def modify(self, fn, attempts: int = 5):
+        """
+        Applies a read-modify-write change to a row of a versioned table without holding any lock. fn is called with
+        the entry, sets its new values and the entry is flushed. If another writer changed the row first the entry
+        is read again and fn is called with the new values, up to attempts times.
+        :param fn: Called with the entry, it must only change the entry's values.
+        :param attempts: The maximum number of times fn is called.
+        :return: The result of the last call of fn.
+        :raises ConflictError: If every attempt conflicted with another writer.
+        """
+        if attempts < 1:
+            raise ValueError("attempts must be at least 1")
+        for attempt in range(attempts):
+            result = fn(self)
+            try:
+                self.flush()
+                return result
+            except ConflictError:
+                if attempt == attempts - 1:
+                    raise
+                self.discard_changes()
 
     def refresh(self):
         """
         Refreshes the values from the database
         :return:
         """
-        sql = f"SELECT * FROM {self.table.table_name} WHERE {self._entry_where_clause()}"
-        result = self.database.run(sql)
-        if result.rowcount == 0:
+        version = self.table._snapshot_version()
+        where, values = self._entry_where_clause()
+        result = self.table._read(f"SELECT * FROM {self.table.table_name} WHERE {where}", values)
+        row = result[0] if result else None
+        if row is None:
             raise KeyError(f"Entry does not exist in table {self.table.table_name}")
-        self._values = {self.columns[i].name: value for i, value in enumerate(result.fetchone())}
+        self._values = {self.columns[i].name: value for i, value in enumerate(row)}
+        self._encoded = {column.name for column in self.columns if column.needs_decoding}
+        self._unloaded = set()
+        self._loaded_version = version
+
+    def _load(self, row: tuple, version=None, load_columns: typing.List[str] = None):
+        """
+        Replaces the values of a clean entry with a row that was read from the database
+        :param row: The row as returned by a SELECT *
+        :param version: The table version the row was read at
+        :param load_columns: The names of the columns in the row if only some columns were selected
+        :return:
+        """
+        if load_columns is not None:  # Only the selected columns are replaced, the entry keeps its version
+            for name, value in zip(load_columns, row):
+                self._set_loaded(name, value)
+            return
+        self._values = {self.columns[i].name: value for i, value in enumerate(row) if i < len(self.columns)}
+        self._previous_values = self._values.copy()
+        self._encoded = {column.name for column in self.columns if column.needs_decoding}
+        self._unloaded = set()
+        self._loaded_version = version
+
+    def _set_loaded(self, name: str, value):
+        """
+        Stores the value of a column as read from the database
+        """
+        self._values[name] = value
+        self._previous_values[name] = value
+        self._unloaded.discard(name)
+        if self.columns[self.columns.index(name)].needs_decoding:
+            self._encoded.add(name)
+        else:
+            self._encoded.discard(name)
+
+    def _unload(self, name: str):
+        """
+        Forgets the loaded value of a column that was changed in the database, it is read again when next accessed.
+        A pending change to the column is kept.
+        """
+        if name in self._values and name in self._previous_values and \
+                self._values[name] is not self._previous_values[name] and \
+                self._values[name] != self._previous_values[name]:
+            return
+        self._values.pop(name, None)
+        self._previous_values.pop(name, None)
+        self._encoded.discard(name)
+        self._unloaded.add(name)
+
+    def _get_rowid(self) -> int:
+        """
+        Gets the rowid of this entry's row, looking it up if it wasn't selected when the entry was loaded
+        """
+        if self._rowid is None:
+            where, values = self._entry_where_clause()
+            result = self.table._read(f"SELECT rowid FROM {self.table.table_name} WHERE {where}", values)
+            if not result:
+                raise KeyError(f"Entry does not exist in table {self.table.table_name}")
+            self._rowid = result[0][0]
+        return self._rowid
+
+    def open_blob(self, column: str, mode: str = "r") -> BlobStream:
+        """
+        Opens a BLOB column of this entry as a file-like object that reads or writes it in place, a chunk at a time
+        :param column: The name of the BLOB column
+        :param mode: "r" to read, "w" to write (writes can't change the size of the blob, see ZeroBlob)
+        :return: The stream, close it once done, triggers and the row version only see the write once it is closed
+        """
+        if column not in self.columns:
+            raise KeyError(f"Column {column} does not exist in table {self.table.table_name}")
+        return BlobStream(self, column, mode)
+
+    def _prepare_set(self, name: str):
+        """
+        Called before a column is assigned, decompresses the current value so the previous value stays comparable.
+        Columns that were never loaded are not read, the assigned value is always written.
+        """
+        if name in self._unloaded:
+            self._unloaded.discard(name)
+        else:
+            self._value(name)
+
+    def _merge(self, row, values: dict, version=None):
+        """
+        Applies values that were written to the database by the table without discarding unflushed changes
+        :param row: The complete row as it is now in the database, or None if only the written values are known
+        :param values: The values that were written
+        :param version: The table version the write was made at
+        :return:
+        """
+        if row is not None and not self._dirty:
+            self._load(row, version)
+            return
+        for key in values:  # Written values take precedence over pending changes to the same column
+            self._values[key] = values[key]
+            self._previous_values[key] = values[key]
+            self._encoded.discard(key)
+            self._unloaded.discard(key)
+        if row is not None:
+            for name in list(self._encoded):
+                self._value(name)
+            for i, value in enumerate(row):
+                if i < len(self.columns):
+                    self._previous_values[self.columns[i].name] = self.columns[i].decode(value)
+                    if self.columns[i].name in self._unloaded:
+                        self._values[self.columns[i].name] = self._previous_values[self.columns[i].name]
+            self._unloaded = set()
+
+    def _value(self, name: str):
+        """
+        Gets the value of a column, loading or decompressing it the first time it is accessed
+        """
+        if name in self._unloaded:
+            self.table._load_lazy(self, name)
+        if name in self._encoded:
+            raw = self._values[name]
+            value = self.columns[self.columns.index(name)].decode(raw)
+            self._values[name] = value
+            if self._previous_values.get(name) is raw:
+                self._previous_values[name] = value
+            self._encoded.discard(name)
+        return self._values[name]
+
+    def _stored(self, name: str, previous: bool = False):
+        """
+        Gets the value of a column in the form it is stored in the database, loading it if it was left out of the query
+        """
+        if name in self._unloaded:
+            self._value(name)
+        value = self._previous_values[name] if previous else self._values[name]
+        if name in self._encoded:
+            return value
+        return self.columns[self.columns.index(name)].encode(value)
+
+    def is_stale(self) -> bool:
+        """
+        Checks if the table may have been modified since this entry was loaded
+        :return: True if the entry should be re-read before its values are trusted
+        """
+        if self._loaded_version is None:
+            return True
+        return self._loaded_version != self.database.table_version(self.table.table_name)
 
     def delete(self):
         """
         Deletes the entry from the database
         :return:
         """
-        sql = f"DELETE FROM {self.table.table_name} WHERE {self._entry_where_clause()}"
-        self.database.run(sql)
+        where, values = self._entry_where_clause()
+        self.database.run(f"DELETE FROM {self.table.table_name} WHERE {where}", values)
         del self
 
     def matches(self, **kwargs):
         """
         Checks if the entry matches the given criteria
-        :param kwargs: The criteria to check
+        :param kwargs: The criteria to check, value, [lower, upper] for ranges or (value, ...) for any of several values
         :return: True if the entry matches the criteria, False otherwise
         """
         for key in kwargs:
             if key in self.columns:
-                if self._values[key] != kwargs[key]:
+                value, criteria = self._value(key), kwargs[key]
+                column = self.columns[self.columns.index(key)]
+                if isinstance(criteria, list) and not column.accepts(criteria):
+                    try:
+                        if value is None or not criteria[0] <= value <= criteria[1]:
+                            return False
+                    except TypeError:
+                        return False
+                elif isinstance(criteria, tuple):
+                    if value not in criteria:
+                        return False
+                elif value != criteria:
                     return False
             else:
                 raise KeyError(f"Column {key} does not exist in table {self.table.table_name}")
@@ -200,32 +473,32 @@ class DynamicEntry:
         """Converts the entry to a dictionary"""
         dictionary = {}
         for column in self.columns:
-            dictionary[column.name] = self._values[column.name]
+            dictionary[column.name] = self._value(column.name)
         return dictionary
 
     def is_dirty(self):
         return self._dirty
 
-    def _entry_where_clause(self):
+    def _entry_where_clause(self) -> tuple:
         """
         Returns a complete WHERE clause to find this entry in the database even if the table has no primary keys
-        Will contain no ?'s and will be ready to be inserted into a SQL statement
-        :return:
+        :return: The clause with a ? placeholder for each value, and the values to bind to them
         """
-        primary_keys = [column.name for column in self.columns if column.primary_key]
-        primary_key_values = [self._values[column.name] for column in self.columns if column.primary_key]
-        sql = ""
         if self.primary_keys:
-            sql += " AND ".join([f"{primary_keys[i]}= {self.columns[i].safe_value(primary_key_values[i])}"
-                                 for i in range(len(primary_keys))])
-        else:  # Use all previous values (filtering out None values)
-            for column in self.columns:
-                if self._previous_values[column.name] is not None:
-                    sql += f"{column.name} = {column.safe_value(self._previous_values[column.name])} AND "
-                else:
-                    sql += f"{column.name} IS NULL AND "
-            sql = sql[:-5]
-        return sql
+            keys = [column.name for column in self.columns if column.primary_key]
+            return " AND ".join(f"{key} = ?" for key in keys), tuple(self._stored(key) for key in keys)
+        if self._rowid is not None and self._unloaded:  # Not every value is known
+            return "rowid = ?", (self._rowid,)
+        # Use all previous values (filtering out None values)
+        filters = []
+        values = ()
+        for column in self.columns:
+            if self._previous_values[column.name] is not None:
+                filters.append(f"{column.name} = ?")
+                values += (self._stored(column.name, previous=True),)
+            else:
+                filters.append(f"{column.name} IS NULL")
+        return " AND ".join(filters), values
 
     def _column_wrappers_to_sql(self):
         """
@@ -267,6 +540,13 @@ class DynamicEntry:
         """Return a hash of the primary key."""
         return hash(tuple(self.primary_keys))
 
+    def _comparison_order(self, other=None) -> list:
+        """
+        Orders the columns so the ones loaded by both entries come before those that still have to be read
+        """
+        unloaded = self._unloaded | (other._unloaded if other is not None else set())
+        return sorted(self.columns, key=lambda column: column.name in unloaded)
+
     def __eq__(self, other):
         if isinstance(other, DynamicEntry):
             if self.table.table_name != other.table.table_name:
@@ -274,22 +554,34 @@ class DynamicEntry:
             for column in self.columns:
                 if column not in other.columns:  # This would be unexpected as they should be from the same table
                     raise TypeError(f"Unexpected column {column.name} in entry {other}")
-                if self._values[column.name] != other._values[column.name]:
-                    return False
+            # Loaded columns are compared first so lazy columns are only read if the entries could still be equal
+            try:
+                for column in self._comparison_order(other):
+                    if self._value(column.name) != other._value(column.name):
+                        return False
+            except KeyError:  # The row of a partial entry no longer exists
+                return False
             return True
         elif isinstance(other, tuple):
             if len(other) != len(self.columns):
                 raise ValueError("Tuple must be the same length as the number of columns in the table")
-            for i, column in enumerate(self.columns):
-                if self._values[column.name] != other[i]:
-                    return False
+            try:
+                for column in self._comparison_order():
+                    if self._stored(column.name) != other[self.columns.index(column.name)]:
+                        return False
+            except KeyError:
+                return False
             return True
         elif isinstance(other, dict):
             for key in other:
-                if key not in self._values:
+                if key not in self._values and key not in self._unloaded:
                     raise KeyError(f"Key {key} not in entry")
-                if self._values[key] != other[key]:
-                    return False
+            try:
+                for key in sorted(other, key=lambda name: name in self._unloaded):
+                    if self._value(key) != other[key]:
+                        return False
+            except KeyError:
+                return False
             return True
         elif other is None:
             return False
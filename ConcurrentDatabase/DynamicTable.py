@@ -1,15 +1,64 @@
+import contextlib
 import datetime
+import functools
+import os
 import sqlite3
 import sys
+import threading
+import time
 import typing
+import urllib.parse
+import weakref
+from concurrent.futures import ProcessPoolExecutor
 
 from typing import List
 
+from . import Codecs, TypeAdapters
+from .BlobStream import ZeroBlob
+from .BloomFilter import BloomFilter, filter_key
+from .ChangeLog import ChangeRecord, changelog_table_name, changelog_key_columns, changelog_columns, \
+    changelog_trigger_sql, changelog_trigger_names
 from .ColumnWrapper import ColumnWrapper
 from .DynamicEntry import DynamicEntry
+from .SqlUtils import split_table_name, column_affinity, updated_columns
 
 from loguru import logger as logging
 
+# INSERT ... ON CONFLICT DO UPDATE ... RETURNING needs SQLite 3.35
+UPSERT_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+def _scan_range(path: str, table_name: str, columns: List[str], where: typing.Optional[str], start: int, end: int,
+                fn, reducer, per_chunk: bool, chunk_size: int, types: typing.Optional[List[str]] = None):
+    """
+    Scan one rowid range of a table in a worker process using its own read-only connection.
+    :param types: The declared type of each column if values are converted by their TypeAdapters converter.
+    :return: A list with the (reduced) results of fn for the range.
+    """
+    connection = sqlite3.connect(f"file:{urllib.parse.quote(path)}?mode=ro", uri=True)
+    try:
+        cursor = connection.execute(f"SELECT {', '.join(columns)} FROM {table_name} "
+                                    f"WHERE rowid >= ? AND rowid < ?{f' AND ({where})' if where else ''} "
+                                    f"ORDER BY rowid", (start, end))
+        results = []
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            if types is not None:
+                rows = [tuple(TypeAdapters.convert(column_type, value) for column_type, value in zip(types, row))
+                        for row in rows]
+            rows = [dict(zip(columns, row)) for row in rows]
+            if per_chunk:
+                results.append(fn(rows))
+            else:
+                results.extend(result for result in map(fn, rows) if result is not None)
+    finally:
+        connection.close()
+    if reducer is not None and results:
+        return [functools.reduce(reducer, results)]
+    return results
+
 
 class DynamicTable:
     """
@@ -22,11 +71,32 @@ class DynamicTable:
         self.columns = []  # type: list[ColumnWrapper]  # A list of all the columns in the table
         self.entries = []  # type: list[DynamicEntry]  # A list of all the entries that have been loaded
         self.primary_keys = []  # type: list[ColumnWrapper]  # A list of the columns that are primary keys
+        self._rowid_table = None  # type: bool or None  # Whether the table has a rowid, checked on first use
         self._load_columns()
+        # The column that counts the writes to each row, used to detect conflicting writes (see enable_versioning)
+        self.version_column = self.database.get_metadata(table_name, "version_column").get("")  # type: str or None
+        # Primary keys that exist, so lookups of missing keys can skip the query (see enable_bloom_filter)
+        self.bloom_filter = None  # type: BloomFilter or None
+        self.bloom_stats = {"lookups": 0, "skipped": 0, "false_positives": 0, "rebuilds": 0}
+        self._bloom_settings = None  # type: tuple or None  # The error rate, shared and check interval
+        self._bloom_generation = 0  # Bumped by every write that may have added keys the filter doesn't know about
+        self._bloom_built = None  # type: tuple or None  # The generation, write epoch and data version it was built at
+        self._bloom_building = None  # type: BloomFilter or None  # Also receives new keys while it is being built
+        self._bloom_data_version = None  # type: int or None  # The data version when it was last checked
+        self._bloom_checked = 0.0  # When the data version was last checked
+        self._bloom_next_rebuild = 0.0  # Rebuilds are spaced out so they take a small share of the time
+        self._bloom_thread = None  # type: threading.Thread or None  # The background rebuild
+        self._bloom_lock = threading.Lock()
+        self._bloom_local = threading.local()
 
         self.parent_tables = []  # type: list[DynamicTable]  # A list of all the tables that reference this table
         self.child_tables = []  # type: list[DynamicTable]  # A list of all the tables that this table references
 
+        # Whether INSERT/UPDATE/DELETE triggers are recording changes to this table in a changelog table
+        schema, name = split_table_name(table_name)
+        self.changelog_enabled = bool(self.database.get(
+            f"SELECT name FROM {schema}.sqlite_master WHERE type='table' AND name=?", (changelog_table_name(name),)))
+
     @property
     def foreign_tables(self):
         """
@@ -36,11 +106,15 @@ class DynamicTable:
         return self.child_tables + self.parent_tables
 
     def _load_columns(self):
-        sql = f"PRAGMA table_info({self.table_name})"  # Get the columns of the table
+        schema, name = split_table_name(self.table_name)
+        sql = f"PRAGMA {schema}.table_info({name})"  # Get the columns of the table
         columns = self.database.get(sql)
         for row in columns:
             column = ColumnWrapper(self, row)
             self.columns.append(column)
+        for column_name, codec in self.database.get_metadata(self.table_name, "codec").items():
+            if column_name in self.columns:
+                self.get_column(column_name).codec = codec
 
     def _validate_columns(self, **kwargs):
         """
@@ -53,7 +127,13 @@ class DynamicTable:
             if column not in self.columns:
                 raise KeyError(f"Column [{column}] not found in table [{self.table_name}]")
             actual_column = self.columns[self.columns.index(column)]
-            actual_column.validate(kwargs[column])
+            actual_column.validate(kwargs[column], self.database.validate)
+
+    def _encode_values(self, values: dict) -> tuple:
+        """
+        Convert the values of a row to the form they are stored in the database, in the order they were given.
+        """
+        return tuple(self.get_column(column).encode(value) for column, value in values.items())
 
     def _contains_primary_keys(self, **kwargs):
         """
@@ -65,6 +145,45 @@ class DynamicTable:
             if primary_key.name not in kwargs:
                 raise KeyError(f"Primary key [{primary_key.name}] not specified")
 
+    def _read(self, sql: str, args: tuple = (), cached: bool = False) -> list:
+        """
+        Run a read query on this table, from its in-memory copy if the table is pinned.
+        :param sql: The query.
+        :param args: The arguments to pass to the query.
+        :param cached: Allow the result to be served from the database's query cache.
+        :return: The rows.
+        """
+        mirror = self.database.mirrors.get(self.table_name)
+        if mirror is not None:
+            try:
+                return mirror.query(sql, args)
+            except sqlite3.Error as e:
+                if str(e).startswith(("no such table", "no such function")):
+                    # The query needs something that isn't in the copy, e.g. another table
+                    logging.debug(f"Reading {self.table_name} from the database, the in-memory copy can't "
+                                  f"answer: {e}")
+                else:  # The copy no longer matches the table
+                    logging.error(f"Read from the in-memory copy of {self.table_name} failed, reading from the "
+                                  f"database instead, reload_pinned() may be needed: {e}")
+        if cached:
+            return self.database.cached_get(sql, args)
+        return self.database.get(sql, args)
+
+    def _write_count(self) -> tuple:
+        """
+        Get a token that changes whenever this connection writes to the table.
+        """
+        return self.database.write_epoch, self.database.write_counters.get(self.table_name, 0)
+
+    def _snapshot_version(self):
+        """
+        Get the current version of this table if the database tracks entry staleness, to be taken before a read.
+        :return: The version token or None.
+        """
+        if self.database.coherence == "version":
+            return self.database.table_version(self.table_name)
+        return None
+
     def update_schema(self):
         """
         Update the schema of the table.
@@ -77,48 +196,64 @@ class DynamicTable:
         """
         Get an entry by the row number.
         """
-        result = self.database.get(f"SELECT * FROM {self.table_name} LIMIT 1 OFFSET {row_num}")
+        version = self._snapshot_version()
+        result = self._read(f"SELECT * FROM {self.table_name} LIMIT 1 OFFSET {row_num}")
         if result:
-            return DynamicEntry(self, load_tuple=result[0])
+            return DynamicEntry(self, load_tuple=result[0], loaded_version=version)
         else:
             return None
 
-    def get_row(self, **kwargs) -> typing.Optional[DynamicEntry]:
+    def get_row(self, columns: List[str] = None, **kwargs) -> typing.Optional[DynamicEntry]:
         """
         Get a row from the table.
+        :param columns: Only read these columns (and the primary keys), the others are read when first accessed.
         :param kwargs: The filters to apply to the query.
         :return: The row.
         """
         self._validate_columns(**kwargs)
         # self._contains_primary_keys(**kwargs)
+        exists = self._might_exist(kwargs)
+        if exists is False:  # The key has certainly never been added
+            return None
 
         # Build the query
-        sql = f"SELECT * FROM {self.table_name}"
-        if len(kwargs) > 0:
-            sql += " WHERE "
-            for column_name in kwargs:
-                column = self.columns[self.columns.index(column_name)]
-                sql += self._create_filter(column, kwargs[column_name]) + " AND "
-            sql = sql[:-5]
-        result = self.database.get(sql)
+        names = self._projection(columns)
+        sql = f"SELECT {self._select_list(names)} FROM {self.table_name}"
+        where, args = self._where_clause(**kwargs)
+        if where:
+            sql += f" WHERE {where}"
+        version = self._snapshot_version()
+        writes = self._write_count()
+        result = self._read(sql, args)
         if result:
+            row, rowid = self._split_row(result[0], names)
 
             # Check if the DynamicEntry is already loaded
+            row_names = names if names is not None else [column.name for column in self.columns]
+            row_keys = {key.name: row[row_names.index(key.name)] for key in self.primary_keys}
             for entry in self.entries:  # TODO: Fix this hacky fix to a ghost entry bug
                 if entry is None:
                     continue
-                if entry.matches(**kwargs):
+                if entry.matches(**kwargs) and entry.matches(**row_keys):
+                    # If the filter identifies exactly one row bring the cached entry up to date with it, unless
+                    # the table was written to since the row was read and the entry may be newer than the row
+                    if self.primary_keys and not entry.is_dirty() and \
+                            all(key.name in kwargs for key in self.primary_keys) and self._write_count() == writes:
+                        entry._load(row, version, names)
                     return entry
 
-            entry = DynamicEntry(self, load_tuple=result[0])
+            entry = DynamicEntry(self, load_tuple=row, loaded_version=version, load_columns=names, rowid=rowid)
             self.entries.append(entry)
             return entry
         else:
+            if exists:
+                self.bloom_stats["false_positives"] += 1
             return None
 
-    def get_rows(self, **kwargs) -> List[DynamicEntry]:
+    def get_rows(self, columns: List[str] = None, **kwargs) -> List[DynamicEntry]:
         """
         Get a set of rows from the table.
+        :param columns: Only read these columns (and the primary keys), the others are read when first accessed.
         :param kwargs: The filters to apply to the query.
         :return: The row.
         """
@@ -126,32 +261,129 @@ class DynamicTable:
         self._validate_columns(**kwargs)
 
         # Build the query
-        sql = f"SELECT * FROM {self.table_name}"
-        if len(kwargs) > 0:
-            sql += " WHERE "
-            for column_name in kwargs:
-                column = self.columns[self.columns.index(column_name)]
-                sql += self._create_filter(column, kwargs[column]) + " AND "
-            sql = sql[:-5]
-        result = self.database.get(sql)
+        names = self._projection(columns)
+        sql = f"SELECT {self._select_list(names)} FROM {self.table_name}"
+        where, args = self._where_clause(**kwargs)
+        if where:
+            sql += f" WHERE {where}"
+        version = self._snapshot_version()
+        result = self._read(sql, args)
         if result:
-            entries = [DynamicEntry(self, load_tuple=row) for row in result]
+            entries = self._entries_from(result, names, version)
             self.entries.extend(entries)
             return entries
         else:
             return []
 
-    def get_all(self, reverse=False) -> List[DynamicEntry]:
+    def _has_rowid(self) -> bool:
+        """
+        Check if the table has a rowid, tables created WITHOUT ROWID don't.
+        """
+        if self._rowid_table is None:
+            schema, name = split_table_name(self.table_name)
+            sql = self.database.get(f"SELECT sql FROM {schema}.sqlite_master WHERE type='table' AND name=?", (name,))
+            self._rowid_table = not sql or "WITHOUT ROWID" not in (sql[0][0] or "").upper()
+        return self._rowid_table
+
+    def _projection(self, columns: typing.Optional[List[str]]) -> typing.Optional[List[str]]:
+        """
+        Get the names of the columns to select for a projection, the primary keys are always included.
+        :param columns: The requested columns, None for every column.
+        :return: The column names, None to select every column.
+        """
+        if columns is None:
+            return None
+        for column in columns:
+            if column not in self.columns:
+                raise KeyError(f"Column [{column}] not found in table [{self.table_name}]")
+        names = [key.name for key in self.primary_keys]
+        if self.version_column:  # Needed to flush changes
+            names.append(self.version_column)
+        names += [column for column in columns if column not in names]
+        return names
+
+    def _select_list(self, names: typing.Optional[List[str]]) -> str:
+        if names is None:
+            return "*"
+        # The rowid is selected so the other columns can be read later
+        return ", ".join((["rowid"] if self._has_rowid() else []) + names)
+
+    def _split_row(self, row: tuple, names: typing.Optional[List[str]]) -> tuple:
+        """
+        Separate the rowid from the values of a row selected with _select_list.
+        :return: The values and the rowid (None if it wasn't selected).
+        """
+        if names is not None and self._has_rowid():
+            return row[1:], row[0]
+        return row, None
+
+    def _entries_from(self, rows: list, names: typing.Optional[List[str]], version) -> List[DynamicEntry]:
+        """
+        Build the entries of rows selected with _select_list, partial entries loaded together remember each other so
+        a column missing from one of them is read for all of them at once.
+        """
+        if names is None:
+            return [DynamicEntry(self, load_tuple=row, loaded_version=version) for row in rows]
+        entries = []
+        batch = []
+        for row in rows:
+            values, rowid = self._split_row(row, names)
+            entry = DynamicEntry(self, load_tuple=values, loaded_version=version, load_columns=names, rowid=rowid)
+            entry._batch = batch
+            batch.append(weakref.ref(entry))
+            entries.append(entry)
+        return entries
+
+    def _load_lazy(self, entry: DynamicEntry, name: str):
+        """
+        Read a column that was left out of the query that loaded an entry, along with the same column of every other
+        entry loaded by that query.
+        :raises KeyError: If the row of the entry no longer exists.
+        """
+        pending = [entry]
+        if entry._rowid is not None and entry._batch is not None:
+            pending += [other for other in (ref() for ref in entry._batch)
+                        if other is not None and other is not entry and name in other._unloaded and
+                        other._rowid is not None]
+        if entry._rowid is None:  # Without a rowid the entry is found by its primary keys
+            where, values = entry._entry_where_clause()
+            result = self._read(f"SELECT {name} FROM {self.table_name} WHERE {where}", values)
+            if not result:
+                raise KeyError(f"Entry does not exist in table {self.table_name}")
+            entry._set_loaded(name, result[0][0])
+            return
+        for start in range(0, len(pending), 500):
+            chunk = pending[start:start + 500]
+            result = self._read(f"SELECT rowid, {name} FROM {self.table_name} "
+                                f"WHERE rowid IN ({', '.join(['?'] * len(chunk))})",
+                                tuple(other._rowid for other in chunk))
+            values = dict(result)
+            for other in chunk:
+                if other._rowid in values:
+                    other._set_loaded(name, values[other._rowid])
+        if name in entry._unloaded:
+            raise KeyError(f"Entry does not exist in table {self.table_name}")
+
+    def get_all(self, reverse=False, columns: List[str] = None) -> List[DynamicEntry]:
         """
         Get all rows from the table. This is not recommended for large tables.
+        :param columns: Only read these columns (and the primary keys), the others are read when first accessed.
         :return: The rows.
         """
-        db_load = self.database.get(f"SELECT * FROM {self.table_name} ORDER BY rowid {'DESC' if reverse else 'ASC'}")
+        version = self._snapshot_version()
+        if columns is not None:
+            names = self._projection(columns)
+            entries = self._entries_from(
+                self._read(f"SELECT {self._select_list(names)} FROM {self.table_name} "
+                           f"ORDER BY rowid {'DESC' if reverse else 'ASC'}"), names, version)
+            self.entries.extend(entries)
+            return entries
+        db_load = self._read(f"SELECT * FROM {self.table_name} ORDER BY rowid {'DESC' if reverse else 'ASC'}")
         if db_load:  # Append any new entries to self.entries and don't overwrite pre-existing entries
             for entry in self.entries:
                 if entry not in db_load:
                     db_load.append(entry)
-            new_entries = [DynamicEntry(self, load_tuple=row) for row in db_load]
+            new_entries = [DynamicEntry(self, load_tuple=row, loaded_version=version) for row in db_load]
             self.entries.extend(new_entries)
             return self.entries
         else:
@@ -178,9 +410,10 @@ class DynamicTable:
         local_key, foreign_key = link.get_foreign_key(self)
         # Get the entries that reference the entry
         sql = f"SELECT * FROM {self.table_name} WHERE {local_key.name} = {entry[foreign_key.name]}"
-        result = self.database.get(sql)
+        version = self._snapshot_version()
+        result = self._read(sql)
         if result:
-            entries = [DynamicEntry(self, load_tuple=row) for row in result]
+            entries = [DynamicEntry(self, load_tuple=row, loaded_version=version) for row in result]
             for entry in entries:
                 if entry not in self.entries:
                     self.entries.append(entry)
@@ -188,23 +421,94 @@ class DynamicTable:
         else:
             return []
 
-    def select(self, where: str, limit: int = -1, offset: int = 0, order_by: str = None) -> List[DynamicEntry]:
+    def join(self, other, how: str = "inner", columns: List[str] = None,
+             **kwargs) -> typing.Iterator[dict]:
+        """
+        Read the rows of this table together with the linked rows of another table in a single query. The join
+        condition comes from the foreign key (or declared link) between the two tables.
+        :param other: The table, or the name of the table, to join with (not this table itself).
+        :param how: "inner" to only return rows with a match in both tables, "left" to also return the rows of this
+         table that have no match (with None for the other table's columns).
+        :param columns: The columns to return, as "table.column" or just "column" if the name is only in one
+         table. Defaults to every column of both tables.
+        :param kwargs: Filters on the columns of either table, named like columns. Use **{"table.column": value}
+         for a column name that is in both tables (a plain name filters this table).
+        :return: An iterator of dictionaries of "table.column" names to values for each joined row.
+        """
+        if isinstance(other, str):
+            other = self.database.get_table(other)
+        if how not in ("inner", "left"):
+            raise ValueError(f"Unknown join type {how}")
+        if other is self:  # Both sides would share their "table.column" names, use custom_query with aliases
+            raise ValueError(f"Table [{self.table_name}] can't be joined with itself")
+        link = [link for link in self.database.table_links if link.has_link(self, other)]
+        if len(link) == 0:
+            raise ValueError(f"Table [{self.table_name}] is not linked to table [{other.table_name}]")
+        elif len(link) > 1:
+            raise ValueError(f"Table [{self.table_name}] has multiple links to table [{other.table_name}]")
+        local_key, foreign_key = link[0].get_foreign_key(self)
+        # Short aliases keep the query valid for tables inside attached databases (schema.table)
+        sides = {self.table_name: (self, "a"), other.table_name: (other, "b")}
+
+        def resolve(name: str) -> typing.Tuple[DynamicTable, ColumnWrapper, str]:
+            table_name, _, column_name = name.rpartition(".")
+            if table_name:
+                if table_name not in sides:
+                    raise KeyError(f"Table [{table_name}] is not part of the join")
+                table, alias = sides[table_name]
+            else:
+                table, alias = sides[self.table_name] if column_name in self.columns else sides[other.table_name]
+            if column_name not in table.columns:
+                raise KeyError(f"Column [{column_name}] not found in table [{table.table_name}]")
+            return table, table.get_column(column_name), alias
+
+        if columns is None:
+            columns = [f"{table.table_name}.{column.name}" for table in (self, other) for column in table.columns]
+        selected = [resolve(name) for name in columns]
+        filters, args = [], ()
+        for name, value in kwargs.items():
+            table, column, alias = resolve(name)
+            column.validate(value, self.database.validate)
+            sql, values = table._create_filter(column, value, alias)
+            filters.append(sql)
+            args += values
+        for table in (self, other):
+            if table.has_dirty_entries():
+                table.flush()
+        sql = f"SELECT {', '.join(f'{alias}.{column.name}' for _, column, alias in selected)} " \
+              f"FROM {self.table_name} AS a {'LEFT JOIN' if how == 'left' else 'JOIN'} {other.table_name} AS b " \
+              f"ON a.{local_key.name} = b.{foreign_key.name}"
+        if filters:
+            sql += " WHERE " + " AND ".join(filters)
+        keys = [f"{table.table_name}.{column.name}" for table, column, _ in selected]
+        for row in self.database.get(sql, args):
+            yield {key: column.decode(value) for key, (_, column, _), value in zip(keys, selected, row)}
+
+    def select(self, where: str, limit: int = -1, offset: int = 0, order_by: str = None,
+               columns: List[str] = None) -> List[DynamicEntry]:
         """
         Select rows from the table.
         :param where: The where clause of the query.
         :param limit: The limit of the query.
         :param offset: The offset of the query.
         :param order_by: The order by clause of the query.
+        :param columns: Only read these columns (and the primary keys), the others are read when first accessed.
         :return: The rows.
         :Note this method has no query validation
         """
-        result = self.database.get(f"SELECT * FROM {self.table_name} WHERE {where}"
-                                   f"{f' ORDER BY {order_by}' if order_by else ''}"
-                                   f"{f' LIMIT {limit}' if limit > 0 else ''}"
-                                   f"{f' OFFSET {offset}' if offset > 0 else ''}")
-        if result:
+        version = self._snapshot_version()
+        names = self._projection(columns)
+        result = self._read(f"SELECT {self._select_list(names)} FROM {self.table_name} WHERE {where}"
+                            f"{f' ORDER BY {order_by}' if order_by else ''}"
+                            f"{f' LIMIT {limit}' if limit > 0 else ''}"
+                            f"{f' OFFSET {offset}' if offset > 0 else ''}", cached=True)
+        if result and names is not None:
+            entries = self._entries_from(result, names, version)
+            self.entries.extend(entries)
+            return entries
+        elif result:
             # Check if some of the entries are already loaded
-            entries = [DynamicEntry(self, load_tuple=row) for row in result]
+            entries = [DynamicEntry(self, load_tuple=row, loaded_version=version) for row in result]
             for entry in entries:
                 if entry not in self.entries:
                     self.entries.append(entry)
@@ -212,13 +516,55 @@ class DynamicTable:
         else:
             return []
 
+    def parallel_scan(self, fn, where: str = None, workers: int = None, reducer=None, initial=None,
+                      per_chunk: bool = False, chunk_size: int = 1000):
+        """
+        Scan the table in parallel worker processes, each reading a range of rowids through its own read-only
+        connection so the scan doesn't hold the database lock.
+        :param fn: Called with each row as a dict (or with a list of up to chunk_size rows if per_chunk is set),
+         results that are None are dropped. Must be picklable, so a module level function.
+        :param where: An optional where clause to filter the rows with.
+        :param workers: The number of worker processes (defaults to the number of CPUs).
+        :param reducer: An optional function combining two results, applied in the workers and then to the partial
+         results of each worker. Must be picklable.
+        :param initial: The initial value for the reducer.
+        :param per_chunk: Call fn with lists of rows instead of single rows.
+        :param chunk_size: The number of rows read (and passed to fn when per_chunk is set) at once.
+        :return: The reduced result if a reducer is given, otherwise a list of all results in rowid order.
+        :Note this method has no query validation, and only sees changes that have been committed
+        """
+        if self.database.database_name == ":memory:" or self.database.database_name == "":
+            raise ValueError("Parallel scans need a database file that other processes can open")
+        if self.has_dirty_entries():
+            self.flush()
+        workers = workers or os.cpu_count() or 1
+        bounds = self.database.get(f"SELECT MIN(rowid), MAX(rowid) FROM {self.table_name}")[0]
+        results = []
+        if bounds[0] is not None:
+            # Split into more ranges than workers so an uneven distribution of rows balances out
+            step = max(1, -(-(bounds[1] - bounds[0] + 1) // (workers * 4)))
+            ranges = [(start, start + step) for start in range(bounds[0], bounds[1] + 1, step)]
+            columns = [column.name for column in self.columns]
+            types = [column.type for column in self.columns] if self.database.type_adapters else None
+            path = os.path.abspath(self.database.database_name)
+            with ProcessPoolExecutor(max_workers=min(workers, len(ranges))) as executor:
+                futures = [executor.submit(_scan_range, path, self.table_name, columns, where, start, end,
+                                           fn, reducer, per_chunk, chunk_size, types) for start, end in ranges]
+                for future in futures:
+                    results.extend(future.result())
+        if reducer is None:
+            return results
+        if initial is not None:
+            return functools.reduce(reducer, results, initial)
+        return functools.reduce(reducer, results) if results else None
+
     def custom_query(self, sql: str) -> sqlite3.Cursor:
         """
-        Run a custom query on the table.
+        Run a custom query on the table, read queries are served from the query cache if it is enabled.
         :param sql: The query to run.
         :return: The result of the query.
         """
-        return self.database.get(sql)
+        return self.database.cached_get(sql)
 
     def add(self, **kwargs) -> DynamicEntry:
         """
@@ -235,14 +581,33 @@ class DynamicTable:
         for column in kwargs:
             sql += f"{column}, "
         sql = sql[:-2] + ") VALUES ("
-        for _ in kwargs:
-            sql += "?, "
+        zero_blobs = [column for column in kwargs if isinstance(kwargs[column], ZeroBlob)]
+        for column in kwargs:
+            # Zero filled blobs are allocated by SQLite so the bytes never exist in memory
+            sql += "zeroblob(?), " if column in zero_blobs else "?, "
         sql = sql[:-2] + ")"
+        values = tuple(kwargs[column].size if column in zero_blobs else self.get_column(column).encode(kwargs[column])
+                       for column in kwargs)
         try:
-            self.database.run(sql, tuple(kwargs.values()))
+            with self._maintaining_bloom_filter():
+                cursor = self.database.run(sql, values)
         except sqlite3.IntegrityError as e:
             raise ValueError(f"Integrity error: {e}")
-        entry = self.get_row(**kwargs)
+        given_keys = all(key.name in kwargs for key in self.primary_keys)
+        if given_keys:  # Before get_row, so the filter doesn't rule the new row out
+            self._bloom_add([kwargs])
+        if zero_blobs:  # Load the new row by its rowid without reading the blobs
+            names = self._projection([column.name for column in self.columns if column.name not in zero_blobs])
+            version = self._snapshot_version()
+            result = self._read(f"SELECT {self._select_list(names)} FROM {self.table_name} WHERE rowid = ?",
+                                (cursor.lastrowid,))
+            if not result:
+                raise RuntimeError(f"Failed to add row to table [{self.table_name}]")
+            entry = self._entries_from(result, names, version)[0]
+        else:
+            entry = self.get_row(**kwargs)
+        if not given_keys and entry is not None:  # Keys assigned by the database, e.g. an INTEGER PRIMARY KEY
+            self._bloom_add([{key.name: entry[key.name] for key in self.primary_keys}])
         self.entries.append(entry)
         return entry
 
@@ -257,14 +622,127 @@ class DynamicTable:
         self._contains_primary_keys(**kwargs)
         # Use get_row only on the primary keys included in the kwargs
         primary_keys = {key: kwargs[key] for key in kwargs if key in self.primary_keys}
-        row = self.get_row(**primary_keys)
-        if row:
-            # print(f"Updating row {row}")
-            row.set(**kwargs)
-            return row
+        if self._might_exist(primary_keys) is False:
+            return self.add(**kwargs)
+        if not self.primary_keys or not UPSERT_RETURNING:
+            row = self.get_row(**primary_keys)
+            if row:
+                row.set(**kwargs)
+                return row
+            else:
+                return self.add(**kwargs)
+
+        version = self._snapshot_version()
+        if self._covers_required_columns(kwargs):
+            # Insert or update the row in a single statement and get the resulting row back
+            sql, values = self._upsert_sql(list(kwargs)) + " RETURNING *", self._encode_values(kwargs)
         else:
-            # print("Adding row")
+            # SQLite checks NOT NULL on the proposed row before resolving the conflict, so a partial update has to be
+            # an UPDATE and the row is only added if none was changed
+            sql = self._update_sql(list(kwargs)) + " RETURNING *"
+            values = self._encode_values({key: value for key, value in kwargs.items()
+                                          if key not in primary_keys and key != self.version_column}) + \
+                self._encode_values(primary_keys)
+        try:
+            with self._maintaining_bloom_filter():
+                result = self.database.get(sql, values)
+        except sqlite3.IntegrityError as e:
+            raise ValueError(f"Integrity error: {e}")
+        if not result and not self._covers_required_columns(kwargs):
             return self.add(**kwargs)
+        self._bloom_add([primary_keys])
+        if not result:
+            raise RuntimeError(f"Failed to update or add row in table [{self.table_name}]")
+        for entry in self.entries:
+            if entry is not None and entry.matches(**primary_keys):
+                entry._merge(result[0], kwargs, version)
+                return entry
+        entry = DynamicEntry(self, load_tuple=result[0], loaded_version=version)
+        self.entries.append(entry)
+        return entry
+
+    def upsert_many(self, rows: typing.Iterable[dict], chunk_size: int = 500) -> int:
+        """
+        Update or add many rows, each chunk of rows is written in a single transaction.
+        :param rows: The values of each row, every row must contain the primary keys of the table.
+        :param chunk_size: The number of rows written per transaction.
+        :return: The number of rows written.
+        """
+        rows = list(rows)
+        for row in rows:
+            self._validate_columns(**row)
+            self._contains_primary_keys(**row)
+        if not self.primary_keys or not UPSERT_RETURNING:
+            for row in rows:
+                self.update_or_add(**row)
+            return len(rows)
+
+        # Rows are grouped by the columns they set as each group needs its own statement
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(row.keys()), []).append(row)
+        key_names = [key.name for key in self.primary_keys]
+        loaded = {tuple(entry[name] for name in key_names): entry for entry in self.entries if entry is not None}
+        for columns, group in groups.items():
+            if not self._covers_required_columns(dict.fromkeys(columns)):  # Partial updates go row by row
+                for row in group:
+                    self.update_or_add(**row)
+                continue
+            sql = self._upsert_sql(list(columns))
+            for start in range(0, len(group), chunk_size):
+                chunk = group[start:start + chunk_size]
+                try:
+                    with self._maintaining_bloom_filter():
+                        self.database.run_many(sql, [self._encode_values(row) for row in chunk])
+                except sqlite3.IntegrityError as e:
+                    raise ValueError(f"Integrity error: {e}")
+                self._bloom_add(chunk)
+                # Keep any loaded entries in step with what was written
+                for row in chunk:
+                    entry = loaded.get(tuple(row[name] for name in key_names))
+                    if entry is not None:
+                        entry._merge(None, row)
+                        entry._bump_version()
+        return len(rows)
+
+    def _covers_required_columns(self, values: dict) -> bool:
+        """
+        Check if the values set every NOT NULL column that has no default, so they can be inserted as a new row.
+        """
+        return all(column.name in values for column in self.columns
+                   if column.not_null and column.default_value in (None, "") and not column.primary_key)
+
+    def _update_sql(self, columns: List[str]) -> str:
+        """
+        Build an UPDATE statement of the row with the given primary keys for the given columns.
+        :param columns: The columns being set, must include the primary keys.
+        :return: The SQL with a ? placeholder for each column that isn't a key followed by one for each key.
+        """
+        key_names = [key.name for key in self.primary_keys]
+        updates = [column for column in columns if column not in key_names]
+        sets = [f"{column} = ?" for column in updates if column != self.version_column]
+        if self.version_column:
+            sets.append(f"{self.version_column} = {self.version_column} + 1")
+        if not sets:  # Still "update" the row so RETURNING yields an existing row
+            sets = [f"{key_names[0]} = {key_names[0]}"]
+        return f"UPDATE {self.table_name} SET {', '.join(sets)} " \
+               f"WHERE {' AND '.join(f'{key} = ?' for key in key_names)}"
+
+    def _upsert_sql(self, columns: List[str]) -> str:
+        """
+        Build an INSERT ... ON CONFLICT DO UPDATE statement for the given columns.
+        :param columns: The columns being set, must include the primary keys.
+        :return: The SQL with a ? placeholder for each column.
+        """
+        key_names = [key.name for key in self.primary_keys]
+        updates = [column for column in columns if column not in key_names]
+        if not updates:  # Still "update" the row so RETURNING yields existing rows
+            updates = key_names[:1]
+        sets = [f"{column} = excluded.{column}" for column in updates if column != self.version_column]
+        if self.version_column:
+            sets.append(f"{self.version_column} = {self.version_column} + 1")
+        return f"INSERT INTO {self.table_name} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))}) " \
+               f"ON CONFLICT ({', '.join(key_names)}) DO UPDATE SET {', '.join(sets)}"
 
     def delete(self, **kwargs):
         """
@@ -283,13 +761,10 @@ class DynamicTable:
 
         # Build the query
         sql = f"DELETE FROM {self.table_name}"
-        if len(kwargs) > 0:
-            sql += " WHERE "
-            for column_name in kwargs:
-                column = self.columns[self.columns.index(column_name)]
-                sql += self._create_filter(column, kwargs[column]) + " AND "
-            sql = sql[:-5]
-        result = self.database.run(sql)
+        where, args = self._where_clause(**kwargs)
+        if where:
+            sql += f" WHERE {where}"
+        result = self.database.run(sql, args)
         if result.rowcount == 0:
             raise ValueError(f"No rows were deleted from table [{self.table_name}]")
         elif result.rowcount > 1:
@@ -303,35 +778,614 @@ class DynamicTable:
         :param kwargs:
         :return:
         """
-        # For each column validate that it is a valid column and that the constraints are met.
-        self._validate_columns(**kwargs)
-
         if len(kwargs) == 0:
             raise ValueError("Must specify at least one column filter for delete_many")
+        self.delete_where(**kwargs)
 
-        entries = self.get_rows(**kwargs)
-        for entry in entries:
-            self.entries.remove(entry)
+    def _chunked_write(self, sql: str, args: tuple, where: str, where_args: tuple, chunk_size: int) -> int:
+        """
+        Run an UPDATE or DELETE on the rows matching a where clause, chunk_size rows at a time. Chunks are bounded by
+        rowid so each statement touches a small contiguous range and the lock is released between chunks.
+        :param sql: The statement without its WHERE clause.
+        :param args: The arguments of the statement.
+        :param where: The where clause selecting the rows, empty for every row.
+        :param where_args: The arguments of the where clause.
+        :param chunk_size: The maximum number of rows written per statement.
+        :return: The number of rows written.
+        """
+        if chunk_size is None or not self._has_rowid():
+            result = self.database.run(sql + (f" WHERE {where}" if where else ""), args + where_args)
+            return max(result.rowcount, 0)
+        written = 0
+        start = None  # Every row up to and including this rowid has been written
+        while True:
+            filters = (["rowid > ?"] if start is not None else []) + ([f"({where})"] if where else [])
+            start_args = (start,) if start is not None else ()
+            bounds = self._read(f"SELECT MAX(rowid), COUNT(*) FROM (SELECT rowid FROM {self.table_name}"
+                                f"{' WHERE ' + ' AND '.join(filters) if filters else ''} ORDER BY rowid LIMIT ?)",
+                                start_args + where_args + (chunk_size,))
+            if not bounds or bounds[0][0] is None:
+                break
+            end, count = bounds[0]
+            result = self.database.run(f"{sql} WHERE {' AND '.join(['rowid <= ?'] + filters)}",
+                                       args + (end,) + start_args + where_args)
+            # Counted from the statement, rows may have changed since they were counted as the lock was released
+            written += max(result.rowcount, 0)
+            if count < chunk_size:
+                break
+            start = end
+        return written
 
-        # Build the query
-        sql = f"DELETE FROM {self.table_name}"
-        if len(kwargs) > 0:
-            sql += " WHERE "
-            for column_name in kwargs:
-                column = self.columns[self.columns.index(column_name)]
-                sql += self._create_filter(column, kwargs[column]) + " AND "
-            sql = sql[:-5]
-        self.database.run(sql)
+    def update_where(self, values: dict, chunk_size: int = 1000, **kwargs) -> int:
+        """
+        Set columns of every row matching the filters without loading the rows.
+        :param values: A dictionary of the columns to set and their new values.
+        :param chunk_size: The maximum number of rows updated per statement, None to update every row at once.
+        :param kwargs: The filters the rows must match, none to update every row.
+        :return: The number of rows updated.
+        """
+        if not values:
+            raise ValueError("Must specify at least one column to update")
+        self._validate_columns(**values)
+        self._validate_columns(**kwargs)
+        where, where_args = self._where_clause(**kwargs)
+        sets = [f"{key} = ?" for key in values]
+        if self.version_column:
+            sets.append(f"{self.version_column} = {self.version_column} + 1")
+        updated = self._chunked_write(f"UPDATE {self.table_name} SET {', '.join(sets)}",
+                                      self._encode_values(values), where, where_args, chunk_size)
+        # Loaded entries that match are brought up to date without reading the rows back
+        for entry in self.entries:
+            if entry is not None and entry.matches(**kwargs):
+                entry._merge(None, dict(values))
+                entry._bump_version()
+        return updated
+
+    def delete_where(self, chunk_size: int = 1000, **kwargs) -> int:
+        """
+        Delete every row matching the filters without loading the rows.
+        :param chunk_size: The maximum number of rows deleted per statement, None to delete every row at once.
+        :param kwargs: The filters the rows must match.
+        :return: The number of rows deleted.
+        """
+        if len(kwargs) == 0:
+            raise ValueError("Must specify at least one column filter for delete_where")
+        self._validate_columns(**kwargs)
+        where, where_args = self._where_clause(**kwargs)
+        deleted = self._chunked_write(f"DELETE FROM {self.table_name}", (), where, where_args, chunk_size)
+        self.entries = [entry for entry in self.entries if entry is not None and not entry.matches(**kwargs)]
+        return deleted
+
+    def refresh_stale(self):
+        """
+        Re-read every clean loaded entry that may have been modified since it was loaded, in as few queries as possible.
+        :return: None
+        """
+        version = self._snapshot_version()
+        stale = [entry for entry in self.entries
+                 if entry is not None and not entry.is_dirty() and
+                 (version is None or entry._loaded_version != version)]
+        if not stale:
+            return
+        if not self.primary_keys:  # Without primary keys there is no way to batch the lookups
+            for entry in stale:
+                entry.refresh()
+            return
+        key_names = [key.name for key in self.primary_keys]
+        key_positions = [self.columns.index(key.name) for key in self.primary_keys]
+        by_key = {tuple(entry[name] for name in key_names): entry for entry in stale}
+        keys = list(by_key.keys())
+        for start in range(0, len(keys), 250):  # Stay well below the maximum number of bound variables
+            chunk = keys[start:start + 250]
+            placeholders = ", ".join(["(" + ", ".join(["?"] * len(key_names)) + ")"] * len(chunk))
+            sql = f"SELECT * FROM {self.table_name} WHERE ({', '.join(key_names)}) IN (VALUES {placeholders})"
+            for row in self._read(sql, tuple(value for key in chunk for value in key)):
+                entry = by_key.get(tuple(row[position] for position in key_positions))
+                if entry is not None:
+                    entry._load(row, version)
 
     def flush(self):
         """
         Flush all dirty DynamicEntries to the database.
         :return:
         """
-        queries = []
-        for entry in self.entries:
-            queries.append(entry.flush_many())
-        self.database.batch_transaction(queries)
+        self.database.flush_entries(self.entries)
+
+    def enable_changelog(self):
+        """
+        Start recording every insert, update and delete on this table in a changelog table.
+        The changelog is maintained by triggers so changes made outside of this library are recorded as well.
+        :return: None
+        """
+        if self.changelog_enabled:
+            return
+        self.database.create_table(changelog_table_name(self.table_name), changelog_columns(self))
+        self.database.transaction([(trigger, ()) for trigger in changelog_trigger_sql(self)])
+        self.changelog_enabled = True
+
+    def disable_changelog(self):
+        """
+        Stop recording changes to this table and drop its changelog.
+        :return: None
+        """
+        if not self.changelog_enabled:
+            return
+        for trigger in changelog_trigger_names(self.table_name):
+            self.database.run(f"DROP TRIGGER IF EXISTS {trigger}")
+        self.database.get_table(changelog_table_name(self.table_name))  # Make sure the changelog is loaded
+        self.database.drop_table(changelog_table_name(self.table_name))
+        self.changelog_enabled = False
+
+    def changes_since(self, seq: int = 0, limit: int = -1) -> List[ChangeRecord]:
+        """
+        Get the changes made to this table after the given sequence number.
+        :param seq: The sequence number of the last change the consumer has seen (0 for all changes).
+        :param limit: The maximum number of changes to return.
+        :return: The changes in the order they were made.
+        """
+        if not self.changelog_enabled:
+            raise RuntimeError(f"Changelog is not enabled for table [{self.table_name}]")
+        key_columns = changelog_key_columns(self)
+        result = self.database.get(f"SELECT seq, operation, changed_at, {', '.join(key_columns)} "
+                                   f"FROM {changelog_table_name(self.table_name)} WHERE seq > ? ORDER BY seq"
+                                   f"{f' LIMIT {limit}' if limit > 0 else ''}", (seq,))
+        return [ChangeRecord(key_columns, row) for row in result]
+
+    def latest_change(self) -> int:
+        """
+        Get the sequence number of the most recent change, consumers can start from here to skip the backlog.
+        :return: The sequence number (0 if no changes have been recorded).
+        """
+        if not self.changelog_enabled:
+            raise RuntimeError(f"Changelog is not enabled for table [{self.table_name}]")
+        result = self.database.get(f"SELECT MAX(seq) FROM {changelog_table_name(self.table_name)}")
+        return result[0][0] or 0
+
+    def prune_changelog(self, seq: int):
+        """
+        Remove all changes up to and including the given sequence number from the changelog.
+        :param seq: The sequence number that all consumers have processed.
+        :return: None
+        """
+        if not self.changelog_enabled:
+            raise RuntimeError(f"Changelog is not enabled for table [{self.table_name}]")
+        self.database.run(f"DELETE FROM {changelog_table_name(self.table_name)} WHERE seq <= ?", (seq,))
+
+    @property
+    def materialized_aggregates(self) -> List[str]:
+        """
+        Get the names of the materialized aggregates maintained over this table.
+        """
+        schema, table_name = split_table_name(self.table_name)
+        prefix = f"{schema}." if schema != "main" else ""
+        triggers = self.database.get(f"SELECT name FROM {schema}.sqlite_master WHERE type='trigger' AND tbl_name=?",
+                                     (table_name,))
+        return [prefix + trigger[0][:-len("_agg_insert")] for trigger in triggers
+                if trigger[0].endswith("_agg_insert")]
+
+    def create_materialized_aggregate(self, name: str, group_by: List[str], sum: List[str] = None,
+                                      count: bool = True) -> "DynamicTable":
+        """
+        Create a table holding per group totals of this table that is kept up to date by triggers, so reading an
+        aggregate never scans this table.
+        :param name: The name of the aggregate table, tables in an attached database need an aggregate in the same
+         database (e.g. "archive.totals").
+        :param group_by: The columns to group the rows of this table by, these are the primary keys of the aggregate.
+        :param sum: The columns to keep a running total of, stored in the aggregate as sum_<column>.
+        :param count: Name the number of rows in each group "count" (otherwise it is kept as "_count").
+        :return: The aggregate table, groups can be read with get_row(**group).
+        """
+        sum = sum or []
+        if not group_by:
+            raise ValueError("A materialized aggregate needs at least one column to group by")
+        schema, table_name = split_table_name(self.table_name)
+        aggregate_schema, local_name = split_table_name(name)
+        if aggregate_schema != schema:  # Triggers can only write to tables in their own database
+            raise ValueError(f"The aggregate of [{self.table_name}] must be in the same database, "
+                             f"e.g. {schema + '.' if schema != 'main' else ''}{local_name}")
+        prefix = f"{schema}." if schema != "main" else ""
+        for column_name in group_by + sum:
+            if column_name not in self.columns:
+                raise KeyError(f"Column [{column_name}] not found in table [{self.table_name}]")
+        count_column = "count" if count else "_count"
+        columns = {column_name: self.get_column(column_name).type for column_name in group_by}
+        for column_name in sum:
+            columns[f"sum_{column_name}"] = self.get_column(column_name).type
+        columns[count_column] = "INTEGER"
+        existed = bool(self.database.get(f"SELECT 1 FROM {schema}.sqlite_master WHERE type='table' AND name=?",
+                                         (local_name,)))
+        aggregate = self.database.create_table(name, columns, group_by)
+
+        # NULL groups can't be found with =, IS matches them
+        def group_match(row):
+            return " AND ".join(f"{column_name} IS {row}.{column_name}" for column_name in group_by)
+
+        def add_row(row):
+            return f"INSERT INTO {local_name} ({', '.join(columns)}) " \
+                   f"SELECT {', '.join(f'{row}.{column_name}' for column_name in group_by)}, " \
+                   f"{', '.join(['0'] * (len(sum) + 1))} WHERE NOT EXISTS " \
+                   f"(SELECT 1 FROM {local_name} WHERE {group_match(row)}); " \
+                   f"UPDATE {local_name} SET " + \
+                   "".join(f"sum_{column_name} = sum_{column_name} + COALESCE({row}.{column_name}, 0), "
+                           for column_name in sum) + \
+                   f"{count_column} = {count_column} + 1 WHERE {group_match(row)};"
+
+        def remove_row(row):
+            return f"UPDATE {local_name} SET " + \
+                   "".join(f"sum_{column_name} = sum_{column_name} - COALESCE({row}.{column_name}, 0), "
+                           for column_name in sum) + \
+                   f"{count_column} = {count_column} - 1 WHERE {group_match(row)}; " \
+                   f"DELETE FROM {local_name} WHERE {group_match(row)} AND {count_column} <= 0;"
+
+        # The triggers are created and the aggregate filled in one transaction so no change is missed or counted twice,
+        # if any statement fails none of them are applied
+        try:
+            self.database.transaction([(sql, ()) for sql in [
+                f"CREATE TRIGGER IF NOT EXISTS {prefix}{local_name}_agg_insert AFTER INSERT ON {table_name} "
+                f"BEGIN {add_row('NEW')} END",
+                f"CREATE TRIGGER IF NOT EXISTS {prefix}{local_name}_agg_update "
+                f"AFTER UPDATE OF {', '.join(group_by + sum)} ON {table_name} BEGIN {remove_row('OLD')} {add_row('NEW')} END",
+                f"CREATE TRIGGER IF NOT EXISTS {prefix}{local_name}_agg_delete AFTER DELETE ON {table_name} "
+                f"BEGIN {remove_row('OLD')} END",
+                f"DELETE FROM {name}",
+                f"INSERT INTO {name} ({', '.join(columns)}) SELECT {', '.join(group_by)}, " +
+                "".join(f"COALESCE(SUM({column_name}), 0), " for column_name in sum) +
+                f"COUNT(*) FROM {self.table_name} GROUP BY {', '.join(group_by)}"
+            ]])
+        except sqlite3.Error:
+            if not existed:
+                self.database.drop_table(name)
+            raise
+        return aggregate
+
+    def drop_materialized_aggregate(self, name: str):
+        """
+        Stop maintaining a materialized aggregate and drop its table.
+        :param name: The name of the aggregate table.
+        :return: None
+        """
+        if name not in self.materialized_aggregates:
+            raise KeyError(f"Materialized aggregate [{name}] not found on table [{self.table_name}]")
+        self.database.transaction([(f"DROP TRIGGER IF EXISTS {name}_agg_{operation}", ())
+                                   for operation in ("insert", "update", "delete")])
+        self.database.get_table(name)  # Make sure the aggregate is loaded
+        self.database.drop_table(name)
+
+    @property
+    def fulltext_columns(self) -> List[str]:
+        """
+        Get the columns of this table that are indexed for full text search (empty if search is not enabled).
+        """
+        schema, name = split_table_name(self.table_name)
+        if not self.database.get(f"SELECT name FROM {schema}.sqlite_master WHERE type='table' AND name=?",
+                                 (f"{name}_fts",)):
+            return []
+        return [row[1] for row in self.database.get(f"PRAGMA {schema}.table_info({name}_fts)")]
+
+    def enable_fulltext(self, columns: List[str]):
+        """
+        Index TEXT columns of this table with an FTS5 external content index, kept up to date by triggers.
+        :param columns: The columns to index.
+        :return: None
+        :raises RuntimeError: If SQLite was built without FTS5.
+        """
+        for column_name in columns:
+            if column_name not in self.columns:
+                raise KeyError(f"Column [{column_name}] not found in table [{self.table_name}]")
+        if self.fulltext_columns:
+            if sorted(self.fulltext_columns) == sorted(columns):
+                return
+            raise ValueError(f"Table [{self.table_name}] already has a full text index on {self.fulltext_columns}")
+        # The index and triggers of a table in an attached database are created in that database, names inside the
+        # trigger bodies and the content option are resolved there and can't be qualified
+        schema, table_name = split_table_name(self.table_name)
+        prefix = f"{schema}." if schema != "main" else ""
+        fts = f"{table_name}_fts"
+        names = ", ".join(columns)
+
+        def row_values(row):
+            return ", ".join([f"{row}.rowid"] + [f"{row}.{column_name}" for column_name in columns])
+
+        try:
+            self.database.transaction([(sql, ()) for sql in [
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {prefix}{fts} USING fts5({names}, content='{table_name}', "
+                f"content_rowid='rowid')",
+                f"CREATE TRIGGER IF NOT EXISTS {prefix}{fts}_insert AFTER INSERT ON {table_name} BEGIN "
+                f"INSERT INTO {fts} (rowid, {names}) VALUES ({row_values('NEW')}); END",
+                f"CREATE TRIGGER IF NOT EXISTS {prefix}{fts}_delete AFTER DELETE ON {table_name} BEGIN "
+                f"INSERT INTO {fts} ({fts}, rowid, {names}) VALUES ('delete', {row_values('OLD')}); END",
+                f"CREATE TRIGGER IF NOT EXISTS {prefix}{fts}_update AFTER UPDATE ON {table_name} BEGIN "
+                f"INSERT INTO {fts} ({fts}, rowid, {names}) VALUES ('delete', {row_values('OLD')}); "
+                f"INSERT INTO {fts} (rowid, {names}) VALUES ({row_values('NEW')}); END",
+                f"INSERT INTO {prefix}{fts} ({fts}) VALUES ('rebuild')"
+            ]])
+        except sqlite3.OperationalError as e:
+            raise RuntimeError(f"Unable to create a full text index on [{self.table_name}], is FTS5 available? {e}")
+
+    def disable_fulltext(self):
+        """
+        Drop the full text index of this table.
+        :return: None
+        """
+        fts = f"{self.table_name}_fts"
+        for operation in ("insert", "delete", "update"):
+            self.database.run(f"DROP TRIGGER IF EXISTS {fts}_{operation}")
+        self.database.run(f"DROP TABLE IF EXISTS {fts}")
+        self.database.tables.pop(fts, None)
+
+    def search(self, query: str, limit: int = 10, rank: bool = True) -> List[DynamicEntry]:
+        """
+        Search the full text index of this table.
+        :param query: An FTS5 query, e.g. "sqlite AND (fast OR small)" or "data*".
+        :param limit: The maximum number of rows to return.
+        :param rank: Order the rows by relevance, otherwise they are returned in rowid order.
+        :return: The matching rows.
+        """
+        schema, table_name = split_table_name(self.table_name)
+        fts = f"{table_name}_fts"  # Referenced unqualified, MATCH takes the bare name of the index
+        version = self._snapshot_version()
+        result = self.database.cached_get(f"SELECT t.* FROM {self.table_name} AS t "
+                                          f"JOIN {self.table_name}_fts AS {fts} ON t.rowid = {fts}.rowid "
+                                          f"WHERE {fts} MATCH ? ORDER BY {f'{fts}.rank' if rank else 't.rowid'}"
+                                          f"{f' LIMIT {limit}' if limit > 0 else ''}", (query,))
+        entries = [DynamicEntry(self, load_tuple=row, loaded_version=version) for row in result]
+        for entry in entries:
+            if entry not in self.entries:
+                self.entries.append(entry)
+        return entries
+
+    def set_codec(self, column_name: str, codec: typing.Optional[str]):
+        """
+        Set the compression codec a TEXT or BLOB column is stored with, the codec is recorded in the schema metadata.
+        Existing values are left as they are and are still read back correctly.
+        :param column_name: The name of the column.
+        :param codec: The name of a registered codec ("zlib", "lzma"), None to store new values uncompressed.
+        """
+        column = self.get_column(column_name)
+        if codec is not None:
+            if codec not in Codecs.COMPRESSION_CODECS:
+                raise ValueError(f"Unknown compression codec [{codec}]")
+            if column.type not in ("TEXT", "STRING", "BLOB"):
+                raise ValueError(f"Column [{column_name}] of type {column.type} can't be compressed")
+            if column.primary_key:
+                raise ValueError(f"Primary key [{column_name}] can't be compressed")
+        self.database.set_metadata(self.table_name, column_name, "codec", codec)
+        column.codec = codec
+
+    def enable_versioning(self, column_name: str = "row_version"):
+        """
+        Give every row a version that is incremented by each write, entries then only write their changes if the row
+        is still at the version they loaded and raise ConflictError otherwise, instead of overwriting another writer's
+        changes. Use entry.modify for read-modify-write changes that are retried on conflicts.
+        :param column_name: The INTEGER column holding the version, it is added to the table if it doesn't exist.
+        """
+        if not self.primary_keys:
+            raise ValueError(f"Table [{self.table_name}] has no primary keys, its rows can't be versioned")
+        if column_name in self.primary_keys:
+            raise ValueError(f"Primary key [{column_name}] can't be the version column")
+        if column_name not in self.columns:
+            if self.has_dirty_entries():
+                self.flush()
+            self.database.run(f"ALTER TABLE {self.table_name} ADD COLUMN {column_name} INTEGER NOT NULL DEFAULT 0")
+            schema, name = split_table_name(self.table_name)
+            row = [row for row in self.database.get(f"PRAGMA {schema}.table_info({name})") if row[1] == column_name]
+            self.columns.append(ColumnWrapper(self, row[0]))
+            for entry in self.entries:  # Read when first needed
+                if entry is not None:
+                    entry._unloaded.add(column_name)
+        elif self.get_column(column_name).type not in ("INTEGER", "INT"):
+            raise ValueError(f"Column [{column_name}] must be an INTEGER to hold the row version")
+        self.database.set_metadata(self.table_name, "", "version_column", column_name)
+        self.version_column = column_name
+
+    def disable_versioning(self):
+        """
+        Stop checking row versions, the version column is kept.
+        """
+        self.database.set_metadata(self.table_name, "", "version_column", None)
+        self.version_column = None
+
+    def enable_bloom_filter(self, error_rate: float = 0.01, shared: bool = False, check_interval: float = 1.0):
+        """
+        Keep a Bloom filter of the primary keys of the table in memory, get_row and update_or_add then skip the query
+        for keys that certainly don't exist. Rows added through the table are added to the filter, any other write
+        that may add keys makes lookups go to the database until the filter has been rebuilt in the background.
+        Deleted keys stay in the filter until it is rebuilt, which only makes lookups of them go to the database.
+        :param error_rate: The fraction of lookups of missing keys that still go to the database.
+        :param shared: Also notice rows added by other connections to the database file, by checking its data version
+         no more than once per check_interval seconds. Rows another connection adds may be reported missing until
+         the next check.
+        :param check_interval: The minimum number of seconds between checks of the data version, 0 checks it before
+         every lookup.
+        """
+        if not self.primary_keys:
+            raise ValueError(f"Table [{self.table_name}] has no primary keys to filter")
+        schema, name = split_table_name(self.table_name)
+        create_sql = self.database.get(f"SELECT sql FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?",
+                                       (name,))
+        if create_sql and create_sql[0][0] and "COLLATE" in create_sql[0][0].upper():
+            raise ValueError(f"Table [{self.table_name}] uses a collation, its keys can't be filtered")
+        if self._bloom_thread is not None:
+            self._bloom_thread.join()
+        self._bloom_settings = (error_rate, shared, check_interval)
+        self._rebuild_bloom_filter()
+
+    def disable_bloom_filter(self):
+        self._bloom_settings = None
+        self.bloom_filter = None
+        self._bloom_built = None
+
+    def _rebuild_bloom_filter(self):
+        """
+        Build the Bloom filter from the keys in the table, reading them a chunk at a time so the lock is released
+        between chunks.
+        """
+        settings = self._bloom_settings
+        if settings is None:
+            return
+        error_rate, shared = settings[:2]
+        started = time.monotonic()
+        built = (self._bloom_generation, self.database.write_epoch,
+                 self.database.data_version() if shared else None)
+        count = self._read(f"SELECT COUNT(*) FROM {self.table_name}")[0][0]
+        bloom = BloomFilter(max(1024, 2 * count), error_rate)
+        self._bloom_building = bloom
+        try:
+            key_names = [key.name for key in self.primary_keys]
+            for rows in self._scan_keys(key_names):
+                for row in rows:
+                    key = self._bloom_key(dict(zip(key_names, row)))
+                    if key is not None:
+                        bloom.add(key)
+        finally:
+            self._bloom_building = None
+        if self._bloom_settings is not settings:  # Disabled or enabled again while it was being built
+            return
+        if shared:  # A change committed by another connection during the scan is only noticed by the next check
+            self._bloom_data_version, self._bloom_checked = built[2], time.monotonic()
+        self.bloom_filter = bloom
+        self._bloom_built = built
+        self.bloom_stats["rebuilds"] += 1
+        finished = time.monotonic()
+        self._bloom_next_rebuild = finished + 9 * (finished - started)  # At most a tenth of the time is spent scanning
+
+    def _schedule_bloom_rebuild(self):
+        """
+        Start rebuilding the Bloom filter in the background, unless a rebuild is running or one finished too recently.
+        """
+        with self._bloom_lock:
+            if self._bloom_thread is not None and self._bloom_thread.is_alive():
+                return
+            if time.monotonic() < self._bloom_next_rebuild:
+                return
+            self._bloom_thread = threading.Thread(target=self._rebuild_in_background, daemon=True,
+                                                  name=f"bloom-{self.table_name}")
+            self._bloom_thread.start()
+
+    def _rebuild_in_background(self):
+        try:
+            self._rebuild_bloom_filter()
+        except Exception as e:
+            logging.warning(f"Unable to rebuild the Bloom filter of {self.table_name}: {e}")
+
+    def _bloom_current(self) -> bool:
+        """
+        Check that no write the Bloom filter doesn't know about has been made since it was built.
+        """
+        built = self._bloom_built
+        if built is None or built[0] != self._bloom_generation or built[1] != self.database.write_epoch:
+            return False
+        if built[2] is None:
+            return True
+        now = time.monotonic()
+        if now - self._bloom_checked >= self._bloom_settings[2]:
+            self._bloom_data_version = self.database.data_version(self._bloom_settings[2])
+            self._bloom_checked = now
+        return built[2] == self._bloom_data_version
+
+    def _scan_keys(self, key_names: List[str], chunk_size: int = 5000) -> typing.Iterator[list]:
+        """
+        Read the primary keys of every row, a chunk of rows per query.
+        """
+        if self._has_rowid():
+            last = None
+            while True:
+                rows = self._read(f"SELECT rowid, {', '.join(key_names)} FROM {self.table_name} "
+                                  f"{'WHERE rowid > ? ' if last is not None else ''}ORDER BY rowid LIMIT ?",
+                                  ((last,) if last is not None else ()) + (chunk_size,))
+                if not rows:
+                    return
+                last = rows[-1][0]
+                yield [row[1:] for row in rows]
+                if len(rows) < chunk_size:
+                    return
+        else:
+            offset = 0
+            while True:
+                rows = self._read(f"SELECT {', '.join(key_names)} FROM {self.table_name} "
+                                  f"ORDER BY {', '.join(key_names)} LIMIT ? OFFSET ?", (chunk_size, offset))
+                if not rows:
+                    return
+                offset += len(rows)
+                yield rows
+                if len(rows) < chunk_size:
+                    return
+
+    def _bloom_key(self, values: dict) -> typing.Optional[str]:
+        """
+        Get the Bloom filter key of the primary key values of a row, None if the values can't be filtered.
+        """
+        if any(isinstance(values[key.name], (list, tuple)) for key in self.primary_keys):  # Ranges and value sets
+            return None
+        return filter_key([key.encode(values[key.name]) for key in self.primary_keys],
+                          [column_affinity(key.type) for key in self.primary_keys])
+
+    def _might_exist(self, kwargs: dict) -> typing.Optional[bool]:
+        """
+        Check the Bloom filter for a row.
+        :param kwargs: The filters of a lookup.
+        :return: False if no row has the key, True if a row may have it, None if the filter can't answer.
+        """
+        if self._bloom_settings is None or len(kwargs) != len(self.primary_keys) or \
+                any(key.name not in kwargs for key in self.primary_keys):
+            return None
+        key = self._bloom_key(kwargs)
+        if key is None:
+            return None
+        if not self._bloom_current():  # The query answers until the filter has caught up
+            self._schedule_bloom_rebuild()
+            return None
+        if self.bloom_filter.full:  # Still correct, just less selective
+            self._schedule_bloom_rebuild()
+        self.bloom_stats["lookups"] += 1
+        if key in self.bloom_filter:
+            return True
+        self.bloom_stats["skipped"] += 1
+        return False
+
+    @contextlib.contextmanager
+    def _maintaining_bloom_filter(self):
+        """
+        Writes made inside this block add their keys to the Bloom filter themselves, so they don't invalidate it.
+        """
+        self._bloom_local.maintaining = True
+        try:
+            yield
+        finally:
+            self._bloom_local.maintaining = False
+
+    def _bloom_add(self, rows: typing.Iterable[dict]):
+        """
+        Add the primary keys of rows written through the table to the Bloom filter.
+        """
+        if self._bloom_settings is None:
+            return
+        for values in rows:
+            key = self._bloom_key(values)
+            if key is None:  # The key may have been stored in a form the lookups can't predict
+                self._bloom_generation += 1
+                continue
+            for bloom in (self.bloom_filter, self._bloom_building):
+                if bloom is not None:
+                    bloom.add(key)
+
+    def _bloom_write(self, sql: str, direct: bool):
+        """
+        Called by the database for each write to this table, invalidates the Bloom filter if the write may have
+        added keys it doesn't know about.
+        :param direct: Whether the statement wrote to this table itself, rather than through a cascade or trigger.
+        """
+        if direct:
+            if getattr(self._bloom_local, "maintaining", False):
+                return
+            keyword = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+            if keyword == "DELETE":  # Removed keys only cause false positives
+                return
+            if keyword == "UPDATE":
+                columns = updated_columns(sql)
+                if columns is not None and not any(key.name in columns for key in self.primary_keys):
+                    return
+        self._bloom_generation += 1
 
     def get_column(self, column_name: str) -> ColumnWrapper:
         """
@@ -341,21 +1395,40 @@ class DynamicTable:
         """
         return self.columns[self.columns.index(column_name)]
 
-    def _create_filter(self, column, value):
+    def _create_filter(self, column, value, qualifier: str = None) -> typing.Tuple[str, tuple]:
         """
         Create an SQL filter from a kwargs key and value.
         :param key: The column name.
-        :param value: The value to filter. value or [lower, upper] for ranges.
-        :return:
+        :param value: The value to filter. value, [lower, upper] for ranges or (value, ...) for any of several values.
+        :param qualifier: The table name or alias to prefix the column name with.
+        :return: The filter with a ? placeholder for each value, and the values to bind to them.
         """
-        if isinstance(value, list):  # Range
+        name = f"{qualifier}.{column.name}" if qualifier else column.name
+        if isinstance(value, list) and not column.accepts(value):  # Range
             if len(value) != 2:
                 raise ValueError(f"Invalid range for column {column.name}")
-            return f"{column.name} >= {column.safe_value(value[0])} AND {column.name} <= {column.safe_value(value[1])}"
+            return f"{name} >= ? AND {name} <= ?", (column.encode(value[0]), column.encode(value[1]))
         elif isinstance(value, tuple):  # Multiple values
-            return ''
+            if not value:
+                return "0", ()
+            return f"{name} IN ({', '.join(['?'] * len(value))})", tuple(column.encode(v) for v in value)
+        elif value is None:
+            return f"{name} IS NULL", ()
         else:
-            return f"{column.name} = {column.safe_value(value)}"
+            return f"{name} = ?", (column.encode(value),)
+
+    def _where_clause(self, **kwargs) -> typing.Tuple[str, tuple]:
+        """
+        Combine the filters of every kwargs key and value.
+        :return: The where clause without the WHERE keyword (empty if there are no filters), and its bound values.
+        """
+        filters = []
+        args = ()
+        for column_name, value in kwargs.items():
+            sql, values = self._create_filter(self.get_column(column_name), value)
+            filters.append(sql)
+            args += values
+        return " AND ".join(filters), args
 
     def has_dirty_entries(self) -> bool:
         """
@@ -369,13 +1442,13 @@ class DynamicTable:
 
     def __getitem__(self, key):
         if key in self.columns:
-            return self.database.get(f"SELECT {key} FROM {self.table_name}")
+            return self._read(f"SELECT {key} FROM {self.table_name}")
         else:
             raise KeyError(f"Column {key} not found in table {self.table_name}")
 
     def __setitem__(self, key, value):
         if key in self.columns:
-            self.database.run(f"UPDATE {self.table_name} SET {key} = ?", value)
+            self.update_where({key: value})
         else:
             raise KeyError(f"Column {key} not found in table {self.table_name}")
 
@@ -398,7 +1471,7 @@ class DynamicTable:
         Get the number of entries in the table.
         """
         sql = f"SELECT COUNT(*) FROM {self.table_name}"
-        return self.database.get(sql)[0][0]
+        return self._read(sql)[0][0]
 
     def __contains__(self, key):
         return key in self.columns
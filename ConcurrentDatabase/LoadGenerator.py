@@ -0,0 +1,266 @@
+import argparse
+import csv
+import json
+import math
+import os
+import random
+import threading
+import time
+import typing
+
+from typing import List
+
+from loguru import logger as logging
+
+from .Database import Database
+
+OPERATIONS = ("read", "write", "update", "flush")
+DEFAULT_MIX = {"read": 0.7, "write": 0.15, "update": 0.1, "flush": 0.05}
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """
+    Get a percentile of a sorted list with the nearest rank method.
+    :param values: The sorted values.
+    :param fraction: The percentile as a fraction, 0.95 for the 95th percentile.
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))]
+
+
+class LoadGenerator:
+    """
+    Drives a mixed workload through a Database and DynamicTable from several threads at once, to measure how
+    throughput and latency change with concurrency.
+    Each thread only writes to the rows it owns and counts its increments, so once the run is over the counters in
+    the table show whether any update was lost. The operations are:
+     read: get_row of any row.
+     write: get_row of an owned row, then entry.set(counter=counter + 1).
+     update: get_row of an owned row, then entry["counter"] += 1, written by the next flush.
+     flush: table.flush() of every pending update.
+    """
+
+    def __init__(self, path: str, rows: int = 1000, mix: typing.Dict[str, float] = None, duration: float = 5.0,
+                 operations: int = None, wal: bool = True, seed: int = None, **database_kwargs):
+        """
+        :param path: The database file to run against, only the load_test table in it is touched.
+        :param rows: The number of rows in the table.
+        :param mix: The relative frequency of each operation.
+        :param duration: The number of seconds each run lasts.
+        :param operations: Stop each thread after this many operations instead of after duration seconds.
+        :param wal: Put the database in WAL mode.
+        :param seed: The seed of the random operation choices.
+        :param database_kwargs: Passed to Database, e.g. coherence or lock_timeout.
+        """
+        mix = dict(DEFAULT_MIX if mix is None else mix)
+        for name in mix:
+            if name not in OPERATIONS:
+                raise ValueError(f"Unknown operation {name}")
+        if sum(mix.values()) <= 0:
+            raise ValueError("The operation mix must have a positive total")
+        if rows < 1:
+            raise ValueError("rows must be at least 1")
+        self.path = path
+        self.rows = rows
+        self.mix = mix
+        self.duration = duration
+        self.operations = operations
+        self.wal = wal
+        self.seed = seed
+        self.database_kwargs = database_kwargs
+        self.database_kwargs.setdefault("no_gc", True)
+
+    def _prepare(self) -> Database:
+        database = Database(self.path, **self.database_kwargs)
+        if self.wal:
+            database.get("PRAGMA journal_mode = WAL")
+        try:
+            database.get_table("load_test")
+            database.drop_table("load_test")  # Left over from an earlier run
+        except KeyError:
+            pass
+        table = database.create_table("load_test", {"id": "INTEGER PRIMARY KEY", "counter": "INTEGER",
+                                                    "payload": "TEXT"})
+        table.upsert_many({"id": i, "counter": 0, "payload": "x" * 64} for i in range(self.rows))
+        return database
+
+    def _worker(self, table, worker: int, threads: int, start: threading.Event, stop: threading.Event,
+                result: dict):
+        rng = random.Random(None if self.seed is None else self.seed + worker)
+        names = list(self.mix)
+        weights = [self.mix[name] for name in names]
+        owned = list(range(worker, self.rows, threads)) or [None]
+        latencies = result["latencies"]
+        start.wait()
+        count = 0
+        while not stop.is_set() and (self.operations is None or count < self.operations):
+            name = rng.choices(names, weights)[0]
+            row_id = owned[rng.randrange(len(owned))] if name in ("write", "update") else rng.randrange(self.rows)
+            if row_id is None:  # More threads than rows, this thread has nothing to write to
+                name, row_id = "read", rng.randrange(self.rows)
+            started = time.perf_counter()
+            try:
+                if name == "read":
+                    table.get_row(id=row_id)["counter"]
+                elif name == "write":
+                    entry = table.get_row(id=row_id)
+                    entry.set(counter=entry["counter"] + 1)
+                    result["increments"][row_id] = result["increments"].get(row_id, 0) + 1
+                elif name == "update":
+                    entry = table.get_row(id=row_id)
+                    entry["counter"] = entry["counter"] + 1
+                    result["increments"][row_id] = result["increments"].get(row_id, 0) + 1
+                    result["pending"].append(entry)  # Keep the entry alive until it is flushed
+                else:
+                    table.flush()
+                    result["pending"] = []
+            except Exception as e:
+                if not result["errors"]:
+                    logging.warning(f"Load generator {name} failed: {e}")
+                result["errors"][name] = result["errors"].get(name, 0) + 1
+                continue
+            latencies.setdefault(name, []).append(time.perf_counter() - started)
+            count += 1
+
+    def run(self, threads: int) -> dict:
+        """
+        Run the workload from a number of threads.
+        :param threads: The number of threads.
+        :return: The total and per operation throughput, the p50, p95, p99 and max latency in milliseconds, the
+         number of failed operations and the number of lost updates.
+        """
+        if threads < 1:
+            raise ValueError("threads must be at least 1")
+        database = self._prepare()
+        try:
+            table = database.get_table("load_test")
+            start, stop = threading.Event(), threading.Event()
+            results = [{"latencies": {}, "increments": {}, "errors": {}, "pending": []} for _ in range(threads)]
+            workers = [threading.Thread(target=self._worker, args=(table, i, threads, start, stop, results[i]),
+                                        name=f"load-{i}", daemon=True) for i in range(threads)]
+            for worker in workers:
+                worker.start()
+            started = time.perf_counter()
+            start.set()
+            if self.operations is None:
+                time.sleep(self.duration)
+                stop.set()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - started
+            table.flush()
+            expected = {}
+            for result in results:
+                for row_id, increments in result["increments"].items():
+                    expected[row_id] = expected.get(row_id, 0) + increments
+            counters = dict(database.get("SELECT id, counter FROM load_test"))
+            lost = sum(max(0, increments - (counters.get(row_id) or 0)) for row_id, increments in expected.items())
+        finally:
+            database.close()
+
+        report = {"threads": threads, "duration": elapsed, "operations": 0, "ops_per_second": 0.0,
+                  "errors": sum(sum(result["errors"].values()) for result in results), "lost_updates": lost,
+                  "latency": {}}
+        for name in self.mix:
+            latencies = sorted(value for result in results for value in result["latencies"].get(name, []))
+            report["operations"] += len(latencies)
+            report["latency"][name] = {
+                "count": len(latencies), "ops_per_second": len(latencies) / elapsed if elapsed else 0.0,
+                "p50_ms": percentile(latencies, 0.50) * 1000, "p95_ms": percentile(latencies, 0.95) * 1000,
+                "p99_ms": percentile(latencies, 0.99) * 1000, "max_ms": latencies[-1] * 1000 if latencies else 0.0,
+                "errors": sum(result["errors"].get(name, 0) for result in results)}
+        report["ops_per_second"] = report["operations"] / elapsed if elapsed else 0.0
+        return report
+
+    def scale(self, thread_counts: typing.Iterable[int] = (1, 2, 4, 8)) -> List[dict]:
+        """
+        Run the workload at each level of concurrency.
+        :param thread_counts: The numbers of threads to run with.
+        :return: The report of each run.
+        """
+        reports = []
+        for threads in thread_counts:
+            report = self.run(threads)
+            logging.info(f"{threads} threads: {report['ops_per_second']:.0f} ops/s, "
+                         f"{report['errors']} errors, {report['lost_updates']} lost updates")
+            reports.append(report)
+        return reports
+
+
+def curve_rows(reports: List[dict]) -> List[dict]:
+    """
+    Flatten the reports of a scaling run into one row per level of concurrency.
+    """
+    rows = []
+    for report in reports:
+        row = {key: report[key] for key in ("threads", "duration", "operations", "ops_per_second", "errors",
+                                            "lost_updates")}
+        for name, stats in report["latency"].items():
+            for key, value in stats.items():
+                row[f"{name}_{key}"] = value
+        rows.append(row)
+    return rows
+
+
+def write_csv(reports: List[dict], path: str):
+    """
+    Write the scaling curve of a run as CSV, one line per level of concurrency.
+    """
+    rows = curve_rows(reports)
+    fields = []
+    for row in rows:
+        fields += [key for key in row if key not in fields]
+    with open(path, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def write_json(reports: List[dict], path: str):
+    """
+    Write the full reports of a scaling run as JSON.
+    """
+    with open(path, "w") as file:
+        json.dump(reports, file, indent=2)
+
+
+def _parse_mix(value: str) -> dict:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def main(argv: List[str] = None) -> List[dict]:
+    parser = argparse.ArgumentParser(prog="python -m ConcurrentDatabase.LoadGenerator",
+                                     description="Measure throughput and latency against the number of threads.")
+    parser.add_argument("path", help="The database file to run against")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per level of concurrency")
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--mix", type=_parse_mix, default=None, help="e.g. read=0.7,write=0.15,update=0.1,flush=0.05")
+    parser.add_argument("--no-wal", action="store_true", help="Keep the default rollback journal")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--csv", help="Write the scaling curve to this CSV file")
+    parser.add_argument("--json", help="Write the full reports to this JSON file")
+    args = parser.parse_args(argv)
+    generator = LoadGenerator(os.path.abspath(args.path), rows=args.rows, mix=args.mix, duration=args.duration,
+                              wal=not args.no_wal, seed=args.seed)
+    reports = generator.scale(args.threads)
+    for report in reports:
+        print(f"threads={report['threads']:<3} ops/s={report['ops_per_second']:<10.0f} "
+              f"errors={report['errors']:<5} lost_updates={report['lost_updates']}")
+        for name, stats in report["latency"].items():
+            print(f"    {name:<7} {stats['ops_per_second']:>10.0f} ops/s  p50={stats['p50_ms']:.3f}ms  "
+                  f"p95={stats['p95_ms']:.3f}ms  p99={stats['p99_ms']:.3f}ms")
+    if args.csv:
+        write_csv(reports, args.csv)
+    if args.json:
+        write_json(reports, args.json)
+    return reports
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+class LockTimeoutError(TimeoutError):
+    """
+    Raised when the lock could not be acquired before the caller's deadline.
+    """
+
+
+class LockQueueFullError(RuntimeError):
+    """
+    Raised when the lock is busy and the maximum number of waiting callers has been reached.
+    """
+
+
+class _Waiter:
+
+    def __init__(self, priority: int, ticket: int, deadline: float):
+        self.priority = priority
+        self.ticket = ticket
+        self.deadline = deadline  # type: float or None
+        self.event = threading.Event()
+        self.cancelled = False
+
+    def __lt__(self, other):
+        # Higher priorities go first, callers with the same priority are served in arrival order
+        return (-self.priority, self.ticket) < (-other.priority, other.ticket)
+
+
+class LockScheduler:
+    """
+    A mutex that hands itself to waiting callers in FIFO order within a priority, supports separate priorities for
+    reads and writes, per-call deadlines and a maximum queue depth to shed load when overloaded.
+    """
+
+    def __init__(self, read_priority: int = 0, write_priority: int = 0, max_queue_depth: int = None):
+        """
+        :param read_priority: The priority of callers acquiring the lock for a read, higher is served first.
+        :param write_priority: The priority of callers acquiring the lock for a write.
+        :param max_queue_depth: The maximum number of callers that may wait for the lock, None for no limit.
+        """
+        self.read_priority = read_priority
+        self.write_priority = write_priority
+        self.max_queue_depth = max_queue_depth
+        self._mutex = threading.Lock()  # Protects the scheduler state, never held while waiting
+        self._held = False
+        self._queue = []  # type: list[_Waiter]  # Heap of waiting callers
+        self._waiting = 0
+        self._tickets = itertools.count()
+
+        # Statistics
+        self.lock_count = 0  # Total number of acquisitions attempted
+        self.queued_lock_count = 0  # Number of callers currently waiting for or holding the lock
+        self.timeout_count = 0
+        self.rejected_count = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def acquire(self, blocking=True, timeout=-1, write=True) -> bool:
+        """
+        Acquire the lock.
+        :param blocking: Wait for the lock if it is held, otherwise return False immediately.
+        :param timeout: The maximum number of seconds to wait, -1 or None to wait forever.
+        :param write: Whether the lock is needed for a write, selects the priority of the caller.
+        :return: True once the lock has been acquired, False if not blocking and the lock is held.
+        :raises LockTimeoutError: If the lock was not acquired within the timeout.
+        :raises LockQueueFullError: If the lock is held and too many callers are already waiting.
+        """
+        start = time.monotonic()
+        with self._mutex:
+            self.lock_count += 1
+            if not self._held and self._waiting == 0:
+                self._held = True
+                self.queued_lock_count += 1
+                return True
+            if not blocking:
+                return False
+            if self.max_queue_depth is not None and self._waiting >= self.max_queue_depth:
+                self.rejected_count += 1
+                raise LockQueueFullError(f"Lock queue is full ({self._waiting} waiting)")
+            deadline = None if timeout is None or timeout < 0 else start + timeout
+            waiter = _Waiter(self.write_priority if write else self.read_priority, next(self._tickets), deadline)
+            heapq.heappush(self._queue, waiter)
+            self._waiting += 1
+            self.queued_lock_count += 1
+
+        acquired = waiter.event.wait(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        with self._mutex:
+            if not acquired and not waiter.event.is_set():
+                # Timed out, the releasing thread will skip this waiter
+                waiter.cancelled = True
+                self._waiting -= 1
+                self.queued_lock_count -= 1
+                self.timeout_count += 1
+                if not self._held:  # A release skipped this waiter, pass the lock on to whoever queued behind it
+                    self._hand_off()
+                raise LockTimeoutError(f"Timed out after {timeout} seconds waiting for the database lock")
+            waited = time.monotonic() - start
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        return True
+
+    def release(self):
+        """
+        Release the lock, handing it directly to the next waiting caller whose deadline hasn't passed.
+        """
+        with self._mutex:
+            if not self._held:
+                raise RuntimeError("Release of an unlocked lock")
+            self.queued_lock_count -= 1
+            self._held = False
+            self._hand_off()
+
+    def _hand_off(self):
+        """
+        Give the free lock to the next waiting caller whose deadline hasn't passed. Must be called holding _mutex.
+        Skipped callers clean themselves up and call this again, so the lock can't be left free with callers queued.
+        """
+        now = time.monotonic()
+        while self._queue:
+            waiter = heapq.heappop(self._queue)
+            if waiter.cancelled:
+                continue
+            if waiter.deadline is not None and waiter.deadline <= now:
+                continue  # The waiter is about to time out, leave it to clean itself up
+            self._waiting -= 1
+            self._held = True
+            waiter.event.set()  # Ownership passes straight to the waiter, the lock never appears free
+            return
+
+    def locked(self) -> bool:
+        return self._held
+
+    def waiting(self) -> int:
+        """
+        Get the number of callers waiting for the lock.
+        """
+        return self._waiting
+
+    def stats(self) -> dict:
+        """
+        Get statistics about how the lock has been used.
+        """
+        with self._mutex:
+            granted = self.lock_count - self.timeout_count - self.rejected_count
+            return {"acquisitions": self.lock_count, "waiting": self._waiting, "timeouts": self.timeout_count,
+                    "rejected": self.rejected_count, "max_wait": self.max_wait,
+                    "mean_wait": self.total_wait / granted if granted > 0 else 0.0}
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
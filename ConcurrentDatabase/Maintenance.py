@@ -0,0 +1,182 @@
+import threading
+import time
+import typing
+
+from loguru import logger as logging
+
+
+def optimize(database):
+    """
+    Let SQLite refresh the planner statistics it considers out of date.
+    """
+    yield database.get("PRAGMA optimize")
+
+
+def analyze(database):
+    """
+    Rebuild the planner statistics of every table, one table per step.
+    """
+    for table_name in list(database.tables):
+        yield database.get(f"ANALYZE {table_name}")
+
+
+def wal_checkpoint(mode: str = "PASSIVE"):
+    """
+    Build a task that copies the WAL back into the database file, "TRUNCATE" also shrinks the WAL file to zero bytes.
+    Does nothing unless the database is in WAL mode.
+    """
+    mode = mode.upper()
+    if mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+        raise ValueError(f"Unknown checkpoint mode {mode}")
+
+    def checkpoint(database):
+        if database.get("PRAGMA journal_mode")[0][0].lower() != "wal":
+            return
+        yield database.get(f"PRAGMA wal_checkpoint({mode})")
+
+    return checkpoint
+
+
+def incremental_vacuum(pages: int = 128):
+    """
+    Build a task that returns free pages to the file system a batch of pages at a time. Does nothing unless the
+    database was created with PRAGMA auto_vacuum = INCREMENTAL.
+    """
+    if pages < 1:
+        raise ValueError("pages must be at least 1")
+
+    def vacuum(database):
+        if database.get("PRAGMA auto_vacuum")[0][0] != 2:
+            return
+        while database.get("PRAGMA freelist_count")[0][0] > 0:
+            yield database.get(f"PRAGMA incremental_vacuum({pages})")
+
+    return vacuum
+
+
+class MaintenanceTask:
+
+    def __init__(self, name: str, fn, interval: float = None, writes: int = None):
+        self.name = name
+        self.fn = fn  # Generator function taking the database, each step runs while holding the lock
+        self.interval = interval  # type: float or None  # Seconds between runs
+        self.writes = writes  # type: int or None  # Number of writes between runs
+        self.last_run = time.monotonic()
+        self.last_writes = 0
+        self.stats = {"runs": 0, "steps": 0, "errors": 0, "last_run": None, "last_duration": 0.0,
+                      "total_duration": 0.0, "max_step": 0.0}
+
+    def due(self, now: float, writes: int) -> bool:
+        return (self.interval is not None and now - self.last_run >= self.interval) or \
+               (self.writes is not None and writes - self.last_writes >= self.writes)
+
+
+class MaintenanceScheduler:
+    """
+    Runs maintenance tasks on a background thread when their interval has passed or enough writes have been made.
+    Each task is a generator that is advanced one step at a time, the database lock is released between steps so
+    queries are never held up for longer than a single step.
+    """
+
+    def __init__(self, database, poll: float = 1.0, pause: float = 0.01):
+        """
+        :param database: The database to maintain.
+        :param poll: The number of seconds between checks for due tasks.
+        :param pause: The number of seconds to wait between the steps of a task.
+        """
+        self.database = database
+        self.poll = poll
+        self.pause = pause
+        self.tasks = {}  # type: dict[str, MaintenanceTask]
+        self._stop = threading.Event()
+        self._run_lock = threading.Lock()  # Only one task runs at a time
+        self._thread = None  # type: threading.Thread or None
+
+    def add_task(self, name: str, fn, interval: float = None, writes: int = None) -> MaintenanceTask:
+        """
+        Schedule a task, replacing any task with the same name.
+        :param name: The name the task's timings are recorded under.
+        :param fn: A generator function taking the database, the lock is released each time it yields.
+        :param interval: Run the task every interval seconds.
+        :param writes: Run the task after this many writes to the database.
+        """
+        task = MaintenanceTask(name, fn, interval, writes)
+        task.last_writes = self._write_count()
+        self.tasks[name] = task
+        return task
+
+    def remove_task(self, name: str):
+        self.tasks.pop(name)
+
+    def _write_count(self) -> int:
+        return sum(self.database.write_counters.values()) + self.database.write_epoch
+
+    def run_task(self, name: str) -> dict:
+        """
+        Run a task now, regardless of when it is due.
+        :return: The statistics of the task.
+        """
+        task = self.tasks[name]
+        with self._run_lock:
+            started = time.perf_counter()
+            steps = 0
+            paused = 0.0  # Time spent waiting between steps isn't counted as work
+            try:
+                step_started = started
+                for _ in task.fn(self.database) or ():
+                    task.stats["max_step"] = max(task.stats["max_step"], time.perf_counter() - step_started)
+                    steps += 1
+                    if self._stop.wait(self.pause):
+                        break
+                    step_started = time.perf_counter()
+                    paused += self.pause
+            except Exception as e:
+                task.stats["errors"] += 1
+                logging.error(f"Maintenance task {name} failed: {e}")
+            duration = time.perf_counter() - started - paused
+            task.last_run = time.monotonic()
+            task.last_writes = self._write_count()
+            task.stats["runs"] += 1
+            task.stats["steps"] += steps
+            task.stats["last_run"] = time.time()
+            task.stats["last_duration"] = duration
+            task.stats["total_duration"] += duration
+        return task.stats
+
+    def run_pending(self) -> typing.List[str]:
+        """
+        Run every task that is due.
+        :return: The names of the tasks that were run.
+        """
+        now = time.monotonic()
+        writes = self._write_count()
+        ran = []
+        for task in list(self.tasks.values()):
+            if self._stop.is_set() or not self.database.open:
+                break
+            if task.due(now, writes):
+                self.run_task(task.name)
+                ran.append(task.name)
+        return ran
+
+    def start(self) -> "MaintenanceScheduler":
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="maintenance", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _loop(self):
+        while not self._stop.wait(self.poll):
+            self.run_pending()
+
+    def stats(self) -> dict:
+        """
+        Get the timings of every task.
+        """
+        return {name: dict(task.stats) for name, task in self.tasks.items()}
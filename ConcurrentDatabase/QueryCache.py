@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class QueryCache:
+    """
+    A LRU cache of query results. Each result is stored with the versions of the tables the query read, a result is
+    only returned while those versions are unchanged.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = None):
+        """
+        :param max_entries: The maximum number of results to keep, the least recently used result is evicted first.
+        :param ttl: The maximum number of seconds to keep a result for, None to keep it until it is invalidated.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._results = OrderedDict()  # key -> (versions, stored_at, rows)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, versions):
+        """
+        Get a cached result.
+        :param key: The normalized query and its parameters.
+        :param versions: The current versions of the tables the query reads.
+        :return: The rows, or None if there is no valid cached result.
+        """
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None:
+                if cached[0] == versions and (self.ttl is None or time.monotonic() - cached[1] < self.ttl):
+                    self._results.move_to_end(key)
+                    self.hits += 1
+                    return cached[2]
+                del self._results[key]  # Invalidated or expired
+                self.evictions += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, versions, rows: list):
+        """
+        Store a result.
+        :param key: The normalized query and its parameters.
+        :param versions: The versions of the tables the query read, taken before the query was run.
+        :param rows: The result of the query.
+        """
+        with self._lock:
+            self._results[key] = (versions, time.monotonic(), rows)
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._results), "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions}
+
+    def __len__(self):
+        return len(self._results)
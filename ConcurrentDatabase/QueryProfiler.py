@@ -0,0 +1,119 @@
+import os
+import sqlite3
+import sys
+import threading
+
+from loguru import logger as logging
+
+from .SqlUtils import statement_shape, statement_type
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _call_site() -> str:
+    """
+    Get the location of the first caller outside of this package.
+    """
+    frame = sys._getframe(1)
+    while frame is not None and os.path.dirname(os.path.abspath(frame.f_code.co_filename)) == _PACKAGE_DIR:
+        frame = frame.f_back
+    if frame is None:
+        return "<unknown>"
+    return f"{frame.f_code.co_filename}:{frame.f_lineno} in {frame.f_code.co_name}"
+
+
+class QueryProfile:
+    """
+    Statistics of every statement with the same shape.
+    """
+
+    def __init__(self, shape: str, plan: list):
+        self.shape = shape
+        self.plan = plan  # type: list[str]  # The details of each step of EXPLAIN QUERY PLAN
+        # A step that reads a whole table or index, searches through an index are fine
+        self.full_scan = any(step.startswith("SCAN") and not step.startswith("SCAN CONSTANT ROW") for step in plan)
+        self.temp_btree = any("USE TEMP B-TREE" in step for step in plan)
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.call_sites = {}  # type: dict[str, int]
+
+    @property
+    def flagged(self) -> bool:
+        return self.full_scan or self.temp_btree
+
+    def to_dict(self) -> dict:
+        return {"shape": self.shape, "count": self.count, "total_time": self.total_time,
+                "mean_time": self.total_time / self.count if self.count else 0.0, "max_time": self.max_time,
+                "plan": self.plan, "full_scan": self.full_scan, "temp_btree": self.temp_btree,
+                "call_sites": dict(self.call_sites)}
+
+    def __str__(self):
+        return f"{self.shape} ({self.count} calls, {self.total_time * 1000:.2f}ms)" \
+               f"{' [SCAN]' if self.full_scan else ''}{' [TEMP B-TREE]' if self.temp_btree else ''}"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class QueryProfiler:
+    """
+    Aggregates how often each statement shape runs and how long it takes, and explains each shape once to flag plans
+    that scan whole tables or sort with temporary b-trees.
+    """
+
+    def __init__(self, warn: bool = True):
+        """
+        :param warn: Log a warning the first time a flagged plan is run from each call site.
+        """
+        self.warn = warn
+        self.profiles = {}  # type: dict[str, QueryProfile]
+        self._lock = threading.Lock()
+
+    def record(self, connection: sqlite3.Connection, sql: str, args, elapsed: float):
+        """
+        Record one execution of a statement. Must be called while holding the database lock as the first execution of
+        each shape is explained on the connection.
+        :param connection: The connection the statement was run on.
+        :param sql: The statement.
+        :param args: The parameters the statement was run with.
+        :param elapsed: How long the statement took in seconds.
+        """
+        if statement_type(sql) not in ("read", "write") or sql.lstrip()[:7].upper() in ("PRAGMA ", "EXPLAIN"):
+            return
+        shape = statement_shape(sql)
+        site = _call_site()
+        profile = self.profiles.get(shape)
+        if profile is None:
+            try:
+                plan = [row[-1] for row in sqlite3.Connection.execute(connection, "EXPLAIN QUERY PLAN " + sql,
+                                                                      args).fetchall()]
+            except (sqlite3.Error, ValueError) as e:
+                plan = [f"Unable to explain: {e}"]
+            profile = QueryProfile(shape, plan)
+            with self._lock:
+                profile = self.profiles.setdefault(shape, profile)
+        with self._lock:
+            profile.count += 1
+            profile.total_time += elapsed
+            profile.max_time = max(profile.max_time, elapsed)
+            new_site = site not in profile.call_sites
+            profile.call_sites[site] = profile.call_sites.get(site, 0) + 1
+        if new_site and profile.flagged and self.warn:
+            logging.warning(f"Query plan of [{shape}] called from {site} "
+                            f"{'scans a table' if profile.full_scan else 'uses a temporary b-tree'}: "
+                            f"{'; '.join(profile.plan)}")
+
+    def report(self, flagged_only: bool = False) -> list:
+        """
+        Get the statistics of every statement shape, the most expensive first.
+        :param flagged_only: Only include shapes with a full scan or temporary b-tree in their plan.
+        :return: A list of dictionaries.
+        """
+        with self._lock:
+            profiles = [profile for profile in self.profiles.values() if profile.flagged or not flagged_only]
+            return [profile.to_dict() for profile in sorted(profiles, key=lambda p: p.total_time, reverse=True)]
+
+    def reset(self):
+        with self._lock:
+            self.profiles.clear()
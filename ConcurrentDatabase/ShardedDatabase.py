@@ -0,0 +1,313 @@
+import os
+import typing
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from typing import List
+
+from .Database import Database
+from .DynamicEntry import DynamicEntry
+from .DynamicTable import DynamicTable
+from .SqlUtils import column_affinity
+
+
+class ShardedTable:
+    """
+    A table whose rows are spread over every shard of a ShardedDatabase by a hash of their primary keys.
+    Has the same read/write surface as a DynamicTable, reads that can't be routed to a single shard are run on every
+    shard in parallel and merged.
+    """
+
+    def __init__(self, database, table_name: str, tables: List[DynamicTable]):
+        self.database = database  # type: ShardedDatabase
+        self.table_name = table_name
+        self.tables = tables  # type: list[DynamicTable]  # The table on each shard, in shard order
+        self.columns = tables[0].columns
+        self.primary_keys = tables[0].primary_keys
+        if not self.primary_keys:
+            raise ValueError(f"Table [{table_name}] must have primary keys to be sharded by key")
+
+    def shard_for(self, **kwargs) -> DynamicTable:
+        """
+        Get the table on the shard that owns the row with the given primary keys.
+        :param kwargs: The values of the row, must contain every primary key.
+        :return: The table on the owning shard.
+        """
+        for key in self.primary_keys:
+            if key.name not in kwargs:
+                raise KeyError(f"Primary key [{key.name}] not specified")
+        token = "|".join(key.safe_value(self._key_value(key, kwargs[key.name])) for key in self.primary_keys)
+        return self.tables[zlib.crc32(token.encode()) % len(self.tables)]
+
+    @staticmethod
+    def _key_value(column, value):
+        """
+        Convert a key to the value SQLite stores for it, so e.g. "01" and 1 in an INTEGER column hash the same.
+        """
+        affinity = column_affinity(column.type)
+        if affinity not in ("INTEGER", "REAL", "NUMERIC") or isinstance(value, (bytes, bytearray)) or value is None:
+            return value
+        if affinity != "REAL":
+            if isinstance(value, int) and not isinstance(value, bool):  # Exact, floats lose precision above 2**53
+                return value
+            if isinstance(value, str):
+                try:
+                    return int(value)
+                except ValueError:
+                    pass
+        try:
+            number = float(value)
+        except (TypeError, ValueError):  # Text that doesn't look like a number is stored as text
+            return value
+        if affinity == "REAL":
+            return number
+        return int(number) if number.is_integer() else number
+
+    def _routable(self, columns=None, **kwargs) -> bool:
+        """Check if the filters select a single primary key, meaning only one shard can contain matches."""
+        return all(key.name in kwargs and not isinstance(kwargs[key.name], (list, tuple))
+                   for key in self.primary_keys)
+
+    def _fan_out(self, method: str, *args, **kwargs) -> list:
+        """
+        Call a method on the table of every shard in parallel.
+        :return: The results of each shard, in shard order.
+        """
+        futures = [self.database.executor.submit(getattr(table, method), *args, **kwargs) for table in self.tables]
+        return [future.result() for future in futures]
+
+    def add(self, **kwargs) -> DynamicEntry:
+        return self.shard_for(**kwargs).add(**kwargs)
+
+    def update_or_add(self, **kwargs) -> DynamicEntry:
+        return self.shard_for(**kwargs).update_or_add(**kwargs)
+
+    def upsert_many(self, rows: typing.Iterable[dict], chunk_size: int = 500) -> int:
+        """
+        Update or add many rows, the rows of each shard are written in parallel.
+        :return: The number of rows written.
+        """
+        per_shard = {}
+        for row in rows:
+            per_shard.setdefault(self.tables.index(self.shard_for(**row)), []).append(row)
+        futures = [self.database.executor.submit(self.tables[shard].upsert_many, shard_rows, chunk_size)
+                   for shard, shard_rows in per_shard.items()]
+        return sum(future.result() for future in futures)
+
+    def get_row(self, **kwargs) -> typing.Optional[DynamicEntry]:
+        if self._routable(**kwargs):
+            return self.shard_for(**kwargs).get_row(**kwargs)
+        for entry in self._fan_out("get_row", **kwargs):
+            if entry is not None:
+                return entry
+        return None
+
+    def get_rows(self, **kwargs) -> List[DynamicEntry]:
+        if self._routable(**kwargs):
+            return self.shard_for(**kwargs).get_rows(**kwargs)
+        return [entry for entries in self._fan_out("get_rows", **kwargs) for entry in entries]
+
+    def get_all(self, columns: List[str] = None) -> List[DynamicEntry]:
+        """
+        Get all rows from every shard. This is not recommended for large tables.
+        """
+        return [entry for entries in self._fan_out("get_all", columns=columns) for entry in entries]
+
+    def select(self, where: str, limit: int = -1, offset: int = 0, order_by: str = None,
+               columns: List[str] = None) -> List[DynamicEntry]:
+        """
+        Select rows from every shard.
+        :param where: The where clause of the query.
+        :param limit: The limit of the merged result.
+        :param offset: The offset into the merged result.
+        :param order_by: The order of the merged result, only plain column names with ASC/DESC are supported.
+        :param columns: Only read these columns (and the primary keys), the others are read when first accessed.
+        :return: The rows.
+        """
+        sort_keys = self._parse_order_by(order_by) if order_by else []
+        # Each shard has to return enough rows to fill the limit on its own
+        shard_limit = limit + offset if limit > 0 else -1
+        entries = [entry for entries in self._fan_out("select", where, limit=shard_limit, order_by=order_by,
+                                                                    columns=columns)
+                   for entry in entries]
+        for column, descending in reversed(sort_keys):  # Stable sorts from the least significant key
+            # SQLite sorts NULL before every other value
+            entries.sort(key=lambda entry: (entry[column] is not None, entry[column]), reverse=descending)
+        if limit > 0:
+            return entries[offset:offset + limit]
+        return entries[offset:]
+
+    def _parse_order_by(self, order_by: str) -> List[tuple]:
+        sort_keys = []
+        for term in order_by.split(","):
+            parts = term.split()
+            if len(parts) == 0 or len(parts) > 2 or parts[0] not in self.columns or \
+                    (len(parts) == 2 and parts[1].upper() not in ("ASC", "DESC")):
+                raise ValueError(f"Unsupported order by term [{term.strip()}] for a sharded table")
+            sort_keys.append((parts[0], len(parts) == 2 and parts[1].upper() == "DESC"))
+        return sort_keys
+
+    def delete(self, **kwargs):
+        if self._routable(**kwargs):
+            return self.shard_for(**kwargs).delete(**kwargs)
+        # The row could be on any shard, exactly one shard has to delete it
+        deleted = None
+        for table in self.tables:
+            try:
+                result = table.delete(**kwargs)
+            except ValueError as e:
+                if "No rows" in str(e):
+                    continue
+                raise
+            if deleted is not None:
+                raise ValueError(f"Multiple rows were deleted from table [{self.table_name}]")
+            deleted = result
+        if deleted is None:
+            raise ValueError(f"No rows were deleted from table [{self.table_name}]")
+        return deleted
+
+    def delete_many(self, **kwargs):
+        self._fan_out("delete_many", **kwargs)
+
+    def update_where(self, values: dict, chunk_size: int = 1000, **kwargs) -> int:
+        if self._routable(**kwargs):
+            return self.shard_for(**kwargs).update_where(values, chunk_size, **kwargs)
+        return sum(self._fan_out("update_where", values, chunk_size, **kwargs))
+
+    def delete_where(self, chunk_size: int = 1000, **kwargs) -> int:
+        if self._routable(**kwargs):
+            return self.shard_for(**kwargs).delete_where(chunk_size, **kwargs)
+        return sum(self._fan_out("delete_where", chunk_size, **kwargs))
+
+    def flush(self):
+        self._fan_out("flush")
+
+    def get_column(self, column_name: str):
+        return self.tables[0].get_column(column_name)
+
+    def __len__(self):
+        return sum(self._fan_out("__len__"))
+
+    def __contains__(self, key):
+        return key in self.columns
+
+    def __repr__(self):
+        return f"ShardedTable({self.table_name}, {self.database})"
+
+    def __str__(self):
+        return self.__repr__()
+
+
+class ShardedDatabase:
+    """
+    Spreads tables over several database files, each with its own connection and lock, so writes to different shards
+    don't wait on each other. Tables are either sharded by key (every shard holds a slice of the rows) or by table
+    (the whole table lives on one shard).
+    """
+
+    def __init__(self, database_name: str, shards: int = 4, workers: int = None, **kwargs):
+        """
+        :param database_name: The path of the database, each shard is stored next to it as name.shardN.ext
+        :param shards: The number of shards, this can't be changed once data has been written.
+        :param workers: The number of threads used to query the shards in parallel (defaults to one per shard).
+        :param kwargs: Passed to each shard's Database.
+        """
+        if shards < 1:
+            raise ValueError("A sharded database needs at least one shard")
+        self.database_name = database_name
+        self.shards = []  # type: list[Database]
+        for i in range(shards):
+            if database_name == ":memory:":
+                path = database_name
+            else:
+                root, ext = os.path.splitext(database_name)
+                path = f"{root}.shard{i}{ext}"
+            self.shards.append(Database(path, **kwargs))
+        self.executor = ThreadPoolExecutor(max_workers=workers or shards, thread_name_prefix="shard")
+        self.tables = {}
+        self.open = True
+
+    def shard_for_table(self, table_name: str) -> Database:
+        """
+        Get the shard that a table sharded by table is stored on.
+        """
+        return self.shards[zlib.crc32(table_name.encode()) % len(self.shards)]
+
+    def create_table(self, table_name: str, columns: dict, primary_keys: List[str] = None,
+                     linked_tables: list = None, shard_by: str = "key"):
+        """
+        Create a table in the database.
+        :param table_name: The name of the table to create.
+        :param columns: A dictionary of the columns to create in the table.
+        :param primary_keys: A list of the primary keys in the table.
+        :param linked_tables: A list of tables to link to this table, links are only enforced within a shard.
+        :param shard_by: "key" to spread the rows over every shard, "table" to keep the table on one shard.
+        :return: A ShardedTable when sharded by key, otherwise the DynamicTable on its shard.
+        """
+        if not self.open:
+            raise RuntimeError("Database is closed")
+        if shard_by == "table":
+            table = self.shard_for_table(table_name).create_table(table_name, columns, primary_keys, linked_tables)
+        elif shard_by == "key":
+            tables = [shard.create_table(table_name, columns, primary_keys, linked_tables) for shard in self.shards]
+            table = ShardedTable(self, table_name, tables)
+        else:
+            raise ValueError(f"Unknown sharding mode {shard_by}")
+        self.tables[table_name] = table
+        return table
+
+    def get_table(self, table_name: str):
+        """
+        Get a table from the database.
+        :param table_name: The name of the table to get.
+        :return: A ShardedTable if the table is sharded by key, otherwise the DynamicTable on its shard.
+        """
+        if not self.open:
+            raise RuntimeError("Database is closed")
+        if table_name in self.tables:
+            return self.tables[table_name]
+        # A table present on every shard is sharded by key
+        tables = []
+        for shard in self.shards:
+            try:
+                tables.append(shard.get_table(table_name))
+            except KeyError:
+                pass
+        if not tables:
+            raise KeyError(f"Table {table_name} not found in database {self.database_name}")
+        elif len(tables) == len(self.shards):
+            table = ShardedTable(self, table_name, tables)
+        else:
+            table = self.shard_for_table(table_name).get_table(table_name)
+        self.tables[table_name] = table
+        return table
+
+    def drop_table(self, table_name: str):
+        """
+        Drop a table from every shard it is stored on.
+        """
+        if not self.open:
+            raise RuntimeError("Database is closed")
+        self.get_table(table_name)
+        for shard in self.shards:
+            if table_name in shard.tables:
+                shard.drop_table(table_name)
+        self.tables.pop(table_name)
+
+    def close(self):
+        """
+        Close every shard.
+        """
+        if not self.open:
+            return
+        self.open = False
+        self.executor.shutdown(wait=True)
+        for shard in self.shards:
+            shard.close()
+
+    def __repr__(self):
+        return f"ShardedDatabase({self.database_name}, {len(self.shards)} shards)"
+
+    def __del__(self):
+        if getattr(self, "open", False):
+            self.close()
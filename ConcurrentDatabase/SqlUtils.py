@@ -0,0 +1,181 @@
+import re
+import typing
+
+_KEYWORD = re.compile(r"^\s*(\w+)")
+_WHITESPACE = re.compile(r"\s+")
+_QUOTED_OR_WHITESPACE = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")|\s+")
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+_HEX_LITERAL = re.compile(r"\b[xX]'[0-9a-fA-F]*'")
+_TUPLE_LIST = re.compile(r"\(\?(?:, \.\.\.)?\)(?:\s*,\s*\(\?(?:, \.\.\.)?\))+")
+_WRITE_TARGET = re.compile(r"\b(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)"
+                           r"\s+([\w.\"`\[\]]+)", re.IGNORECASE)
+_UPDATE_SET = re.compile(r"^\s*UPDATE(?:\s+OR\s+\w+)?\s+[\w.\"`\[\]]+\s+SET\s+(.*?)(?:\bWHERE\b|\bFROM\b|\bRETURNING\b|$)",
+                         re.IGNORECASE | re.DOTALL)
+_ASSIGNED_COLUMN = re.compile(r"([\w\"`\[\]]+)\s*=(?!=)")
+# An identifier, bare or quoted with "", `` or []
+_NAME = r'"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\]|[A-Za-z_]\w*'
+_NAME_TOKEN = re.compile(rf"({_NAME})(\s*\.\s*)?")
+_SOURCE = re.compile(rf"\b(?:FROM|JOIN)\s+((?:{_NAME})(?:\s*\.\s*(?:{_NAME}))?)(\s*\()?", re.IGNORECASE)
+_CTE_NAME = re.compile(rf"(?:\bWITH(?:\s+RECURSIVE)?|,)\s*({_NAME})\s*(?:\([^)]*\)\s*)?AS\s*(?:NOT\s+)?"
+                       rf"(?:MATERIALIZED\s*)?\(", re.IGNORECASE)
+
+READ_KEYWORDS = ["SELECT", "PRAGMA", "EXPLAIN", "VALUES"]
+WRITE_KEYWORDS = ["INSERT", "REPLACE", "UPDATE", "DELETE"]
+SCHEMA_KEYWORDS = ["CREATE", "DROP", "ALTER"]
+# Words that can follow UPDATE without it being an UPDATE statement (ON CONFLICT DO UPDATE SET, AFTER UPDATE ON/OF)
+_NOT_TABLES = ["SET", "ON", "OF"]
+
+
+def statement_type(sql: str) -> str:
+    """
+    Classify a SQL statement by its leading keyword.
+    :param sql: The SQL statement.
+    :return: "read", "write", "schema" or "other" (transaction control, ATTACH, VACUUM, etc.)
+    """
+    match = _KEYWORD.match(sql)
+    if not match:
+        return "other"
+    keyword = match.group(1).upper()
+    if keyword in READ_KEYWORDS:
+        return "read"
+    elif keyword in WRITE_KEYWORDS:
+        return "write"
+    elif keyword in SCHEMA_KEYWORDS:
+        return "schema"
+    elif keyword == "WITH":  # A common table expression can prefix both reads and writes
+        return "write" if _WRITE_TARGET.search(sql) else "read"
+    return "other"
+
+
+def written_tables(sql: str) -> typing.List[str]:
+    """
+    Get the names of the tables a write statement (or script of statements) modifies.
+    :param sql: The SQL statement.
+    :return: The table names without quoting, an empty list if none could be determined.
+    """
+    tables = []
+    for name in _WRITE_TARGET.findall(sql):
+        name = name.strip("\"`[]").replace("\"", "").replace("`", "")
+        if name.upper() in _NOT_TABLES:
+            continue
+        if name.lower().startswith("main."):
+            name = name[5:]
+        if name not in tables:
+            tables.append(name)
+    return tables
+
+
+def column_affinity(column_type: str) -> str:
+    """
+    Get the type affinity SQLite gives a column with the given declared type.
+    :param column_type: The declared type of the column.
+    :return: "INTEGER", "TEXT", "BLOB", "REAL" or "NUMERIC"
+    """
+    column_type = (column_type or "").upper()
+    if "INT" in column_type:
+        return "INTEGER"
+    elif "CHAR" in column_type or "CLOB" in column_type or "TEXT" in column_type:
+        return "TEXT"
+    elif "BLOB" in column_type or not column_type:
+        return "BLOB"
+    elif "REAL" in column_type or "FLOA" in column_type or "DOUB" in column_type:
+        return "REAL"
+    return "NUMERIC"
+
+
+def updated_columns(sql: str) -> typing.Optional[typing.List[str]]:
+    """
+    Get the names of the columns set by an UPDATE statement.
+    :param sql: The SQL statement.
+    :return: The column names, None if the statement isn't a plain UPDATE.
+    """
+    match = _UPDATE_SET.match(sql)
+    if not match or "SELECT" in match.group(1).upper():  # A subquery hides where the SET clause ends
+        return None
+    return [name.strip("\"`[]") for name in _ASSIGNED_COLUMN.findall(match.group(1))]
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Normalize the formatting of a SQL statement so equivalent statements compare equal, quoted strings and
+    identifiers are left as they are.
+    """
+    return _QUOTED_OR_WHITESPACE.sub(lambda match: match.group(1) or " ", sql).strip().rstrip(";").strip()
+
+
+def _unquote(name: str) -> str:
+    if name[:1] in ("\"", "`", "[") and len(name) > 1:
+        return name[1:-1].replace("\"\"", "\"") if name[0] == "\"" else name[1:-1]
+    return name
+
+
+def _identifiers(sql: str) -> typing.Set[str]:
+    """
+    Get every identifier in a statement, and every pair of identifiers joined by a dot, unquoted and case folded.
+    """
+    identifiers = set()
+    previous = None  # An identifier that was followed by a dot
+    for name, dot in _NAME_TOKEN.findall(_STRING_LITERAL.sub("''", sql)):
+        name = _unquote(name).casefold()
+        identifiers.add(name)
+        if previous is not None:
+            identifiers.add(f"{previous}.{name}")
+        previous = name if dot else None
+    return identifiers
+
+
+def referenced_tables(sql: str, table_names) -> typing.List[str]:
+    """
+    Get the tables a statement may reference, any identifier in the statement that names a table is included.
+    Identifiers are matched case-insensitively, quoted or not.
+    :param sql: The SQL statement.
+    :param table_names: The names of the tables in the database.
+    :return: The table names, as they were given.
+    """
+    identifiers = _identifiers(sql)
+    return sorted(name for name in table_names if name.casefold() in identifiers)
+
+
+def read_sources(sql: str) -> typing.Optional[typing.List[str]]:
+    """
+    Get the names a statement reads rows from (after FROM or JOIN), leaving out its common table expressions.
+    :param sql: The SQL statement.
+    :return: The unquoted, case folded names, None if it reads from a table-valued function.
+    """
+    sql = _STRING_LITERAL.sub("''", sql)
+    ctes = {_unquote(name).casefold() for name in _CTE_NAME.findall(sql)}
+    sources = []
+    for name, call in _SOURCE.findall(sql):
+        if call:
+            return None
+        name = ".".join(_unquote(part.strip()) for part in re.findall(rf"{_NAME}", name)).casefold()
+        if name not in ctes:
+            sources.append(name)
+    return sources
+
+
+def split_table_name(table_name: str) -> typing.Tuple[str, str]:
+    """
+    Split a table name that may be qualified with the alias of an attached database.
+    :param table_name: e.g. "users" or "archive.users"
+    :return: The schema ("main" if unqualified) and the name of the table within it.
+    """
+    if "." in table_name:
+        schema, name = table_name.split(".", 1)
+        return schema, name
+    return "main", table_name
+
+
+def statement_shape(sql: str) -> str:
+    """
+    Reduce a statement to its shape by replacing literal values with placeholders, so statements that only differ in
+    their values compare equal.
+    """
+    shape = _HEX_LITERAL.sub("?", sql)
+    shape = _STRING_LITERAL.sub("?", shape)
+    shape = _NUMBER_LITERAL.sub("?", shape)
+    shape = _PLACEHOLDER_LIST.sub("?, ...", shape)
+    shape = _TUPLE_LIST.sub("(?, ...), ...", shape)
+    return normalize_sql(shape)
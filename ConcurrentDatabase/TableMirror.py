@@ -0,0 +1,93 @@
+import re
+import sqlite3
+import threading
+
+from .SqlUtils import split_table_name
+
+_CREATE_TABLE = re.compile(r"^\s*CREATE\s+TABLE\s+", re.IGNORECASE)
+
+
+class TableMirror:
+    """
+    A copy of a single table in a private in-memory database. Reads are served from the copy under its own small lock
+    instead of the database lock, writes made through the database are applied to both copies.
+    """
+
+    def __init__(self, table_name: str):
+        self.table_name = table_name
+        self.connection = None  # type: sqlite3.Connection or None
+        self.lock = threading.Lock()
+        self.reads = 0
+        self.reloads = 0
+
+    def load(self, database):
+        """
+        Copy the table from the database into a new in-memory database. Must be called while holding the database lock.
+        :param database: The database the table is stored in.
+        """
+        schema, name = split_table_name(self.table_name)
+        source = sqlite3.Connection.cursor(database)
+        try:
+            create = source.execute(f"SELECT sql FROM {schema}.sqlite_master WHERE type='table' AND name=?",
+                                    (name,)).fetchone()
+            if create is None:
+                raise KeyError(f"Table {self.table_name} not found in database {database.database_name}")
+            columns = [row[1] for row in source.execute(f"PRAGMA {schema}.table_info({name})").fetchall()]
+            rows = source.execute(f"SELECT rowid, * FROM {self.table_name}").fetchall()
+            sequence = []
+            if source.execute(f"SELECT name FROM {schema}.sqlite_master WHERE name='sqlite_sequence'").fetchone():
+                sequence = source.execute(f"SELECT seq FROM {schema}.sqlite_sequence WHERE name=?",
+                                          (name,)).fetchall()
+        finally:
+            source.close()
+
+        connection = sqlite3.connect(":memory:", check_same_thread=False)
+        if schema != "main":  # The copy of an attached table is kept under the same alias so queries run unchanged
+            connection.execute(f"ATTACH DATABASE ':memory:' AS {schema}")
+            connection.execute(_CREATE_TABLE.sub(rf"\g<0>{schema}.", create[0], count=1))
+        else:
+            connection.execute(create[0])
+        # Rowids are copied as well so replayed statements affect the same rows in both copies
+        connection.executemany(f"INSERT INTO {self.table_name} (rowid, {', '.join(columns)}) "
+                               f"VALUES ({', '.join(['?'] * (len(columns) + 1))})", rows)
+        if sequence:  # Keep AUTOINCREMENT handing out the same keys as the database
+            connection.execute(f"INSERT INTO {schema}.sqlite_sequence (name, seq) VALUES (?, ?)",
+                               (name, sequence[0][0]))
+        connection.commit()
+        with self.lock:
+            previous, self.connection = self.connection, connection
+            self.reloads += 1
+        if previous is not None:
+            previous.close()
+
+    def query(self, sql: str, args=()) -> list:
+        """
+        Run a read query against the copy.
+        :raises sqlite3.Error: If the query can't be answered from the copy, e.g. it references another table.
+        """
+        with self.lock:
+            self.reads += 1
+            return self.connection.execute(sql, args).fetchall()
+
+    def apply(self, sql: str, args=(), many: bool = False, script: bool = False):
+        """
+        Replay a write that was made to the database on the copy.
+        :raises sqlite3.Error: If the statement can't be replayed, the copy should then be reloaded.
+        """
+        with self.lock:
+            try:
+                if script:
+                    self.connection.executescript(sql)
+                elif many:
+                    self.connection.executemany(sql, args)
+                else:
+                    self.connection.execute(sql, args).fetchall()
+            finally:
+                if self.connection.in_transaction:
+                    self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
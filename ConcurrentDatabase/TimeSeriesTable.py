@@ -0,0 +1,216 @@
+import json
+import threading
+import time
+import typing
+
+from typing import List
+
+from .DynamicTable import DynamicTable
+
+from loguru import logger as logging
+
+
+def rollup_table_name(table_name: str, label: str) -> str:
+    return f"{table_name}_rollup_{label}"
+
+
+class TimeSeriesTable(DynamicTable):
+    """
+    An append-only table of timestamped samples. Samples are buffered and written in batches, rows are stored in
+    time order so expired samples can be deleted a small range at a time, and samples can be summarised into
+    downsampled rollup tables before they expire.
+    """
+
+    def __init__(self, table_name, database):
+        super().__init__(table_name, database)
+        settings = {key: self.database.get_metadata(table_name, key).get("")
+                    for key in ("time_column", "retention", "rollups", "rollup_columns", "batch_size")}
+        self.time_column = settings["time_column"] or "timestamp"  # type: str
+        self.retention = float(settings["retention"]) if settings["retention"] else None  # type: float or None
+        self.rollups = json.loads(settings["rollups"]) if settings["rollups"] else {}  # type: dict[str, float]
+        self.rollup_columns = json.loads(settings["rollup_columns"]) if settings["rollup_columns"] else []
+        self.batch_size = int(settings["batch_size"]) if settings["batch_size"] else 500  # type: int
+        # Tables created with clustered="timestamp" use the time as an INTEGER PRIMARY KEY, one sample per second
+        self.clustered = bool(self.get_column(self.time_column).primary_key)  # type: bool
+        self.retention_interval = 60.0  # Seconds between the retention checks made when appends are flushed
+        self._buffer = []  # type: list[dict]  # Appended samples that haven't been written yet
+        self._buffer_lock = threading.Lock()
+        self._last_retention = time.monotonic()
+
+    def append(self, **kwargs):
+        """
+        Append a sample, it is written once batch_size samples have been buffered or flush_appends is called.
+        :param kwargs: The values of the sample, the time column defaults to the current unix time (in whole seconds
+         if the table is clustered by time).
+        """
+        self.append_many([kwargs])
+
+    def append_many(self, rows: typing.Iterable[dict]):
+        """
+        Append many samples.
+        :param rows: The values of each sample.
+        :raises ValueError: If the table is clustered by time and a sample time isn't a whole second.
+        """
+        now = int(time.time()) if self.clustered else time.time()
+        rows = [row if self.time_column in row else dict(row, **{self.time_column: now}) for row in rows]
+        for row in rows:
+            self._validate_columns(**row)
+            if self.clustered:
+                sample_time = row[self.time_column]
+                if isinstance(sample_time, float) and not sample_time.is_integer():
+                    raise ValueError(f"Table {self.table_name} is clustered by time, sample times must be whole "
+                                     f"seconds")
+        with self._buffer_lock:
+            self._buffer.extend(rows)
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self.flush_appends()
+
+    def flush_appends(self) -> int:
+        """
+        Write every buffered sample, samples with the same columns are written in one transaction. In a table
+        clustered by time a sample whose second already holds a sample is dropped with a warning.
+        :return: The number of samples written.
+        """
+        with self._buffer_lock:
+            rows, self._buffer = self._buffer, []
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(row.keys()), []).append(row)
+        written = 0
+        for columns, group in groups.items():
+            sql = f"INSERT INTO {self.table_name} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})"
+            if self.clustered:  # Only the time is unique, the conflict is left to the insert rather than checked first
+                sql += f" ON CONFLICT ({self.time_column}) DO NOTHING"
+            cursor = self.database.run_many(sql, [self._encode_values(row) for row in group])
+            written += cursor.rowcount
+            if cursor.rowcount < len(group):
+                logging.warning(f"Dropped {len(group) - cursor.rowcount} samples of {self.table_name} at a second "
+                                f"that already holds a sample")
+        if self.retention is not None and time.monotonic() - self._last_retention >= self.retention_interval:
+            self.enforce_retention()
+        return written
+
+    def flush(self):
+        self.flush_appends()
+        super().flush()
+
+    def range(self, start: float = None, end: float = None, limit: int = -1) -> List[dict]:
+        """
+        Get the samples in a time range, oldest first.
+        :param start: The earliest time to include.
+        :param end: The time to stop at (exclusive).
+        :param limit: The maximum number of samples.
+        :return: A dictionary of column names to values for each sample.
+        """
+        self.flush_appends()
+        filters, args = [], ()
+        if start is not None:
+            filters.append(f"{self.time_column} >= ?")
+            args += (start,)
+        if end is not None:
+            filters.append(f"{self.time_column} < ?")
+            args += (end,)
+        sql = f"SELECT * FROM {self.table_name}"
+        if filters:
+            sql += " WHERE " + " AND ".join(filters)
+        sql += f" ORDER BY {self.time_column} LIMIT {int(limit)}"
+        names = [column.name for column in self.columns]
+        return [{name: column.decode(value) for name, column, value in zip(names, self.columns, row)}
+                for row in self._read(sql, args)]
+
+    def rollup(self, label: str, start: float = None, end: float = None) -> List[dict]:
+        """
+        Get the downsampled buckets of a rollup, oldest first.
+        :param label: The label the rollup was created with.
+        :return: A dictionary per bucket with the bucket start time, the sample count and the min, max, sum and
+         average of each rolled up column.
+        """
+        if label not in self.rollups:
+            raise KeyError(f"Rollup {label} not found for table {self.table_name}")
+        sql = f"SELECT * FROM {rollup_table_name(self.table_name, label)} WHERE bucket >= ? AND bucket < ? " \
+              f"ORDER BY bucket"
+        names = ["bucket", "count"] + [f"{column}_{stat}" for column in self.rollup_columns
+                                       for stat in ("min", "max", "sum")]
+        buckets = []
+        for row in self._read(sql, (start if start is not None else float("-inf"),
+                                    end if end is not None else float("inf"))):
+            bucket = dict(zip(names, row))
+            for column in self.rollup_columns:
+                bucket[f"{column}_avg"] = bucket[f"{column}_sum"] / bucket["count"] if bucket["count"] else None
+            buckets.append(bucket)
+        return buckets
+
+    def _rollup_sql(self, label: str, interval: float) -> str:
+        """
+        Build the statement that adds the samples older than a cutoff (and up to a rowid) to a rollup.
+        """
+        stats = [f"MIN({column}), MAX({column}), SUM({column})" for column in self.rollup_columns]
+        stat_columns = [f"{column}_{stat}" for column in self.rollup_columns for stat in ("min", "max", "sum")]
+        updates = ["count = count + excluded.count"]
+        for column in self.rollup_columns:
+            updates.append(f"{column}_min = MIN(COALESCE({column}_min, excluded.{column}_min), "
+                           f"COALESCE(excluded.{column}_min, {column}_min))")
+            updates.append(f"{column}_max = MAX(COALESCE({column}_max, excluded.{column}_max), "
+                           f"COALESCE(excluded.{column}_max, {column}_max))")
+            updates.append(f"{column}_sum = COALESCE({column}_sum, 0) + COALESCE(excluded.{column}_sum, 0)")
+        bucket = f"CAST({self.time_column} / {interval} AS INTEGER) * {interval}"
+        # The SELECT's WHERE clause keeps SQLite from parsing ON CONFLICT as part of a join constraint (an upsert from
+        # a SELECT without one needs a WHERE true)
+        return f"INSERT INTO {rollup_table_name(self.table_name, label)} (bucket, count, {', '.join(stat_columns)}) " \
+               f"SELECT {bucket}, COUNT(*), {', '.join(stats)} FROM {self.table_name} " \
+               f"WHERE {self.time_column} < ? AND rowid <= ? GROUP BY 1 " \
+               f"ON CONFLICT (bucket) DO UPDATE SET {', '.join(updates)}"
+
+    def enforce_retention(self, now: float = None, chunk_size: int = 1000) -> int:
+        """
+        Delete the samples older than the retention period, rolling them up first. The samples are deleted
+        chunk_size rows per transaction and the lock is released between transactions so writers aren't stalled.
+        :param now: The current unix time.
+        :param chunk_size: The number of rows deleted per transaction.
+        :return: The number of samples deleted.
+        """
+        self._last_retention = time.monotonic()
+        if self.retention is None:
+            return 0
+        cutoff = (now if now is not None else time.time()) - self.retention
+        return self.expire_before(cutoff, chunk_size)
+
+    def expire_before(self, cutoff: float, chunk_size: int = 1000) -> int:
+        """
+        Delete the samples older than a cutoff time, rolling them up first.
+        :param cutoff: The unix time to delete samples before.
+        :param chunk_size: The number of rows deleted per transaction.
+        :return: The number of samples deleted.
+        """
+        deleted = 0
+        while True:
+            # The rows are stored in time order, so the oldest chunk is a contiguous range of rowids
+            last = self._read(f"SELECT MAX(rowid), COUNT(*) FROM (SELECT rowid FROM {self.table_name} "
+                              f"WHERE {self.time_column} < ? ORDER BY rowid LIMIT ?)", (cutoff, chunk_size))
+            if not last or last[0][0] is None:
+                break
+            statements = [(self._rollup_sql(label, interval), (cutoff, last[0][0]))
+                          for label, interval in self.rollups.items()]
+            statements.append((f"DELETE FROM {self.table_name} WHERE {self.time_column} < ? AND rowid <= ?",
+                               (cutoff, last[0][0])))
+            self.database.transaction(statements)
+            deleted += last[0][1]
+            if last[0][1] < chunk_size:
+                break
+        self.entries = [entry for entry in self.entries
+                        if entry is not None and entry[self.time_column] is not None and
+                        entry[self.time_column] >= cutoff]
+        return deleted
+
+    def __del__(self):
+        if self._buffer and self.database.open:
+            self.flush_appends()
+        super().__del__()
+
+    def __len__(self):
+        self.flush_appends()
+        return super().__len__()
+
+    def __repr__(self):
+        return f"TimeSeriesTable({self.table_name}, {self.database})"
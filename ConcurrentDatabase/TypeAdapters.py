@@ -0,0 +1,115 @@
+import datetime
+import decimal
+import json
+
+# Column type -> (python types stored in it, adapter to a SQLite value, converter from the stored value)
+TYPE_ADAPTERS = {}
+
+# The python types accepted without parsing by validate="fast" for the built in column types
+NATIVE_TYPES = {
+    "INTEGER": (int,),
+    "INT": (int,),
+    "REAL": (float, int),
+    "TEXT": (str,),
+    "STRING": (str,),
+    "BLOB": (bytes, bytearray, memoryview),
+    "BOOLEAN": (bool,),
+}
+
+
+def register_type(column_type: str, python_types: tuple, adapter=None, converter=None):
+    """
+    Register how values of a column type are written to and read from the database. The conversions are applied by
+    ColumnWrapper.encode and decode on databases opened with type_adapters=True, nothing is registered with sqlite3
+    so other connections in the process are unaffected.
+    :param column_type: The declared type of the column, e.g. "JSON".
+    :param python_types: The python types stored in columns of this type.
+    :param adapter: Converts a python value to an int, float, str or bytes.
+    :param converter: Converts the value read from the database back to the python value, values it can't convert
+     should be returned unchanged.
+    """
+    column_type = column_type.upper()
+    TYPE_ADAPTERS[column_type] = (tuple(python_types), adapter, converter)
+
+
+def accepts(column_type: str, value) -> bool:
+    """
+    Check if a value is one of the python types registered for a column type.
+    """
+    registered = TYPE_ADAPTERS.get(column_type)
+    return registered is not None and isinstance(value, registered[0])
+
+
+def adapt(column_type: str, value):
+    """
+    Convert a value to the form sqlite3 stores it in, values without a registered adapter are returned unchanged.
+    """
+    registered = TYPE_ADAPTERS.get(column_type)
+    if registered is None or registered[1] is None or not isinstance(value, registered[0]):
+        return value
+    return registered[1](value)
+
+
+def convert(column_type: str, value):
+    """
+    Convert a value read from the database to the python type registered for the column type, values without a
+    registered converter are returned unchanged.
+    """
+    registered = TYPE_ADAPTERS.get(column_type)
+    if registered is None or registered[2] is None or value is None:
+        return value
+    return registered[2](value)
+
+
+def has_converter(column_type: str) -> bool:
+    registered = TYPE_ADAPTERS.get(column_type)
+    return registered is not None and registered[2] is not None
+
+
+# Values that don't parse, e.g. a legacy TIMESTAMP column holding epoch seconds, are returned as they were stored
+def _convert_date(value):
+    if not isinstance(value, str):
+        return value
+    try:
+        return datetime.date.fromisoformat(value[:10])
+    except ValueError:
+        return value
+
+
+def _convert_datetime(value):
+    if not isinstance(value, str):
+        return value
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return value
+
+
+def _convert_decimal(value):
+    if isinstance(value, bytes):
+        return value
+    try:
+        return decimal.Decimal(str(value))
+    except decimal.InvalidOperation:
+        return value
+
+
+def _convert_json(value):
+    if not isinstance(value, (str, bytes)):
+        return value
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def _convert_boolean(value):
+    return bool(value) if isinstance(value, int) and value in (0, 1) else value
+
+
+register_type("DATE", (datetime.date,), datetime.date.isoformat, _convert_date)
+register_type("DATETIME", (datetime.datetime,), datetime.datetime.isoformat, _convert_datetime)
+register_type("TIMESTAMP", (datetime.datetime,), datetime.datetime.isoformat, _convert_datetime)
+register_type("DECIMAL", (decimal.Decimal,), str, _convert_decimal)
+register_type("JSON", (dict, list), json.dumps, _convert_json)
+register_type("BOOLEAN", (bool,), int, _convert_boolean)
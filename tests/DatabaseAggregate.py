@@ -0,0 +1,74 @@
+import os
+import sqlite3
+import unittest
+
+from ConcurrentDatabase.Database import Database
+
+
+class DatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.database = Database("aggregate_test.db", no_gc=True)
+        self.table = self.database.create_table("sales", {"id": "INTEGER PRIMARY KEY", "store": "TEXT",
+                                                          "amount": "INTEGER"})
+        for i in range(30):
+            self.table.add(id=i, store=f"store{i % 3}", amount=i)
+
+    def tearDown(self):
+        self.database.close()
+        if os.path.exists("aggregate_test.db"):
+            os.remove("aggregate_test.db")
+
+    def expected(self, store):
+        return self.database.get("SELECT SUM(amount), COUNT(*) FROM sales WHERE store = ?", (store,))[0]
+
+    def test_aggregate_maintained(self):
+        totals = self.table.create_materialized_aggregate("sales_by_store", group_by=["store"], sum=["amount"])
+        row = totals.get_row(store="store1")
+        self.assertEqual((row["sum_amount"], row["count"]), self.expected("store1"))
+
+        self.table.add(id=100, store="store1", amount=1000)
+        self.table.get_row(id=1).set(store="store2")
+        self.table.delete(id=4)
+        for store in ["store0", "store1", "store2"]:
+            row = totals.get_row(store=store)
+            self.assertEqual((row["sum_amount"], row["count"]), self.expected(store))
+
+        self.table.delete_many(store="store0")
+        self.assertIsNone(totals.get_row(store="store0"))
+
+    def test_drop_aggregate_table(self):
+        self.table.create_materialized_aggregate("sales_by_store", group_by=["store"], sum=["amount"])
+        self.database.drop_table("sales_by_store")
+        self.assertEqual(self.table.materialized_aggregates, [])
+        self.assertNotIn("sales_by_store", self.database.tables)
+        self.table.add(id=100, store="store1", amount=1000)
+        self.assertEqual(self.database.get("SELECT amount FROM sales WHERE id = 100"), [(1000,)])
+
+    def test_aggregate_survives_restart(self):
+        self.table.create_materialized_aggregate("sales_by_store", group_by=["store"], sum=["amount"])
+        self.database.close()
+        self.database = Database("aggregate_test.db", no_gc=True)
+        self.table = self.database.get_table("sales")
+        self.assertEqual(self.table.materialized_aggregates, ["sales_by_store"])
+        self.assertEqual(self.database.table_version_table.get_row(table_name="sales_by_store")["version"], 0)
+        self.table.add(id=100, store="store1", amount=1000)
+        row = self.database.get_table("sales_by_store").get_row(store="store1")
+        self.assertEqual((row["sum_amount"], row["count"]), self.expected("store1"))
+
+        self.database.drop_table("sales")
+        self.assertRaises(KeyError, self.database.get_table, "sales_by_store")
+
+    def test_failed_creation_is_rolled_back(self):
+        # An existing table that rejects the totals makes filling the aggregate fail after the triggers are created
+        self.database.run("CREATE TABLE sales_by_store (store TEXT PRIMARY KEY, sum_amount INTEGER, "
+                          "count INTEGER CHECK (count < 0))")
+        self.assertRaises(sqlite3.IntegrityError, self.table.create_materialized_aggregate, "sales_by_store",
+                          group_by=["store"], sum=["amount"])
+        self.assertEqual(self.table.materialized_aggregates, [])
+        self.table.add(id=100, store="store1", amount=1000)  # No half installed triggers fire
+        self.assertEqual(self.database.get("SELECT COUNT(*) FROM sales_by_store")[0][0], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
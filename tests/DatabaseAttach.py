@@ -0,0 +1,98 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from ConcurrentDatabase.Database import Database
+
+
+class DatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        archive = sqlite3.connect(os.path.join(self.directory.name, "archive.db"))
+        archive.executescript("""
+            CREATE TABLE stores (id INTEGER PRIMARY KEY, city TEXT);
+            CREATE TABLE orders (id INTEGER PRIMARY KEY, user_id INTEGER, store_id INTEGER REFERENCES stores(id),
+                                 total REAL);
+            INSERT INTO stores VALUES (1, 'Oslo');
+            INSERT INTO orders VALUES (1, 1, 1, 10.0), (2, 1, 1, 5.5), (3, 2, 1, 7.0);
+        """)
+        archive.commit()
+        archive.close()
+        self.database = Database(os.path.join(self.directory.name, "main.db"), no_gc=True)
+        self.users = self.database.create_table("users", {"id": "INTEGER PRIMARY KEY", "name": "TEXT"})
+        self.users.add(id=1, name="ada")
+        self.users.add(id=2, name="bob")
+        self.tables = self.database.attach(os.path.join(self.directory.name, "archive.db"), "archive")
+
+    def tearDown(self):
+        self.database.close()
+        self.directory.cleanup()
+
+    def test_attached_tables(self):
+        self.assertEqual(sorted(table.table_name for table in self.tables), ["archive.orders", "archive.stores"])
+        orders = self.database.get_table("archive.orders")
+        self.assertEqual(orders.get_row(id=2)["total"], 5.5)
+        orders.get_row(id=2).set(total=6.5)
+        self.assertEqual(self.database.get("SELECT total FROM archive.orders WHERE id = 2"), [(6.5,)])
+        # Foreign keys inside the attached file are linked with qualified names
+        self.assertIn("archive.stores.id <-> archive.orders.store_id", [str(link) for link in self.database.table_links])
+
+    def test_cross_file_queries(self):
+        self.assertEqual([user["name"] for user in
+                          self.users.select("id IN (SELECT user_id FROM archive.orders WHERE total > 6)")],
+                         ["ada", "bob"])
+        rows = self.users.custom_query("SELECT users.name, SUM(orders.total) FROM users "
+                                       "JOIN archive.orders AS orders ON orders.user_id = users.id "
+                                       "GROUP BY users.id ORDER BY users.id")
+        self.assertEqual(rows, [("ada", 15.5), ("bob", 7.0)])
+
+    def test_declared_links_and_cache(self):
+        self.database.link_tables("archive.orders", "user_id", "users", "id")
+        orders = self.database.get_table("archive.orders")
+        self.assertEqual(len(orders.get_related_entries(self.users.get_row(id=1))), 2)
+        self.database.enable_query_cache()
+        sql = "SELECT COUNT(*) FROM archive.orders"
+        self.assertEqual(self.database.cached_get(sql), [(3,)])
+        orders.add(id=4, user_id=2, store_id=1, total=1.0)
+        self.assertEqual(self.database.cached_get(sql), [(4,)])
+        self.database.detach("archive")
+        self.assertEqual(self.database.declared_links, [])
+        self.assertRaises(KeyError, self.database.get_table, "archive.orders")
+
+    def test_triggers_on_attached_tables(self):
+        orders = self.database.get_table("archive.orders")
+        orders.enable_changelog()
+        self.assertTrue(orders.changelog_enabled)
+        orders.add(id=4, user_id=2, store_id=1, total=1.0)
+        self.assertEqual([change.operation for change in orders.changes_since(0)], ["INSERT"])
+
+        stores = self.database.get_table("archive.stores")
+        stores.enable_fulltext(["city"])
+        self.assertEqual(stores.fulltext_columns, ["city"])
+        stores.add(id=2, city="Bergen")
+        self.assertEqual([row["id"] for row in stores.search("bergen")], [2])
+
+        self.assertRaises(ValueError, orders.create_materialized_aggregate, "totals", group_by=["user_id"])
+        totals = orders.create_materialized_aggregate("archive.totals", group_by=["user_id"], sum=["total"])
+        orders.add(id=5, user_id=1, store_id=1, total=2.0)
+        self.assertEqual(totals.get_row(user_id=1)["sum_total"], 17.5)
+        self.assertEqual(orders.materialized_aggregates, ["archive.totals"])
+        self.database.drop_table("archive.orders")
+        self.assertEqual(self.database.get("SELECT name FROM archive.sqlite_master WHERE type='trigger' "
+                                           "AND tbl_name='orders'"), [])
+
+    def test_pin_attached_table(self):
+        self.database.pin_in_memory("archive.orders")
+        mirror = self.database.mirrors["archive.orders"]
+        orders = self.database.get_table("archive.orders")
+        self.database.lock.acquire()  # Served from the copy without the database lock
+        try:
+            self.assertEqual(orders.get_row(id=2)["total"], 5.5)
+        finally:
+            self.database.lock.release()
+        orders.add(id=4, user_id=2, store_id=1, total=1.0)
+        self.assertEqual(mirror.query("SELECT id FROM archive.orders ORDER BY id"), [(1,), (2,), (3,), (4,)])
+        self.assertGreaterEqual(mirror.reads, 1)
+
@@ -0,0 +1,96 @@
+import time
+import unittest
+
+from ConcurrentDatabase.Database import Database
+
+
+class DatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.database = Database(":memory:", no_gc=True)
+        self.users = self.database.create_table("users", {"id": "INTEGER PRIMARY KEY", "name": "TEXT"})
+        self.items = self.database.create_table("items", {"id": "INTEGER PRIMARY KEY", "count": "INTEGER"})
+        for i in range(10):
+            self.users.add(id=i, name=f"user{i}")
+            self.items.add(id=i, count=0)
+
+    def tearDown(self):
+        self.database.close()
+
+    def wait_for(self, condition, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def test_flushes_after_interval(self):
+        flusher = self.database.enable_auto_flush(interval=0.05)
+        self.users.get_row(id=1)["name"] = "ada"
+        self.items.get_row(id=1)["count"] = 5
+        self.assertEqual(flusher.pending(), 2)
+        self.assertTrue(self.wait_for(lambda: self.database.stats()["auto_flush"]["flushes"] >= 1))
+        self.assertEqual(self.database.get("SELECT name FROM users WHERE id = 1"), [("ada",)])
+        self.assertEqual(self.database.get("SELECT count FROM items WHERE id = 1"), [(5,)])
+        stats = self.database.stats()["auto_flush"]
+        self.assertEqual(stats["entries"], 2)
+        self.assertEqual(stats["pending"], 0)
+        self.assertGreater(stats["last_lag"], 0.0)
+
+    def test_flushes_when_full(self):
+        flusher = self.database.enable_auto_flush(interval=3600, max_dirty=5)
+        for i in range(4):
+            self.items.get_row(id=i)["count"] = 1
+        time.sleep(0.05)
+        self.assertEqual(flusher.pending(), 4)
+        self.items.get_row(id=4)["count"] = 1
+        self.assertTrue(self.wait_for(lambda: flusher.pending() == 0))
+        self.assertEqual(self.database.get("SELECT SUM(count) FROM items"), [(5,)])
+        self.assertFalse(self.items.has_dirty_entries())
+
+    def test_disable_writes_pending_changes(self):
+        entry = self.users.get_row(id=2)
+        entry["name"] = "already dirty"
+        self.database.enable_auto_flush(interval=3600)
+        self.users.get_row(id=3)["name"] = "bob"
+        self.database.disable_auto_flush()
+        self.assertEqual(self.database.get("SELECT name FROM users WHERE id IN (2, 3) ORDER BY id"),
+                         [("already dirty",), ("bob",)])
+        self.assertFalse(entry.is_dirty())
+        self.assertIsNone(self.database.auto_flusher)
+
+    def test_failed_flush_is_retried(self):
+        flusher = self.database.enable_auto_flush(interval=3600)
+        flusher.stop()  # Only flush when asked to
+        self.database.run("CREATE TRIGGER no_bob BEFORE UPDATE ON users WHEN NEW.name = 'bob' "
+                          "BEGIN SELECT RAISE(ABORT, 'no bob'); END")
+        entry = self.users.get_row(id=4)
+        entry["name"] = "bob"
+        self.items.get_row(id=4)["count"] = 9
+        self.assertEqual(flusher.flush(), 1)  # The other entry is still written
+        self.assertTrue(entry.is_dirty())
+        self.assertEqual(flusher.pending(), 1)
+        self.assertEqual(self.database.get("SELECT count FROM items WHERE id = 4"), [(9,)])
+        entry["name"] = "bea"
+        self.assertEqual(flusher.flush(), 1)
+        self.assertEqual(self.database.get("SELECT name FROM users WHERE id = 4"), [("bea",)])
+        self.assertEqual(flusher.stats()["errors"], 1)
+
+    def test_entry_that_never_flushes_is_dropped(self):
+        flusher = self.database.enable_auto_flush(interval=3600, max_retries=3)
+        flusher.stop()
+        self.database.run("CREATE TRIGGER no_bob BEFORE UPDATE ON users WHEN NEW.name = 'bob' "
+                          "BEGIN SELECT RAISE(ABORT, 'no bob'); END")
+        entry = self.users.get_row(id=5)
+        entry["name"] = "bob"
+        for attempt in range(3):
+            self.items.get_row(id=attempt)["count"] = attempt + 1
+            self.assertEqual(flusher.flush(), 1)
+        self.assertEqual(flusher.pending(), 0)
+        self.assertEqual(flusher.stats()["dropped"], 1)
+        self.assertTrue(entry.is_dirty())  # The change is kept for the application to deal with
+        self.items.get_row(id=3)["count"] = 4
+        self.assertEqual(flusher.flush(), 1)
+        self.assertEqual(self.database.get("SELECT SUM(count) FROM items"), [(10,)])
+        entry["name"] = "bea"  # Changing it again registers it again
+        self.assertEqual(flusher.flush(), 1)
+        self.assertEqual(self.database.get("SELECT name FROM users WHERE id = 5"), [("bea",)])
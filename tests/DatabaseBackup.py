@@ -0,0 +1,57 @@
+import os
+import sqlite3
+import threading
+import unittest
+
+from ConcurrentDatabase.Database import Database
+
+
+class DatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.database = Database("backup_source.db", no_gc=True)
+        self.table = self.database.create_table("test_table", {"id": "INTEGER PRIMARY KEY", "payload": "TEXT"})
+        self.table.upsert_many([{"id": i, "payload": "x" * 500} for i in range(2000)])
+
+    def tearDown(self):
+        self.database.close()
+        for path in ("backup_source.db", "backup_target.db"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def count(self, path):
+        connection = sqlite3.connect(path)
+        result = connection.execute("SELECT COUNT(*) FROM test_table").fetchone()[0]
+        connection.close()
+        return result
+
+    def test_backup(self):
+        steps = []
+        job = self.database.backup_to("backup_target.db", pages_per_step=16, sleep=0,
+                                      progress=lambda copied, total: steps.append((copied, total)))
+        self.assertTrue(job.wait(30))
+        self.assertEqual(job.progress, 1.0)
+        self.assertGreater(len(steps), 1)
+        self.assertEqual(steps[-1][0], steps[-1][1])
+        self.assertEqual(self.count("backup_target.db"), 2000)
+        self.assertFalse(os.path.exists("backup_target.db.partial"))
+
+    def test_queries_run_during_backup(self):
+        reads = []
+        job = self.database.backup_to("backup_target.db", pages_per_step=1, sleep=0.001)
+
+        def reader():
+            while not job.done:
+                reads.append(self.table.get_row(id=len(reads) % 2000))
+
+        thread = threading.Thread(target=reader)
+        thread.start()
+        self.table.add(id=5000, payload="written during backup")
+        job.wait(60)
+        thread.join()
+        self.assertGreater(len(reads), 1)
+        self.assertEqual(self.count("backup_target.db"), 2001)
+
+
+if __name__ == '__main__':
+    unittest.main()
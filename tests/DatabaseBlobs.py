@@ -0,0 +1,65 @@
+import io
+import shutil
+import unittest
+
+from ConcurrentDatabase.BlobStream import BLOB_STREAMING, ZeroBlob
+from ConcurrentDatabase.Database import Database
+
+
+@unittest.skipUnless(BLOB_STREAMING, "Blob streaming needs Python 3.11")
+class DatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.database = Database(":memory:", no_gc=True)
+        self.attachments = self.database.create_table("attachments", {"id": "INTEGER PRIMARY KEY", "name": "TEXT",
+                                                                      "data": "BLOB"})
+
+    def tearDown(self):
+        self.database.close()
+
+    def test_stream_write_then_read(self):
+        payload = bytes(range(256)) * 1000
+        entry = self.attachments.add(id=1, name="upload", data=ZeroBlob(len(payload)))
+        self.assertNotIn("data", entry._values)  # The zeroes were never read back
+        with entry.open_blob("data", "w") as blob:
+            shutil.copyfileobj(io.BytesIO(payload), blob, 4096)
+            self.assertRaises(ValueError, blob.write, b"past the end")
+        self.assertEqual(entry["data"], payload)
+
+        with self.attachments.get_row(columns=["name"], id=1).open_blob("data") as blob:
+            self.assertEqual(blob.size, len(payload))
+            blob.seek(1000)
+            self.assertEqual(blob.read(10), payload[1000:1010])
+            self.assertFalse(self.database.lock.locked())  # Only held while a chunk is transferred
+            self.assertRaises(io.UnsupportedOperation, blob.write, b"x")
+
+    def test_loaded_value_is_refreshed(self):
+        entry = self.attachments.add(id=1, name="small", data=b"aaaa")
+        self.assertEqual(entry["data"], b"aaaa")
+        with entry.open_blob("data", "w") as blob:
+            blob.seek(2)
+            blob.write(b"bb")
+        self.assertEqual(entry["data"], b"aabb")
+
+    def test_stream_write_fires_triggers(self):
+        self.attachments.enable_changelog()
+        entry = self.attachments.add(id=1, name="upload", data=ZeroBlob(4))
+        with entry.open_blob("data", "w") as blob:
+            blob.write(b"abcd")
+        self.assertEqual([change.operation for change in self.attachments.changes_since(0)], ["INSERT", "UPDATE"])
+
+        files = self.database.create_table("files", {"id": "INTEGER PRIMARY KEY", "data": "BLOB"})
+        files.enable_versioning()
+        entry = files.add(id=1, data=ZeroBlob(4))
+        with entry.open_blob("data", "w") as blob:
+            blob.write(b"abcd")
+        self.assertEqual(self.database.get("SELECT row_version FROM files")[0][0], entry["row_version"])
+        self.assertGreater(entry["row_version"], 0)
+        entry["data"] = b"wxyz"  # Still flushes against the version it now has
+        entry.flush()
+        self.assertEqual(self.database.get("SELECT data FROM files"), [(b"wxyz",)])
+
+    def test_invalid_blobs(self):
+        self.assertRaises(ValueError, self.attachments.add, id=1, name=ZeroBlob(10))
+        entry = self.attachments.add(id=1, name="x", data=b"")
+        self.assertRaises(ValueError, entry.open_blob, "data", "a")
@@ -0,0 +1,100 @@
+import os
+import tempfile
+import time
+import unittest
+
+from ConcurrentDatabase.BloomFilter import BloomFilter, filter_key
+from ConcurrentDatabase.Database import Database
+
+
+class DatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "bloom.db")
+        self.database = Database(self.path, no_gc=True)
+        self.users = self.database.create_table("users", {"id": "INTEGER PRIMARY KEY", "name": "TEXT"})
+        self.users.upsert_many([{"id": i, "name": f"user{i}"} for i in range(100)])
+        self.users.enable_bloom_filter()
+
+    def tearDown(self):
+        self.database.close()
+        self.directory.cleanup()
+
+    def count_selects(self):
+        statements = []
+        self.database.set_trace_callback(lambda sql: statements.append(sql) if "users" in sql or "PRAGMA" in sql
+                                         else None)
+        return statements
+
+    def wait_for_filter(self, table, timeout=2.0):
+        """Wait until the background rebuild has caught up with every write."""
+        deadline = time.monotonic() + timeout
+        while table._might_exist({"id": -1}) is None and time.monotonic() < deadline:
+            if table._bloom_thread is not None:
+                table._bloom_thread.join()
+            time.sleep(0.005)
+        return table._might_exist({"id": -1}) is not None
+
+    def test_missing_keys_skip_the_query(self):
+        statements = self.count_selects()
+        for i in range(100, 200):
+            self.assertIsNone(self.users.get_row(id=i))
+        self.assertLess(len(statements), 10)
+        self.assertFalse(any("data_version" in sql for sql in statements))  # Not shared, nothing to check
+        self.assertGreater(self.users.bloom_stats["skipped"], 90)
+        self.assertEqual(self.users.get_row(id=42)["name"], "user42")
+        self.assertEqual(self.users.get_row(name="user7")["id"], 7)  # Not a key lookup, the filter isn't used
+
+    def test_writes_through_the_table(self):
+        self.users.add(id=500, name="ada")
+        self.users.update_or_add(id=501, name="bob")
+        self.users.update_or_add(id=1, name="cy")
+        self.users.upsert_many([{"id": 502, "name": "dan"}])
+        self.assertEqual([self.users.get_row(id=i)["name"] for i in (500, 501, 1, 502)], ["ada", "bob", "cy", "dan"])
+        self.users.get_row(id=2).set(name="eve")  # Doesn't change a key, the filter is kept
+        self.users.delete(id=3)
+        self.assertIsNone(self.users.get_row(id=3))
+        self.assertEqual(self.users.bloom_stats["rebuilds"], 1)
+
+    def test_other_writes_are_detected(self):
+        self.database.run("INSERT INTO users (id, name) VALUES (600, 'raw')")
+        self.assertEqual(self.users.get_row(id=600)["name"], "raw")  # Queried while the filter is rebuilt
+        self.assertTrue(self.wait_for_filter(self.users))
+        self.database.run("UPDATE users SET id = 601 WHERE id = 600")
+        self.assertEqual(self.users.get_row(id=601)["name"], "raw")
+        self.assertTrue(self.wait_for_filter(self.users))
+        self.assertGreaterEqual(self.users.bloom_stats["rebuilds"], 3)
+
+        self.users.enable_bloom_filter(shared=True, check_interval=0)
+        other = Database(self.path, no_gc=True)
+        try:
+            other.get_table("users").add(id=700, name="other")
+        finally:
+            other.close()
+        self.assertEqual(self.users.get_row(id=700)["name"], "other")
+        self.assertTrue(self.wait_for_filter(self.users))
+        self.assertTrue(self.users._might_exist({"id": 700}))
+
+    def test_shared_checks_are_rate_limited(self):
+        self.users.enable_bloom_filter(shared=True, check_interval=60)
+        statements = self.count_selects()
+        for i in range(100, 200):
+            self.assertIsNone(self.users.get_row(id=i))
+        self.assertLessEqual(len([sql for sql in statements if "data_version" in sql]), 1)
+
+    def test_keys_that_cant_be_filtered(self):
+        names = self.database.create_table("names", {"name": "TEXT PRIMARY KEY", "value": "INTEGER"})
+        names.add(name="10", value=1)
+        names.enable_bloom_filter()
+        self.assertIsNone(names._might_exist({"name": 10}))  # Compared as text by SQLite, left to the database
+        self.assertEqual(names.get_row(name=10)["value"], 1)
+        self.assertEqual(self.users.get_row(id=5.0)["name"], "user5")
+        self.assertRaises(ValueError, self.database.create_table("logs", {"line": "TEXT"}).enable_bloom_filter)
+        self.assertIsNone(filter_key(["5"], ["INTEGER"]))
+        self.assertEqual(filter_key([5.0], ["INTEGER"]), filter_key([5], ["INTEGER"]))
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add(str(i))
+        self.assertTrue(all(str(i) in bloom for i in range(1000)))
+        self.assertLess(sum(str(i) in bloom for i in range(1000, 11000)), 300)
@@ -0,0 +1,42 @@
+import unittest
+
+from ConcurrentDatabase.Database import Database
+
+
+class DatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.database = Database(":memory:", no_gc=True)
+        self.table = self.database.create_table("items", {"id": "INTEGER PRIMARY KEY", "group_id": "INTEGER",
+                                                          "status": "TEXT"})
+        self.table.upsert_many([{"id": i, "group_id": i % 3, "status": "new"} for i in range(1, 101)])
+
+    def tearDown(self):
+        self.database.close()
+
+    def test_update_where_in_chunks(self):
+        loaded = self.table.get_row(id=3)
+        statements = []
+        self.database.set_trace_callback(statements.append)
+        updated = self.table.update_where({"status": "done"}, chunk_size=10, group_id=0)
+        self.database.set_trace_callback(None)
+        self.assertEqual(updated, 33)
+        self.assertEqual(len([sql for sql in statements if sql.startswith("UPDATE")]), 4)
+        self.assertEqual(self.database.get("SELECT COUNT(*) FROM items WHERE status = 'done'")[0][0], 33)
+        self.assertEqual(loaded["status"], "done")
+        self.assertEqual(self.table.get_row(id=4)["status"], "new")
+
+    def test_delete_where_ranges(self):
+        loaded = [self.table.get_row(id=5), self.table.get_row(id=50)]
+        self.assertEqual(self.table.delete_where(chunk_size=7, id=[1, 20]), 20)
+        self.assertEqual(self.table.delete_where(id=(21, 22, 1000)), 2)
+        self.assertEqual(len(self.table), 78)
+        self.assertNotIn(loaded[0], self.table.entries)
+        self.assertIn(loaded[1], self.table.entries)
+        self.assertRaises(ValueError, self.table.delete_where)
+
+    def test_set_column_and_delete_many(self):
+        self.table["status"] = "archived"
+        self.assertEqual(self.database.get("SELECT DISTINCT status FROM items"), [("archived",)])
+        self.table.delete_many(group_id=1)
+        self.assertEqual(len(self.table), 66)
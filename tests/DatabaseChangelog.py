@@ -0,0 +1,48 @@
+import unittest
+
+from ConcurrentDatabase.Database import Database
+
+
+class DatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.database = Database(":memory:", no_gc=True)
+        self.table = self.database.create_table("test_table",
+                                                {"id": "INTEGER PRIMARY KEY", "random": "INTEGER"})
+        self.table.enable_changelog()
+
+    def tearDown(self):
+        self.database.close()
+
+    def test_changes_recorded(self):
+        self.table.add(id=1, random=1)
+        self.table.add(id=2, random=2)
+        self.table.get_row(id=1).set(random=5)
+        self.table.delete(id=2)
+        changes = self.table.changes_since(0)
+        self.assertEqual([change.operation for change in changes], ["INSERT", "INSERT", "UPDATE", "DELETE"])
+        self.assertEqual([change.key["id"] for change in changes], [1, 2, 1, 2])
+        self.assertEqual(changes, sorted(changes, key=lambda change: change.seq))
+
+    def test_incremental_consumer(self):
+        self.table.add(id=1, random=1)
+        seq = self.table.latest_change()
+        self.table.add(id=2, random=2)
+        changes = self.table.changes_since(seq)
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(changes[0].key, {"id": 2})
+        self.assertEqual(self.table.changes_since(changes[-1].seq), [])
+
+    def test_prune_and_disable(self):
+        for i in range(10):
+            self.table.add(id=i, random=i)
+        self.table.prune_changelog(5)
+        self.assertEqual(len(self.table.changes_since(0)), 5)
+        self.table.disable_changelog()
+        self.assertFalse(self.table.changelog_enabled)
+        self.assertRaises(KeyError, self.database.get_table, "test_table_changelog")
+        self.table.add(id=100, random=100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+import zlib
+
+from ConcurrentDatabase.Database import Database
+
+
+class DatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "codecs.db")
+        self.database = Database(self.path, no_gc=True)
+        self.documents = self.database.create_table(
+            "documents", {"id": "INTEGER", "body": "TEXT", "data": "BLOB"}, ["id"],
+            codecs={"body": "zlib", "data": "lzma"})
+
+    def tearDown(self):
+        self.database.close()
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        body = "lorem ipsum " * 200
+        self.documents.add(id=1, body=body, data=b"\x00\x01" * 500)
+        stored = self.database.get("SELECT body, data FROM documents WHERE id = 1")[0]
+        self.assertEqual(zlib.decompress(stored[0]).decode(), body)
+        self.assertLess(len(stored[0]), len(body))
+        entry = self.documents.get_row(id=1)
+        self.assertEqual(entry["body"], body)
+        self.assertEqual(entry["data"], b"\x00\x01" * 500)
+        self.assertEqual(self.documents.get_row(body=body), entry)
+
+    def test_writes_are_compressed(self):
+        entry = self.documents.add(id=1, body="first")
+        entry["body"] = "second"
+        entry.flush()
+        self.documents.update_or_add(id=2, body="third")
+        self.documents.upsert_many([{"id": 3, "body": "fourth"}])
+        stored = self.database.get("SELECT body FROM documents ORDER BY id")
+        self.assertEqual([zlib.decompress(row[0]).decode() for row in stored], ["second", "third", "fourth"])
+        self.assertEqual(self.documents.get_row(id=2)["body"], "third")
+
+    def test_codec_survives_reopen(self):
+        self.documents.add(id=1, body="persisted")
+        self.database.close()
+        self.database = Database(self.path, no_gc=True)
+        documents = self.database.get_table("documents")
+        self.assertEqual(documents.get_column("body").codec, "zlib")
+        self.assertEqual(documents.get_row(id=1)["body"], "persisted")
+
+    def test_invalid_codec(self):
+        self.assertRaises(ValueError, self.documents.set_codec, "body", "rot13")
+        self.assertRaises(ValueError, self.documents.set_codec, "id", "zlib")
@@ -0,0 +1,69 @@
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from ConcurrentDatabase.Database import Database
+
+
+class DatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "coherence.db")
+        self.database = Database(self.path, no_gc=True, coherence="version", version_check_interval=0)
+        self.table = self.database.create_table("test_table",
+                                                {"id": "INTEGER PRIMARY KEY", "random": "INTEGER"})
+        for i in range(10):
+            self.table.add(id=i, random=i)
+
+    def tearDown(self):
+        self.database.close()
+        self.directory.cleanup()
+
+    def test_clean_entry_not_refreshed(self):
+        entry = self.table.get_row(id=1)
+        self.assertFalse(entry.is_stale())
+        # Bypass the wrapper, the entry has no way of knowing about this write
+        super(Database, self.database).execute("UPDATE test_table SET random = 100 WHERE id = 1")
+        self.assertEqual(entry.get("random"), 1)
+
+    def test_local_write_detected(self):
+        entry = self.table.get_row(id=1)
+        self.database.run("UPDATE test_table SET random = 100 WHERE id = 1")
+        self.assertTrue(entry.is_stale())
+        self.assertEqual(entry.get("random"), 100)
+        self.assertFalse(entry.is_stale())
+
+    def test_external_write_detected(self):
+        entries = self.table.get_rows(id=[0, 9])
+        other = sqlite3.connect(self.path)
+        other.execute("UPDATE test_table SET random = random + 100")
+        other.commit()
+        other.close()
+        self.assertTrue(all(entry.is_stale() for entry in entries))
+        self.assertEqual(entries[0].get("random"), 100)
+        # The first access refreshed every stale entry in one go
+        self.assertFalse(any(entry.is_stale() for entry in entries))
+        self.assertEqual([entry["random"] for entry in entries], [i + 100 for i in range(10)])
+
+    def test_data_version_checks_rate_limited(self):
+        self.database.version_check_interval = 0.2
+        entry = self.table.get_row(id=1)
+        statements = []
+        self.database.set_trace_callback(statements.append)
+        for _ in range(50):
+            entry.get("random")
+        self.database.set_trace_callback(None)
+        self.assertLessEqual(len([sql for sql in statements if "data_version" in sql]), 1)
+        other = sqlite3.connect(self.path)
+        other.execute("UPDATE test_table SET random = 100 WHERE id = 1")
+        other.commit()
+        other.close()
+        time.sleep(0.25)  # Other connections' writes are seen once the interval has passed
+        self.assertEqual(entry.get("random"), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
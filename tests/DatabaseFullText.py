@@ -0,0 +1,43 @@
+import unittest
+
+from ConcurrentDatabase.Database import Database
+
+
+class DatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.database = Database(":memory:", no_gc=True)
+        self.table = self.database.create_table("documents", {"id": "INTEGER PRIMARY KEY", "title": "TEXT",
+                                                              "body": "TEXT"}, fulltext=["title", "body"])
+        self.table.add(id=1, title="SQLite", body="A small fast database engine")
+        self.table.add(id=2, title="Python", body="A programming language with a sqlite module")
+        self.table.add(id=3, title="Cooking", body="Recipes for dinner")
+
+    def tearDown(self):
+        self.database.close()
+
+    def test_search(self):
+        self.assertEqual(self.table.fulltext_columns, ["title", "body"])
+        self.assertEqual(sorted(entry["id"] for entry in self.table.search("sqlite")), [1, 2])
+        self.assertEqual([entry["id"] for entry in self.table.search("sqlite", limit=1)], [1])
+        self.assertEqual(self.table.search("nothing"), [])
+
+    def test_index_maintained(self):
+        self.table.get_row(id=3).set(body="Recipes using sqlite")
+        self.table.delete(id=1)
+        self.assertEqual([entry["id"] for entry in self.table.search("sqlite", rank=False)], [2, 3])
+        self.assertEqual([entry["id"] for entry in self.table.search("sqlite", rank=False, limit=1)], [2])
+        self.table.add(id=4, title="Indexes", body="Full text search")
+        self.assertEqual([entry["id"] for entry in self.table.search("full text")], [4])
+
+    def test_enable_on_existing_table(self):
+        notes = self.database.create_table("notes", {"id": "INTEGER PRIMARY KEY", "text": "TEXT"})
+        notes.add(id=1, text="existing rows are indexed")
+        notes.enable_fulltext(["text"])
+        self.assertEqual(len(notes.search("indexed")), 1)
+        notes.disable_fulltext()
+        self.assertEqual(notes.fulltext_columns, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
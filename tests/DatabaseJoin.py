@@ -0,0 +1,64 @@
+import datetime
+import unittest
+
+from ConcurrentDatabase.Database import Database, CreateTableLink
+
+
+class DatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.database = Database(":memory:", no_gc=True, type_adapters=True)
+        self.users = self.database.create_table("users", {"id": "INTEGER PRIMARY KEY", "name": "TEXT"})
+        self.orders = self.database.create_table(
+            "orders", {"id": "INTEGER PRIMARY KEY", "user_id": "INTEGER", "total": "REAL", "day": "DATE"},
+            linked_tables=[CreateTableLink(target_table="users", target_key="id",
+                                           source_table="orders", source_key="user_id")])
+        self.users.add(id=1, name="ada")
+        self.users.add(id=2, name="bob")
+        self.users.add(id=3, name="cy")
+        self.orders.add(id=1, user_id=1, total=10.0, day=datetime.date(2024, 1, 1))
+        self.orders.add(id=2, user_id=1, total=5.5, day=datetime.date(2024, 1, 2))
+        self.orders.add(id=3, user_id=2, total=7.0, day=datetime.date(2024, 1, 3))
+
+    def tearDown(self):
+        self.database.close()
+
+    def test_inner_join(self):
+        rows = list(self.users.join(self.orders))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(set(rows[0]), {"users.id", "users.name", "orders.id", "orders.user_id", "orders.total",
+                                        "orders.day"})
+        self.assertEqual(sorted((row["users.name"], row["orders.id"]) for row in rows),
+                         [("ada", 1), ("ada", 2), ("bob", 3)])
+        self.assertIs(type(rows[0]["orders.day"]), datetime.date)
+        # The link is found from either side
+        self.assertEqual(len(list(self.orders.join("users"))), 3)
+
+    def test_self_join_rejected(self):
+        employees = self.database.create_table("employees", {"id": "INTEGER PRIMARY KEY", "boss": "INTEGER"})
+        self.database.link_tables("employees", "boss", "employees", "id")
+        self.assertRaises(ValueError, list, employees.join(employees))
+        self.assertRaises(ValueError, list, employees.join("employees"))
+
+    def test_left_join_and_columns(self):
+        rows = list(self.users.join(self.orders, how="left", columns=["name", "orders.total"]))
+        self.assertEqual(len(rows), 4)
+        self.assertIn({"users.name": "cy", "orders.total": None}, rows)
+        self.assertRaises(ValueError, lambda: list(self.users.join(self.orders, how="outer")))
+        self.assertRaises(KeyError, lambda: list(self.users.join(self.orders, columns=["missing"])))
+
+    def test_filters_on_both_sides(self):
+        rows = list(self.users.join(self.orders, columns=["orders.id"], name="ada", total=[5.0, 6.0]))
+        self.assertEqual(rows, [{"orders.id": 2}])
+        # A plain name in both tables filters this table, a qualified one the other table
+        self.assertEqual(len(list(self.users.join(self.orders, id=1))), 2)
+        self.assertEqual(len(list(self.users.join(self.orders, **{"orders.id": (1, 3)}))), 2)
+
+    def test_declared_link_and_pending_writes(self):
+        notes = self.database.create_table("notes", {"id": "INTEGER PRIMARY KEY", "author": "TEXT"})
+        notes.add(id=1, author="bob")
+        self.assertRaises(ValueError, lambda: list(notes.join(self.users)))
+        self.database.link_tables("notes", "author", "users", "name")
+        self.users.get_row(id=2)["name"] = "bea"  # Not flushed yet
+        notes.get_row(id=1)["author"] = "bea"
+        self.assertEqual(list(notes.join(self.users, columns=["users.id"])), [{"users.id": 2}])
@@ -0,0 +1,57 @@
+import csv
+import json
+import os
+import tempfile
+import unittest
+
+from ConcurrentDatabase.LoadGenerator import LoadGenerator, main, percentile, write_csv, write_json
+
+
+class DatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "load.db")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_percentile(self):
+        values = [float(i) for i in range(1, 101)]
+        self.assertEqual(percentile(values, 0.5), 50.0)
+        self.assertEqual(percentile(values, 0.99), 99.0)
+        self.assertEqual(percentile([3.0], 0.95), 3.0)
+        self.assertEqual(percentile([], 0.5), 0.0)
+
+    def test_concurrent_run(self):
+        generator = LoadGenerator(self.path, rows=50, operations=100, seed=1)
+        report = generator.run(4)
+        self.assertEqual(report["threads"], 4)
+        self.assertEqual(report["operations"], 400)
+        self.assertEqual(report["errors"], 0)
+        self.assertEqual(report["lost_updates"], 0)
+        self.assertEqual(set(report["latency"]), {"read", "write", "update", "flush"})
+        read = report["latency"]["read"]
+        self.assertLessEqual(read["p50_ms"], read["p95_ms"])
+        self.assertLessEqual(read["p95_ms"], read["p99_ms"])
+        self.assertGreater(report["ops_per_second"], 0)
+
+    def test_scaling_curve_files(self):
+        generator = LoadGenerator(self.path, rows=20, mix={"read": 1, "update": 1, "flush": 1}, operations=20)
+        reports = generator.scale([1, 2])
+        write_csv(reports, os.path.join(self.directory.name, "curve.csv"))
+        write_json(reports, os.path.join(self.directory.name, "curve.json"))
+        with open(os.path.join(self.directory.name, "curve.csv")) as file:
+            rows = list(csv.DictReader(file))
+        self.assertEqual([row["threads"] for row in rows], ["1", "2"])
+        self.assertIn("update_p99_ms", rows[0])
+        with open(os.path.join(self.directory.name, "curve.json")) as file:
+            self.assertEqual(json.load(file)[1]["threads"], 2)
+        self.assertRaises(ValueError, LoadGenerator, self.path, mix={"scan": 1})
+
+    def test_command_line(self):
+        reports = main([self.path, "--threads", "2", "--duration", "0.2", "--rows", "10", "--mix", "read=1,write=1",
+                        "--json", os.path.join(self.directory.name, "curve.json")])
+        self.assertEqual(len(reports), 1)
+        self.assertEqual(reports[0]["lost_updates"], 0)
+        self.assertTrue(os.path.exists(os.path.join(self.directory.name, "curve.json")))
@@ -0,0 +1,98 @@
+import threading
+import time
+import unittest
+
+from ConcurrentDatabase.Database import Database
+from ConcurrentDatabase.LockScheduler import LockScheduler, LockTimeoutError, LockQueueFullError
+
+
+class DatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.database = Database(":memory:", no_gc=True, lock_timeout=0.1, max_queue_depth=1)
+        self.table = self.database.create_table("test_table", {"id": "INTEGER PRIMARY KEY", "random": "INTEGER"})
+
+    def tearDown(self):
+        self.database.close()
+
+    def _queue_waiters(self, lock, waiters):
+        """Start a thread per (name, write) pair and wait until each one is queued before starting the next."""
+        order = []
+        threads = []
+        for name, write in waiters:
+            def waiter(name=name, write=write):
+                lock.acquire(write=write)
+                order.append(name)
+                lock.release()
+            thread = threading.Thread(target=waiter)
+            thread.start()
+            while lock.waiting() < len(threads) + 1:
+                time.sleep(0.001)
+            threads.append(thread)
+        return order, threads
+
+    def test_fifo(self):
+        lock = LockScheduler()
+        lock.acquire()
+        order, threads = self._queue_waiters(lock, [(i, True) for i in range(5)])
+        lock.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, list(range(5)))
+
+    def test_read_priority(self):
+        lock = LockScheduler(read_priority=1)
+        lock.acquire()
+        order, threads = self._queue_waiters(lock, [("write", True), ("read", False)])
+        lock.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, ["read", "write"])
+
+    def test_timeout(self):
+        self.database.lock.acquire()
+        start = time.monotonic()
+        self.assertRaises(LockTimeoutError, self.table.add, id=1, random=1)
+        self.assertLess(time.monotonic() - start, 1)
+        self.database.lock.release()
+        self.assertFalse(self.database.lock.locked())
+        self.table.add(id=1, random=1)
+        self.assertEqual(self.database.lock.stats()["timeouts"], 1)
+
+    def test_queue_full(self):
+        self.database.lock.acquire()
+        waiter = threading.Thread(target=self.database.run, args=("SELECT 1",), kwargs={"timeout": 5})
+        waiter.start()
+        while self.database.lock.waiting() < 1:
+            time.sleep(0.001)
+        self.assertRaises(LockQueueFullError, self.database.run, "SELECT 1")
+        self.database.lock.release()
+        waiter.join()
+
+    def test_timeout_during_release(self):
+        lock = LockScheduler()
+        lock.acquire()
+        errors = []
+
+        def expiring():
+            try:
+                lock.acquire(timeout=0.2)
+            except LockTimeoutError as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=expiring)
+        thread.start()
+        while lock.waiting() < 1:
+            time.sleep(0.001)
+        lock._queue[0].deadline = 0  # Its deadline passes just before the release, which skips it
+        lock.release()
+        self.assertTrue(lock.acquire(timeout=2))  # Handed on when the skipped waiter gives up
+        lock.release()
+        thread.join()
+        self.assertEqual(len(errors), 1)
+        self.assertFalse(lock.locked())
+        self.assertEqual(lock.waiting(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+
+from ConcurrentDatabase.Database import Database
+
+
+class DatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "maintenance.db")
+        self.database = Database(self.path, no_gc=True)
+        self.database.run("PRAGMA auto_vacuum = INCREMENTAL")
+        self.database.run("VACUUM")  # auto_vacuum only takes effect on an existing database after a vacuum
+        self.database.get("PRAGMA journal_mode = WAL")
+        self.table = self.database.create_table("blobs", {"id": "INTEGER PRIMARY KEY", "data": "BLOB"})
+        self.table.upsert_many([{"id": i, "data": os.urandom(2000)} for i in range(200)])
+        # Only check for due tasks when asked to
+        self.maintenance = self.database.enable_maintenance(poll=3600, pause=0, vacuum_pages=16)
+
+    def tearDown(self):
+        self.database.close()
+        self.directory.cleanup()
+
+    def test_incremental_vacuum(self):
+        self.database.run("DELETE FROM blobs")
+        self.assertGreater(self.database.get("PRAGMA freelist_count")[0][0], 16)
+        stats = self.maintenance.run_task("incremental_vacuum")
+        self.assertEqual(self.database.get("PRAGMA freelist_count")[0][0], 0)
+        self.assertGreater(stats["steps"], 1)  # Freed in several steps, releasing the lock between them
+
+    def test_checkpoint_after_writes(self):
+        self.maintenance.add_task("checkpoint", self.maintenance.tasks["checkpoint"].fn, writes=5)
+        self.assertEqual(self.maintenance.run_pending(), [])
+        for i in range(5):
+            self.table.update_or_add(id=i, data=b"x")
+        self.assertEqual(self.maintenance.run_pending(), ["checkpoint"])
+        self.assertEqual(self.database.stats()["maintenance"]["checkpoint"]["runs"], 1)
+
+    def test_lock_released_between_steps(self):
+        held = []
+
+        def task(database):
+            for table_name in ("blobs", "table_versions"):
+                yield database.get(f"SELECT COUNT(*) FROM {table_name}")
+                held.append(database.lock.locked())
+
+        self.maintenance.add_task("count", task)
+        stats = self.maintenance.run_task("count")
+        self.assertEqual(held, [False, False])
+        self.assertEqual(stats["steps"], 2)
+        self.assertGreaterEqual(stats["max_step"], 0.0)
@@ -0,0 +1,55 @@
+import operator
+import os
+import tempfile
+import unittest
+
+from ConcurrentDatabase.Database import Database
+
+
+def square_random(row):
+    return row["random"] ** 2
+
+
+def odd_ids(row):
+    return row["id"] if row["id"] % 2 else None
+
+
+def chunk_count(rows):
+    return len(rows)
+
+
+class DatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = Database(os.path.join(self.directory.name, "parallel.db"), no_gc=True)
+        self.table = self.database.create_table("test_table",
+                                                {"id": "INTEGER PRIMARY KEY", "random": "INTEGER"})
+        self.table.upsert_many([{"id": i, "random": i} for i in range(1000)])
+
+    def tearDown(self):
+        self.database.close()
+        self.directory.cleanup()
+
+    def test_reduce(self):
+        total = self.table.parallel_scan(square_random, workers=2, reducer=operator.add)
+        self.assertEqual(total, sum(i ** 2 for i in range(1000)))
+
+    def test_collect_in_rowid_order(self):
+        ids = self.table.parallel_scan(odd_ids, where="id < 100", workers=2)
+        self.assertEqual(ids, list(range(1, 100, 2)))
+
+    def test_per_chunk(self):
+        total = self.table.parallel_scan(chunk_count, workers=2, reducer=operator.add, initial=0,
+                                         per_chunk=True, chunk_size=64)
+        self.assertEqual(total, 1000)
+
+    def test_memory_database(self):
+        database = Database(":memory:", no_gc=True)
+        table = database.create_table("test_table", {"id": "INTEGER PRIMARY KEY"})
+        self.assertRaises(ValueError, table.parallel_scan, chunk_count)
+        database.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+
+from loguru import logger as logging
+
+from ConcurrentDatabase.Database import Database, CreateTableLink
+
+
+class DatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.database = Database(":memory:", no_gc=True)
+        self.database.execute("PRAGMA foreign_keys = ON")
+        self.users = self.database.create_table("users", {"id": "INTEGER PRIMARY KEY AUTOINCREMENT", "name": "TEXT"})
+        self.roles = self.database.create_table(
+            "roles", {"user_id": "INTEGER PRIMARY KEY", "role": "TEXT"},
+            linked_tables=[CreateTableLink(target_table="users", target_key="id", source_key="user_id")])
+        for i in range(10):
+            self.users.add(name=f"user{i}")
+            self.roles.add(user_id=i + 1, role="member")
+        self.database.pin_in_memory("roles")
+        self.mirror = self.database.mirrors["roles"]
+
+    def tearDown(self):
+        self.database.close()
+
+    def test_reads_served_from_memory(self):
+        self.database.lock.acquire()  # Reads of the pinned table don't need the database lock
+        try:
+            self.assertEqual(self.roles.get_row(user_id=3)["role"], "member")
+            self.assertEqual(len(self.roles), 10)
+            self.assertEqual(len(self.roles.select("role = 'member'")), 10)
+        finally:
+            self.database.lock.release()
+        self.assertGreaterEqual(self.mirror.reads, 3)
+
+    def test_writes_go_to_both(self):
+        self.roles.get_row(user_id=3).set(role="admin")
+        self.roles.update_or_add(user_id=4, role="owner")
+        self.roles.upsert_many([{"user_id": 5, "role": "guest"}])
+        self.roles.delete(user_id=6)
+        expected = self.database.get("SELECT * FROM roles ORDER BY user_id")
+        self.assertEqual(self.mirror.query("SELECT * FROM roles ORDER BY user_id"), expected)
+        self.assertEqual(self.roles.get_row(user_id=3)["role"], "admin")
+
+    def test_diverged_copy_is_logged(self):
+        self.mirror.connection.execute("ALTER TABLE roles RENAME COLUMN role TO title")
+        messages = []
+        handler = logging.add(messages.append, level="ERROR")
+        try:
+            self.assertEqual(len(self.roles.select("role = 'member'")), 10)  # Read from the database instead
+        finally:
+            logging.remove(handler)
+        self.assertEqual(len(messages), 1)
+        self.database.reload_pinned("roles")
+        self.assertEqual(self.mirror.query("SELECT role FROM roles WHERE user_id = 3"), [("member",)])
+
+    def test_cascade_reloads_mirror(self):
+        self.users.delete(id=2)
+        self.assertIsNone(self.roles.get_row(user_id=2))
+        self.assertEqual(len(self.roles), 9)
+
+    def test_autoincrement_in_step(self):
+        self.database.pin_in_memory("users")
+        self.users.delete(id=10)
+        entry = self.users.add(name="new")
+        self.assertEqual(entry["id"], 11)
+        self.assertEqual(self.database.mirrors["users"].query("SELECT id FROM users WHERE name = 'new'"), [(11,)])
+
+    def test_unpin(self):
+        self.database.unpin("roles")
+        self.assertEqual(self.database.mirrors, {})
+        self.assertEqual(len(self.roles), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+
+from ConcurrentDatabase.Database import Database
+
+
+class DatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.database = Database(":memory:", no_gc=True)
+        self.table = self.database.create_table("test_table",
+                                                {"id": "INTEGER PRIMARY KEY", "random": "INTEGER"})
+        for i in range(100):
+            self.table.add(id=i, random=i)
+        self.database.enable_profiling(warn=False)
+
+    def tearDown(self):
+        self.database.close()
+
+    def test_shapes_aggregated(self):
+        for i in range(10):
+            self.table.get_row(id=i)
+        report = self.database.profile_report()
+        lookups = [profile for profile in report if profile["shape"] == "SELECT * FROM test_table WHERE id = ?"]
+        self.assertEqual(len(lookups), 1)
+        self.assertEqual(lookups[0]["count"], 10)
+        self.assertFalse(lookups[0]["full_scan"])
+        self.assertEqual(sum(lookups[0]["call_sites"].values()), 10)
+        self.assertIn(__file__, list(lookups[0]["call_sites"])[0])
+
+    def test_scan_flagged(self):
+        self.table.get_row(random=5)
+        self.table.select("id > 5", order_by="random")
+        flagged = self.database.profile_report(flagged_only=True)
+        self.assertEqual(len(flagged), 2)
+        flagged = {profile["shape"]: profile for profile in flagged}
+        self.assertTrue(flagged["SELECT * FROM test_table WHERE random = ?"]["full_scan"])
+        self.assertTrue(flagged["SELECT * FROM test_table WHERE id > ? ORDER BY random"]["temp_btree"])
+        self.assertEqual(self.database.profile_report(flagged_only=False)[0]["count"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
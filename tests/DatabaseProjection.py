@@ -0,0 +1,55 @@
+import unittest
+
+from ConcurrentDatabase.Database import Database
+
+
+class DatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.database = Database(":memory:", no_gc=True)
+        self.files = self.database.create_table("files", {"id": "INTEGER PRIMARY KEY", "name": "TEXT",
+                                                          "content": "BLOB"})
+        self.files.upsert_many([{"id": i, "name": f"file{i}", "content": bytes([i]) * 1000} for i in range(1, 21)])
+        self.statements = []
+        self.database.set_trace_callback(self.statements.append)
+
+    def tearDown(self):
+        self.database.close()
+
+    def test_projection_skips_columns(self):
+        entry = self.files.get_row(columns=["name"], id=3)
+        self.assertEqual((entry["id"], entry["name"]), (3, "file3"))
+        self.assertNotIn("content", entry._values)
+        self.assertNotIn("*", " ".join(self.statements))
+
+    def test_lazy_columns_load_in_one_batch(self):
+        entries = self.files.select("id <= 10", columns=["name"])
+        self.statements.clear()
+        self.assertEqual(entries[4]["content"], bytes([5]) * 1000)
+        self.assertEqual([entry["content"][0] for entry in entries], list(range(1, 11)))
+        self.assertEqual(len([sql for sql in self.statements if sql.startswith("SELECT")]), 1)
+        self.assertEqual(len(self.files.get_all(columns=["name"])), 20)
+
+    def test_flush_partial_entries(self):
+        for entry in self.files.get_rows(columns=["name"], id=[1, 2]):
+            entry["name"] = entry["name"].upper()
+            entry["content"] = b"replaced"
+        self.files.flush()
+        self.database.set_trace_callback(None)
+        self.assertEqual(self.database.get("SELECT name, content FROM files WHERE id <= 3"),
+                         [("FILE1", b"replaced"), ("FILE2", b"replaced"), ("file3", bytes([3]) * 1000)])
+        self.assertRaises(KeyError, self.files.get_row, columns=["size"], id=1)
+
+    def test_mixed_projected_and_full_reads(self):
+        partial = self.files.get_rows(columns=["name"], id=[1, 2])
+        self.database.set_trace_callback(None)
+        entries = self.files.get_all()
+        self.assertEqual(len(self.files.get_all(columns=["id"])), 20)
+        self.assertEqual(len(entries), len(self.files.entries))
+        self.assertEqual(partial[0], (1, "file1", bytes([1]) * 1000))
+        self.assertNotEqual(partial[1], (2, "file2", b"other"))
+        self.assertEqual(partial[0], {"id": 1, "content": bytes([1]) * 1000})
+        full = self.files.get_row(id=2)
+        self.assertEqual(partial[1], full)
+        self.files.delete(id=1)
+        self.assertNotEqual(self.files.get_row(columns=["name"], id=2), partial[0])
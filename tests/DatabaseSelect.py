@@ -66,3 +66,57 @@ class DatabaseTests(unittest.TestCase):
         self.assertEqual(len(rows), 9)
         self.assertEqual(rows[0]['id'], 51)
         self.assertEqual(rows[-1]['id'], 59)
+
+    def test_select_cached(self):
+        self.load_values()
+        self.database.enable_query_cache()
+        rows = self.table.select("id > 50")
+        self.assertEqual(len(self.table.select("id  >  50")), 49)
+        self.assertEqual(self.database.query_cache.stats()["hits"], 1)
+        rows[0].set(random=1000)  # Writes through the database invalidate the cached result
+        self.assertEqual(self.table.select("random >= 1000")[0]['id'], 51)
+        self.assertEqual(len(self.table.select("id > 50")), 49)
+        self.assertEqual(self.database.query_cache.stats()["hits"], 1)
+
+    def test_custom_query_cached(self):
+        self.load_values()
+        self.database.enable_query_cache(max_entries=1)
+        self.assertEqual(self.table.custom_query("SELECT COUNT(*) FROM test_table")[0][0], 100)
+        self.table.delete(id=1)
+        self.assertEqual(self.table.custom_query("SELECT COUNT(*) FROM test_table")[0][0], 99)
+        self.table.custom_query("SELECT MAX(id) FROM test_table")  # Evicts the count
+        self.assertEqual(self.table.custom_query("SELECT COUNT(*) FROM test_table")[0][0], 99)
+        self.assertEqual(self.database.query_cache.stats()["hits"], 0)
+
+    def test_cache_matches_tables_case_insensitively(self):
+        self.load_values()
+        self.database.enable_query_cache()
+        for sql in ("SELECT COUNT(*) FROM TEST_TABLE", 'SELECT COUNT(*) FROM "Test_Table"',
+                    "SELECT COUNT(*) FROM [test_table]"):
+            self.assertEqual(self.database.cached_get(sql)[0][0], 100)
+            self.table.add(id=1000, random=0)
+            self.assertEqual(self.database.cached_get(sql)[0][0], 101)
+            self.table.delete(id=1000)
+        self.database.run("INSERT INTO TEST_TABLE (id, random) VALUES (1000, 0)")  # Raw writes in another case
+        self.assertEqual(self.database.cached_get("SELECT COUNT(*) FROM test_table")[0][0], 101)
+        # Reads from something the cache can't track are never cached
+        cached = len(self.database.query_cache)
+        self.database.cached_get("SELECT COUNT(*) FROM pragma_table_info('test_table')")
+        self.database.cached_get("SELECT COUNT(*) FROM sqlite_master")
+        self.assertEqual(len(self.database.query_cache), cached)
+
+    def test_cache_literals_and_views(self):
+        self.load_values()
+        self.database.enable_query_cache()
+        labels = self.database.create_table("labels", {"id": "INTEGER PRIMARY KEY", "name": "TEXT"})
+        labels.add(id=1, name="a b")
+        labels.add(id=2, name="a  b")
+        self.assertEqual(labels.select("name = 'a b'")[0]["id"], 1)
+        self.assertEqual(labels.select("name = 'a  b'")[0]["id"], 2)  # Not the cached result of the other literal
+        self.database.run("CREATE VIEW v_labels AS SELECT * FROM labels")
+        self.database.run("CREATE VIEW v_v_labels AS SELECT * FROM v_labels")
+        for view in ("v_labels", "v_v_labels"):
+            self.assertEqual(self.database.cached_get(f"SELECT COUNT(*) FROM {view}")[0][0], 2)
+        labels.add(id=3, name="c")
+        for view in ("v_labels", "v_v_labels"):
+            self.assertEqual(self.database.cached_get(f"SELECT COUNT(*) FROM {view}")[0][0], 3)
@@ -0,0 +1,63 @@
+import unittest
+
+from ConcurrentDatabase.DynamicTable import DynamicTable
+from ConcurrentDatabase.ShardedDatabase import ShardedDatabase, ShardedTable
+
+
+class DatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.database = ShardedDatabase(":memory:", shards=4, no_gc=True)
+        self.table = self.database.create_table("test_table",
+                                                {"id": "INTEGER PRIMARY KEY", "random": "INTEGER"})
+
+    def tearDown(self):
+        self.database.close()
+
+    def load_values(self):
+        for i in range(100):
+            self.table.add(id=i, random=i)
+
+    def test_rows_spread_over_shards(self):
+        self.load_values()
+        self.assertIsInstance(self.table, ShardedTable)
+        counts = [len(table) for table in self.table.tables]
+        self.assertEqual(sum(counts), 100)
+        self.assertTrue(all(count > 0 for count in counts))
+        self.assertEqual(len(self.table), 100)
+        self.assertEqual(self.table.get_row(id=42)["random"], 42)
+        self.assertEqual(self.table.get_row(random=43)["id"], 43)
+
+    def test_keys_routed_by_stored_value(self):
+        for key in (1, "1", "01", 1.0, " 1"):
+            self.assertIs(self.table.shard_for(id=key), self.table.shard_for(id=1))
+        self.table.add(id="07", random=7)
+        self.assertEqual(self.table.get_row(id=7)["random"], 7)
+        self.assertEqual(self.table.get_row(id="7")["random"], 7)
+        large = 2 ** 60 + 1
+        self.table.add(id=large, random=1)
+        self.assertEqual(self.table.get_row(id=str(large))["id"], large)
+        self.assertIs(self.table.shard_for(id=str(large)), self.table.shard_for(id=large))
+
+    def test_select_merged(self):
+        self.load_values()
+        rows = self.table.select("id > 50", order_by="id DESC", limit=10, offset=10)
+        self.assertEqual([row["id"] for row in rows], list(range(89, 79, -1)))
+        self.assertEqual(len(self.table.select("random < 20")), 20)
+
+    def test_upsert_and_delete(self):
+        self.table.upsert_many([{"id": i, "random": i} for i in range(20)])
+        self.table.update_or_add(id=5, random=500)
+        self.assertEqual(self.table.get_row(id=5)["random"], 500)
+        self.table.delete(random=500)
+        self.assertIsNone(self.table.get_row(id=5))
+        self.assertEqual(len(self.table.get_rows(random=[0, 9])), 9)
+
+    def test_shard_by_table(self):
+        table = self.database.create_table("whole_table", {"id": "INTEGER PRIMARY KEY"}, shard_by="table")
+        self.assertIsInstance(table, DynamicTable)
+        self.assertIs(table.database, self.database.shard_for_table("whole_table"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import tempfile
+import unittest
+
+from ConcurrentDatabase.Database import Database
+from ConcurrentDatabase.TimeSeriesTable import TimeSeriesTable
+
+
+class DatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "metrics.db")
+        self.database = Database(self.path, no_gc=True)
+        self.metrics = self.database.create_timeseries_table(
+            "metrics", {"host": "TEXT", "cpu": "REAL"}, retention=100, rollups={"10s": 10}, batch_size=50)
+
+    def tearDown(self):
+        self.database.close()
+        self.directory.cleanup()
+
+    def test_batched_appends(self):
+        for i in range(49):
+            self.metrics.append(timestamp=i, host="a", cpu=i)
+        self.assertEqual(self.database.get("SELECT COUNT(*) FROM metrics")[0][0], 0)  # Still buffered
+        self.metrics.append(timestamp=49, host="a", cpu=49)
+        self.assertEqual(self.database.get("SELECT COUNT(*) FROM metrics")[0][0], 50)
+        self.metrics.append(host="b", cpu=1.0)  # Timestamped now
+        samples = self.metrics.range(start=10, end=20)
+        self.assertEqual([sample["cpu"] for sample in samples], list(range(10, 20)))
+        self.assertEqual(len(self.metrics), 51)
+
+    def test_retention_and_rollups(self):
+        self.metrics.append_many({"timestamp": i, "host": "a", "cpu": i % 10} for i in range(250))
+        self.metrics.flush_appends()
+        deleted = self.metrics.enforce_retention(now=250, chunk_size=40)  # Keeps samples from 150 on
+        self.assertEqual(deleted, 150)
+        self.assertEqual(self.metrics.range(limit=1)[0]["timestamp"], 150)
+        buckets = self.metrics.rollup("10s")
+        self.assertEqual(len(buckets), 15)
+        self.assertEqual(buckets[0]["count"], 10)
+        self.assertEqual((buckets[0]["cpu_min"], buckets[0]["cpu_max"], buckets[0]["cpu_avg"]), (0, 9, 4.5))
+
+    def test_reopened_as_time_series(self):
+        self.metrics.append(timestamp=1, host="a", cpu=1)
+        self.metrics.flush()
+        self.database.close()
+        self.database = Database(self.path, no_gc=True)
+        metrics = self.database.get_table("metrics")
+        self.assertIsInstance(metrics, TimeSeriesTable)
+        self.assertEqual((metrics.retention, metrics.rollups, metrics.batch_size), (100.0, {"10s": 10}, 50))
+        self.database.drop_table("metrics")
+        self.assertRaises(KeyError, self.database.get_table, "metrics_rollup_10s")
+
+    def test_buffered_samples_written_on_close(self):
+        for i in range(10):
+            self.metrics.append(timestamp=i, host="a", cpu=i)
+        self.database.close()
+        self.database = Database(self.path, no_gc=True)
+        self.assertEqual(self.database.get("SELECT COUNT(*) FROM metrics")[0][0], 10)
+
+    def test_clustered_by_time(self):
+        events = self.database.create_timeseries_table("events", {"cpu": "REAL"}, clustered="timestamp")
+        self.assertTrue(events.clustered)
+        events.append(cpu=1.0)  # Timestamped now, in whole seconds
+        events.append(timestamp=5, cpu=2.0)
+        events.append(timestamp=5, cpu=3.0)  # Buffered in the same second
+        self.assertEqual(events.flush_appends(), 2)
+        statements = []
+        self.database.set_trace_callback(statements.append)
+        events.append_many([{"timestamp": 5, "cpu": 4.0}, {"timestamp": 6, "cpu": 5.0}])  # Stored in the same second
+        self.database.set_trace_callback(None)
+        self.assertEqual(statements, [])  # Appending doesn't query the stored samples
+        self.assertEqual(events.flush_appends(), 1)
+        self.assertRaises(ValueError, events.append, timestamp=6.5, cpu=3.0)
+        self.assertEqual([sample["cpu"] for sample in events.range()], [2.0, 5.0, 1.0])
@@ -0,0 +1,71 @@
+import datetime
+import decimal
+import sqlite3
+import unittest
+
+from ConcurrentDatabase.Database import Database
+
+
+class DatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.database = Database(":memory:", no_gc=True, type_adapters=True)
+        self.events = self.database.create_table(
+            "events", {"id": "INTEGER PRIMARY KEY", "day": "DATE", "at": "TIMESTAMP", "price": "DECIMAL",
+                       "payload": "JSON", "active": "BOOLEAN"})
+
+    def tearDown(self):
+        self.database.close()
+
+    def test_rich_types_round_trip(self):
+        values = {"day": datetime.date(2024, 2, 29), "at": datetime.datetime(2024, 2, 29, 12, 30, 15),
+                  "price": decimal.Decimal("19.99"), "payload": {"tags": ["a", "b"], "count": 2}, "active": True}
+        self.events.add(id=1, **values)
+        self.events.entries.clear()
+        entry = self.events.get_row(day=datetime.date(2024, 2, 29))
+        for key, value in values.items():
+            self.assertEqual(entry[key], value)
+            self.assertIs(type(entry[key]), type(value))
+
+    def test_table_flush_binds_parameters(self):
+        entry = self.events.add(id=1, payload={"quote": "it's"}, day=datetime.date(2024, 1, 1))
+        entry["payload"] = {"quote": "'; DROP TABLE events; --"}
+        entry["day"] = datetime.date(2024, 1, 2)
+        self.events.flush()
+        self.assertEqual(self.database.get("SELECT payload, day FROM events")[0],
+                         ('{"quote": "\'; DROP TABLE events; --"}', "2024-01-02"))
+        self.assertFalse(entry.is_dirty())
+
+    def test_transaction_rolls_back(self):
+        self.events.add(id=1)
+        with self.assertRaises(Exception):
+            self.database.transaction([("UPDATE events SET price = ? WHERE id = ?", ("5", 1)),
+                                       ("INSERT INTO events (id) VALUES (?)", (1,))])
+        self.assertEqual(self.database.get("SELECT price FROM events"), [(None,)])
+
+    def test_validation_modes(self):
+        self.events.add(id="1")  # Parsed as an integer in strict mode
+        self.database.validate = "fast"
+        self.assertRaises(ValueError, self.events.add, id="2")
+        self.events.add(id=2, active=True)
+        self.database.validate = "off"
+        self.events.add(id=3, active="yes")
+        self.assertEqual(len(self.events), 3)
+        self.assertRaises(ValueError, Database, ":memory:", validate="lenient")
+
+    def test_conversion_is_opt_in(self):
+        legacy = Database(":memory:", no_gc=True)
+        try:
+            table = legacy.create_table("events", {"id": "INTEGER PRIMARY KEY", "at": "TIMESTAMP", "active": "BOOLEAN"})
+            legacy.run("INSERT INTO events (id, at, active) VALUES (1, 1700000000.5, 1)")
+            table.entries.clear()
+            entry = table.get_row(id=1)
+            self.assertEqual((entry["at"], entry["active"]), (1700000000.5, 1))
+            self.assertIs(type(entry["active"]), int)
+        finally:
+            legacy.close()
+        self.database.run("INSERT INTO events (id, at) VALUES (1, 1700000000.5)")  # Stored before adapters were used
+        self.assertEqual(self.events.get_row(id=1)["at"], 1700000000.5)
+        connection = sqlite3.connect(":memory:")  # Other connections in the process are unaffected
+        self.assertRaises(sqlite3.ProgrammingError, connection.execute, "SELECT ?", ({"a": 1},))
+        connection.close()
@@ -0,0 +1,74 @@
+import unittest
+
+from ConcurrentDatabase.Database import Database
+
+
+class DatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.database = Database(":memory:", no_gc=True)
+        self.table = self.database.create_table("test_table",
+                                                {"id": "INTEGER", "group_id": "INTEGER", "random": "INTEGER"},
+                                                primary_keys=["id", "group_id"])
+
+    def tearDown(self):
+        self.database.close()
+
+    def test_update_or_add(self):
+        row = self.table.update_or_add(id=1, group_id=1, random=1)
+        self.assertEqual(row["random"], 1)
+        row2 = self.table.update_or_add(id=1, group_id=1, random=2)
+        self.assertEqual(id(row), id(row2))
+        self.assertEqual(row["random"], 2)
+        self.assertEqual(self.database.get("SELECT random FROM test_table WHERE id = 1")[0][0], 2)
+        self.assertEqual(len(self.table), 1)
+
+    def test_update_or_add_keys_only(self):
+        self.table.add(id=1, group_id=1, random=5)
+        row = self.table.update_or_add(id=1, group_id=1)
+        self.assertEqual(row["random"], 5)
+
+    def test_update_or_add_partial_row_with_not_null_column(self):
+        table = self.database.create_table("named_table", {"id": "INTEGER", "name": "TEXT NOT NULL", "v": "INTEGER"},
+                                           primary_keys=["id"])
+        table.add(id=1, name="one", v=1)
+        row = table.update_or_add(id=1, v=5)
+        self.assertEqual(row["v"], 5)
+        self.assertEqual(row["name"], "one")
+        self.assertEqual(self.database.get("SELECT name, v FROM named_table WHERE id = 1"), [("one", 5)])
+        # A missing row still has to be added with the NOT NULL column set
+        self.assertRaises(ValueError, table.update_or_add, id=2, v=5)
+        self.assertEqual(table.update_or_add(id=2, name="two")["name"], "two")
+        table.upsert_many([{"id": 1, "v": 6}, {"id": 3, "name": "three", "v": 3}])
+        self.assertEqual(self.database.get("SELECT id, name, v FROM named_table ORDER BY id"),
+                         [(1, "one", 6), (2, "two", None), (3, "three", 3)])
+
+    def test_upsert_many(self):
+        self.table.upsert_many([{"id": i, "group_id": i % 3, "random": i} for i in range(100)])
+        loaded = self.table.get_row(id=10, group_id=1)
+        written = self.table.upsert_many([{"id": i, "group_id": i % 3, "random": -i} for i in range(50, 150)],
+                                         chunk_size=7)
+        self.assertEqual(written, 100)
+        self.assertEqual(len(self.table), 150)
+        self.assertEqual(self.table.get_row(id=60, group_id=0)["random"], -60)
+        self.assertEqual(self.table.get_row(id=10, group_id=1)["random"], 10)
+        self.assertEqual(loaded["random"], 10)
+
+    def test_upsert_many_updates_loaded_entries(self):
+        self.table.add(id=1, group_id=1, random=1)
+        row = self.table.get_row(id=1, group_id=1)
+        self.table.upsert_many([{"id": 1, "group_id": 1, "random": 7}])
+        self.assertEqual(row["random"], 7)
+        self.assertFalse(row.is_dirty())
+
+    def test_failed_chunk_is_rolled_back(self):
+        self.database.run("CREATE TRIGGER no_negative BEFORE INSERT ON test_table WHEN NEW.random < 0 "
+                          "BEGIN SELECT RAISE(ABORT, 'negative'); END")
+        rows = [{"id": i, "group_id": 0, "random": 1 if i != 5 else -1} for i in range(10)]
+        self.assertRaises(ValueError, self.table.upsert_many, rows, chunk_size=4)
+        # The first chunk was committed, the rows of the failing chunk written before row 5 were undone
+        self.assertEqual(self.database.get("SELECT id FROM test_table ORDER BY id"), [(0,), (1,), (2,), (3,)])
+
+
+if __name__ == '__main__':
+    unittest.main()
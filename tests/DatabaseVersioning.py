@@ -0,0 +1,87 @@
+import os
+import tempfile
+import unittest
+
+from ConcurrentDatabase.Database import Database
+from ConcurrentDatabase.DynamicEntry import ConflictError
+
+
+class DatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "versions.db")
+        self.database = Database(self.path, no_gc=True)
+        self.accounts = self.database.create_table("accounts", {"id": "INTEGER PRIMARY KEY", "balance": "INTEGER",
+                                                                "owner": "TEXT"})
+        self.accounts.add(id=1, balance=100, owner="ada")
+        self.accounts.enable_versioning()
+        # A second connection stands in for another process writing to the same rows
+        self.other = Database(self.path, no_gc=True)
+        self.other_accounts = self.other.get_table("accounts")
+
+    def tearDown(self):
+        self.other.close()
+        self.database.close()
+        self.directory.cleanup()
+
+    def test_versions_are_incremented(self):
+        entry = self.accounts.get_row(id=1)
+        self.assertEqual(entry["row_version"], 0)
+        entry.set(balance=90)
+        self.assertEqual(entry["row_version"], 1)
+        self.accounts.update_where({"owner": "bob"}, id=1)
+        self.accounts.upsert_many([{"id": 1, "balance": 80}])
+        self.assertEqual(self.database.get("SELECT balance, owner, row_version FROM accounts"), [(80, "bob", 3)])
+        self.assertEqual(self.other_accounts.version_column, "row_version")  # Read from the schema metadata
+
+    def test_conflicting_flush(self):
+        entry = self.accounts.get_row(id=1)
+        other_entry = self.other_accounts.get_row(id=1)
+        other_entry.set(balance=50)
+        entry["balance"] = entry["balance"] + 10
+        self.assertRaises(ConflictError, entry.flush)
+        self.assertTrue(entry.is_dirty())
+        self.assertEqual(self.database.get("SELECT balance FROM accounts"), [(50,)])  # Not overwritten
+        entry.discard_changes()
+        self.assertEqual((entry["balance"], entry["row_version"]), (50, 1))
+        entry.set(balance=60)
+        self.assertEqual(self.database.get("SELECT balance, row_version FROM accounts"), [(60, 2)])
+
+    def test_table_flush_rolls_back_on_conflict(self):
+        self.accounts.add(id=2, balance=5, owner="cy")
+        first, second = self.accounts.get_row(id=1), self.accounts.get_row(id=2)
+        self.other_accounts.get_row(id=2).set(owner="dan")
+        first["balance"] = 1
+        second["balance"] = 2
+        with self.assertRaises(ConflictError) as context:
+            self.accounts.flush()
+        self.assertIs(context.exception.entry, second)
+        self.assertEqual(self.database.get("SELECT balance FROM accounts ORDER BY id"), [(100,), (5,)])
+        self.assertTrue(first.is_dirty() and second.is_dirty())
+        second.discard_changes()
+        self.accounts.flush()
+        self.assertEqual(self.database.get("SELECT balance, owner FROM accounts ORDER BY id"),
+                         [(1, "ada"), (5, "dan")])
+
+    def test_modify_retries(self):
+        entry = self.accounts.get_row(id=1)
+        calls = []
+
+        def withdraw(account):
+            calls.append(account["balance"])
+            if len(calls) == 1:  # Another writer gets in between the read and the write
+                self.other_accounts.get_row(id=1).set(balance=account["balance"] - 30)
+            account["balance"] = account["balance"] - 20
+
+        entry.modify(withdraw)
+        self.assertEqual(calls, [100, 70])
+        self.assertEqual(self.database.get("SELECT balance, row_version FROM accounts"), [(50, 2)])
+
+        def always_conflicts(account):
+            calls.append(account["balance"])
+            self.other_accounts.get_row(id=1).set(owner=f"eve{len(calls)}")
+            account["balance"] = 0
+
+        self.assertRaises(ConflictError, entry.modify, always_conflicts, attempts=2)
+        self.assertRaises(ValueError, self.database.create_table("logs", {"line": "TEXT"}).enable_versioning)